@@ -9,23 +9,98 @@ MYSQL_CONFIG = {
     'host': 'localhost',
     'user': 'root',
     'password': '',  # Update if you have a password
-    'database': 'info_db'
+    'database': 'info_db',
+    'compress': True  # Compressed protocol (C extension is used automatically when installed)
 }
 
+# MySQL read replicas - overrides of MYSQL_CONFIG, tried in order when ETL_CONFIG['read_from_replica'] is on
+# The user needs REPLICATION CLIENT for the lag check (SHOW REPLICA STATUS)
+MYSQL_REPLICAS = [
+    # {'host': 'mysql-replica-1'},
+]
+
 # ClickHouse Configuration
 CH_CONFIG = {
     'host': 'localhost',
     'port': 8123,
     'username': 'default',
     'password': '',  # Update if you have a password
-    'database': 'main_data'
+    'database': 'main_data',
+    'compress': 'lz4'  # Insert/query compression: 'lz4', 'zstd' or False
 }
 
 # ETL Configuration
 ETL_CONFIG = {
     'batch_size': 500,  # Process 500 events at a time
     'sync_interval': 300,  # 5 minutes in seconds
-    'tracking_file': 'logs/last_sync_id.txt'  # Store last synced order_log_id
+    'scheduler_mode': 'daemon',  # 'daemon' (in-process, persistent connections), 'poll' or 'subprocess'
+    'poll_min_interval': 1,  # poll mode: seconds between MAX(order_log_id) checks while events flow
+    'poll_max_interval': 60,  # poll mode: back-off ceiling while idle
+    'poll_coalesce_seconds': 2,  # poll mode: wait this long when fewer than batch_size rows are pending
+    'full_load_batch_size': 10000,  # Rows per keyset page during the full load
+    'backfill_shards': 8,  # order_log_id ranges for the parallel backfill
+    'backfill_workers': 4,  # Shards loaded concurrently (1 MySQL + 1 ClickHouse connection each)
+    'backfill_state_file': 'logs/backfill_state.json',  # Per-shard progress for resuming
+    'tracking_file': 'logs/last_sync_id.txt',  # Store last synced order_log_id
+    'checkpoint_table': None,  # e.g. 'etl_state' - also keep the checkpoint in ClickHouse
+    'schema_check_interval': 600,  # Seconds a cached DESCRIBE is trusted before re-checking its fingerprint
+    'orders_cache': False,  # Extract only order_logs rows and copy orders columns from an in-memory cache
+    'orders_cache_size': 200000,  # Max orders kept in the cache (least recently used are evicted)
+    'order_updates': False,  # Also rewrite synced events of orders changed since the updated_at watermark
+    'order_updates_file': 'logs/orders_updated_at.json',  # (updated_at, order_id) watermark of that stream
+    'order_updates_batch_size': 1000,  # Changed orders per batch
+    'order_updates_lag_seconds': 5,  # Leave the newest updates for the next run (transactions still committing)
+    'unmapped_status_policy': 'pass',  # order_status_ids not in EVENT_TYPE_MAPPING: 'pass', 'drop' or 'quarantine'
+    'quarantine_file': 'logs/quarantine_events.jsonl',  # Where 'quarantine' appends those rows
+    'metrics_file': 'logs/metrics.jsonl',  # One JSON line per run (and batch) with per-stage timings; None to disable
+    'metrics_port': None,  # e.g. 9108 - the scheduler serves Prometheus metrics on /metrics
+    'profile_dir': 'logs/profiles',  # Where etl_events_main.py --profile writes its dumps
+    'bench_baseline_file': 'logs/bench_baseline.json',  # etl_bench.py --save-baseline results (per machine)
+    'rollups': False,  # Keep the ROLLUPS tables current: 'load' (aggregate each loaded block) or 'view' (materialized views)
+    'rollups_stale_file': 'logs/rollups_stale_months.json',  # Months rewritten events left for `etl_rollups.py rebuild --stale`
+    'reconcile_recent': True,  # After each sync, compare per-range counts/checksums for the ids it wrote
+    'reconcile_range_size': 100000,  # order_log_ids per reconciliation range
+    'reconcile_repair': False,  # Re-insert events found missing from ClickHouse
+    'insert_block_rows': 100000,  # Coalesce small batches into inserts of at least this many rows...
+    'insert_block_mb': 128,  # ...or this much memory (fewer, bigger parts to merge)
+    'async_insert': False,  # Let the server buffer inserts (async_insert=1)
+    'wait_for_async_insert': True,  # ...and only return once the buffer is flushed
+    'insert_workers': 2,  # Concurrent inserts during the full load (one client each)
+    'staging': False,  # Write each block to a local Native file and ship that (survives ClickHouse outages)
+    'staging_dir': 'logs/staging',  # Staged files, named <scope>_<after_id>_<last_id>.native.gz
+    'staging_max_mb': 2048,  # Stop extracting once this much is staged and ClickHouse still fails
+    'streaming_extract': False,  # Read each batch from an unbuffered cursor and transform it chunk by chunk
+    'stream_chunk_rows': 10000,  # Rows per chunk - caps raw-row memory regardless of batch_size
+    'narrow_dtypes': False,  # Transformed batches in the smallest dtype per ClickHouse type (categories for repeated strings)
+    'columnar_fast_path': False,  # Skip pandas: unbuffered cursor → NumPy columns → column-oriented insert
+    'pipelined': False,  # Overlap extract/transform/load across several batches per run
+    'pipeline_queue_size': 2,  # Batches buffered between stages (caps memory)
+    'pipeline_max_batches': 20,  # Batches per pipelined run (when catch_up is off)
+    'catch_up': True,  # Keep syncing until the MySQL head (or max_run_seconds) each run
+    'max_run_seconds': 240,  # Time budget per run - keep below sync_interval
+    'min_batch_size': 500,  # Adaptive batch size bounds in catch-up mode
+    'max_batch_size': 50000,
+    'target_batch_seconds': 10,  # Shrink the batch when one takes longer than this
+    'max_batch_memory_mb': 256,  # ...or when its DataFrame is bigger than this
+    'read_from_replica': False,  # Extract from the first of MYSQL_REPLICAS within replica_max_lag_seconds
+    'replica_max_lag_seconds': 30,  # ...and stop reading (until the next run) once it is further behind
+    'replica_fallback_primary': False,  # With no replica within the limit, read the primary instead of failing
+    'throttle': False,  # Pause between extraction queries while MySQL is busy (doubling up to throttle_max_sleep)
+    'throttle_threads_running': 32,  # Busy: Threads_running above this...
+    'throttle_latency_factor': 3,  # ...or a query's seconds per row above this × the best seen this run
+    'throttle_max_sleep': 30,
+    'force_index': False,  # Pin extraction to the order_log_id primary key (FORCE INDEX + STRAIGHT_JOIN)
+    'pipeline_workers': 4,  # scripts/etl_pipelines.py: pipelines synced at the same time
+    'max_mysql_connections': 4,  # ...and MySQL / ClickHouse connections open at once across all of them
+    'max_clickhouse_connections': 4,
+}
+
+# CDC (binlog) Configuration - used by scripts/etl_events_cdc.py
+CDC_CONFIG = {
+    'server_id': 4379,  # Unique replication client id (must not clash with real replicas)
+    'position_file': 'logs/cdc_position.json',  # Last applied binlog file + position
+    'max_events': 5000,  # Row events applied per batch (cut at the next transaction end)
+    'poll_interval': 1  # Seconds to wait when the binlog has nothing new
 }
 
 # Event Type Mapping: order_status_id → event_type
@@ -42,4 +117,66 @@ EVENT_TYPE_MAPPING = {
     11: 11, # Payment Refund
     12: 12, # Payment Pending
     14: 14  # Address Update Pending
-}
\ No newline at end of file
+}
+
+# orders columns copied onto each event (order_logs supplies the rest)
+ORDER_COLUMNS = [
+    'order_number', 'order_type_id', 'customer_id', 'segment_id',
+    'customer_type', 'is_first_order', 'is_favourite_order', 'new_customer_foc',
+    'grand_total', 'vat', 'delivery_fee', 'discount',
+    'wallet_amount', 'wallet_discount', 'wallet_cashback', 'is_cash_back',
+    'invoice_amount', 'payment_method_id', 'promocode_id', 'promotion_id',
+    'coupon_quantity', 'reward', 'qitaf_rewardpoints',
+    'delivery_date', 'delivery_time', 'delivery_type', 'delivered_quantity',
+    'country_id', 'city_id', 'area_id', 'store_id', 'sale_office_id',
+    'route_id', 'agent_id', 'address_id', 'source_id', 'channel_id',
+    'sub_channel_id', 'device_type', 'app_version',
+    'total_items_quantity', 'total_unique_item_count',
+    'gift_item_quantity', 'foc_item_quantity',
+    'is_recurring', 'is_split_order', 'corporate_invoice', 'loyalty_programs',
+    'is_bfm_customer', 'order_customer_bfm_club_id', 'is_stc_tayamouz_customer',
+    'fulfilment_id', 'invoice_date', 'created_at', 'updated_at'
+]
+
+# events_data layout - scripts/etl_schema.py creates the table, or migrates an existing one, to this
+EVENTS_TABLE = {
+    'engine': 'ReplacingMergeTree(version)',  # Copies of an event_id merge to the newest version (order_updates, replays)
+    'partition_by': 'toYYYYMM(event_timestamp)',  # Monthly parts: date filters skip whole months
+    'order_by': 'event_id',  # Keyset ranges, the high-water mark and reconcile ranges read the primary key
+    'lookup_columns': ['order_id', 'customer_id'],  # Point lookups served by...
+    'lookup_index': 'bloom_filter',  # ...a bloom_filter skip index, a 'projection' per column (full copy each), or None
+    'settings': {'non_replicated_deduplication_window': 1000},  # Keeps insert tokens (crash-safe checkpoints)
+}
+
+# Pipelines - MySQL table → ClickHouse table syncs run by scripts/etl_pipelines.py
+# Omitted keys take their defaults from scripts/etl_pipelines.py (PIPELINE_DEFAULTS)
+PIPELINES = {
+    # The order_logs ⋈ orders sync of etl_events_main.py - same checkpoint and
+    # insert tokens, so either script can run it (not both at once)
+    'events': {
+        'mysql': {},  # Overrides of MYSQL_CONFIG, e.g. {'host': 'shard-2', 'database': 'info_db_2'}
+        'replicas': MYSQL_REPLICAS,  # Read from these when read_from_replica is on
+        'source': 'order_logs',
+        'key': 'order_log_id',  # Increasing, indexed id the sync pages on
+        'columns': {  # Source column → ClickHouse column
+            'order_log_id': 'event_id',
+            'order_id': 'order_id',
+            'order_status_id': 'order_status_id',
+            'created_at': 'event_timestamp'
+        },
+        'join': {'table': 'orders', 'on': 'order_id', 'columns': ORDER_COLUMNS},  # INNER JOIN, names kept
+        'event_type': 'order_status_id',  # Mapped through EVENT_TYPE_MAPPING into event_type
+        'target': 'events_data',
+        'batch_size': ETL_CONFIG['batch_size'],
+        'tracking_file': ETL_CONFIG['tracking_file'],
+        'checkpoint_key': 'events_data',  # Row in checkpoint_table
+        'dedup_scope': None  # Insert token scope (None = the tokens etl_events_main.py uses)
+    },
+}
+
+# Rollups - pre-aggregated events_data for dashboards (scripts/etl_rollups.py)
+# One row per day × event_type × dimensions with the event count and the sum of each column in 'sums'
+ROLLUPS = {
+    'events_daily_city': {'dimensions': ['city_id'], 'sums': ['grand_total']},
+    'events_daily_channel': {'dimensions': ['channel_id'], 'sums': ['grand_total']},
+}
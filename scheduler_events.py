@@ -1,18 +1,98 @@
 #!/usr/bin/env python3
 # scheduler_events.py
 """
-Scheduler - Runs events ETL every 5 minutes
+Scheduler - Runs events ETL every ETL_CONFIG['sync_interval'] seconds
+
+Modes:
+  daemon     - imports the ETL once and runs it in-process over persistent,
+               health-checked MySQL/ClickHouse connections (default)
+  poll       - like daemon, but checks MAX(order_log_id) and syncs as soon as
+               new rows appear, backing off exponentially while idle
+  subprocess - starts a fresh scripts/etl_events_main.py for every run
+  pipelines  - runs every enabled pipeline in config.PIPELINES concurrently
+               (scripts/etl_pipelines.py), each over its own connections
 """
 
+import argparse
+import signal
+import threading
 import time
 import subprocess
 import sys
 from datetime import datetime
 
+from config.config import CH_CONFIG, ETL_CONFIG
+
+stop_event = threading.Event()
+
 def log(message):
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     print(f"[{timestamp}] {message}", flush=True)
 
+def handle_stop(signum, frame):
+    log(f"Received {signal.Signals(signum).name} - stopping after the current batch")
+    stop_event.set()
+
+class EtlConnections:
+    """
+    Keeps one MySQL connection and one ClickHouse client open between runs
+    Each is health-checked before use and re-created if it went away
+    """
+
+    def __init__(self):
+        self._mysql = None
+        self._ch = None
+
+    def mysql(self):
+        import mysql.connector
+        from scripts.etl_source import connect_source, replica_ok
+        if self._mysql is not None:
+            try:
+                self._mysql.ping(reconnect=True, attempts=3, delay=2)
+                # A replica that fell behind is swapped for one that didn't
+                if not ETL_CONFIG['read_from_replica'] or replica_ok(self._mysql):
+                    return self._mysql
+                log("⚠ MySQL replica too far behind - reconnecting")
+            except mysql.connector.Error as e:
+                log(f"⚠ MySQL connection lost ({e}) - reconnecting")
+            self._close_mysql()
+        self._mysql = connect_source()
+        # Without autocommit the REPEATABLE READ snapshot from the first query
+        # would hide every row inserted after it for the life of the connection
+        self._mysql.autocommit = True
+        return self._mysql
+
+    def clickhouse(self):
+        import clickhouse_connect
+        if self._ch is not None:
+            if self._ch.ping():
+                return self._ch
+            log("⚠ ClickHouse connection lost - reconnecting")
+            self._close_ch()
+        self._ch = clickhouse_connect.get_client(**CH_CONFIG)
+        return self._ch
+
+    def reset(self):
+        """Drop both connections so the next run starts fresh"""
+        self._close_mysql()
+        self._close_ch()
+
+    def _close_mysql(self):
+        if self._mysql is not None:
+            try:
+                self._mysql.close()
+            except Exception:
+                pass
+            self._mysql = None
+
+    def _close_ch(self):
+        if self._ch is not None:
+            try:
+                self._ch.close()
+            except Exception:
+                pass
+            self._ch = None
+
 def run_etl():
     log("="*70)
     log("Running Events ETL...")
@@ -34,22 +114,140 @@ def run_etl():
     
     log("="*70)
 
+def make_in_process_runner():
+    """Import the ETL once and return a run function bound to persistent connections"""
+    from scripts.etl_events_main import run_sync
+
+    connections = EtlConnections()
+
+    def run_etl_in_process():
+        log("="*70)
+        log("Running Events ETL (in-process)...")
+        started = time.monotonic()
+        try:
+            run_sync(connections.clickhouse(), connections.mysql(), stop_event)
+            log(f"✓ ETL completed successfully in {time.monotonic() - started:.2f}s")
+        except Exception as e:
+            log(f"✗ ETL failed: {e}")
+            import traceback
+            traceback.print_exc()
+            connections.reset()
+        log("="*70)
+
+    return run_etl_in_process, connections
+
+def run_pipelines_job():
+    from scripts.etl_pipelines import run_pipelines
+
+    log("="*70)
+    log("Running pipelines...")
+    started = time.monotonic()
+    results = run_pipelines(stop_event=stop_event)
+    failed = [name for name, result in results.items() if isinstance(result, Exception)]
+    if failed:
+        log(f"✗ Pipelines failed: {', '.join(failed)}")
+    else:
+        log(f"✓ {len(results)} pipelines completed in {time.monotonic() - started:.2f}s")
+    log("="*70)
+
+def run_every(interval, job):
+    """
+    Run job on a fixed grid of start + k * interval, so run time does not
+    push later runs back; runs that would overlap are skipped
+    """
+    started = time.monotonic()
+    while not stop_event.is_set():
+        job()
+        if stop_event.is_set():
+            break
+        ticks = int((time.monotonic() - started) // interval) + 1
+        next_run = started + ticks * interval
+        wait = next_run - time.monotonic()
+        log(f"Next run at {datetime.fromtimestamp(time.time() + wait).strftime('%H:%M:%S')}")
+        # Wakes up immediately on SIGTERM/SIGINT
+        stop_event.wait(wait)
+
+def poll_for_events(connections, job):
+    """
+    Sync as soon as MySQL has rows past the checkpoint
+    The poll itself is a single MAX() on the order_logs primary key; while
+    idle, or when a run doesn't move the checkpoint, the interval doubles from
+    poll_min_interval up to poll_max_interval
+    """
+    from scripts.etl_events_main import get_head_id, get_last_synced_id
+
+    min_interval = ETL_CONFIG['poll_min_interval']
+    max_interval = ETL_CONFIG['poll_max_interval']
+    coalesce_seconds = ETL_CONFIG['poll_coalesce_seconds']
+    interval = min_interval
+
+    while not stop_event.is_set():
+        try:
+            head_id = get_head_id(connections.mysql())
+            pending = head_id - get_last_synced_id(quiet=True)
+        except Exception as e:
+            log(f"✗ Poll failed: {e}")
+            connections.reset()
+            pending = 0
+
+        if pending > 0:
+            # A small trickle waits briefly so a burst lands in one batch
+            if pending < ETL_CONFIG['batch_size'] and coalesce_seconds > 0:
+                stop_event.wait(coalesce_seconds)
+            log(f"New events found - lag: {pending:,} ids (head: {head_id})")
+            checkpoint = head_id - pending
+            job()
+            try:
+                moved = get_last_synced_id(quiet=True) > checkpoint
+            except Exception as e:
+                log(f"✗ Poll failed: {e}")
+                moved = False
+            # A run that couldn't move the checkpoint (e.g. a failing load) backs off too
+            interval = min_interval if moved else min(interval * 2, max_interval)
+        else:
+            interval = min(interval * 2, max_interval)
+
+        stop_event.wait(interval)
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Events ETL scheduler")
+    parser.add_argument('--mode', choices=['daemon', 'poll', 'subprocess', 'pipelines'],
+                        default=ETL_CONFIG['scheduler_mode'])
+    args = parser.parse_args()
+
+    interval = ETL_CONFIG['sync_interval']
+    signal.signal(signal.SIGTERM, handle_stop)
+    signal.signal(signal.SIGINT, handle_stop)
+
     log("="*70)
-    log("EVENTS ETL SCHEDULER - Every 5 minutes")
+    if args.mode == 'poll':
+        log(f"EVENTS ETL SCHEDULER - Polling every {ETL_CONFIG['poll_min_interval']}-{ETL_CONFIG['poll_max_interval']} seconds")
+    else:
+        log(f"EVENTS ETL SCHEDULER - Every {interval} seconds ({args.mode} mode)")
     log("Press Ctrl+C to stop")
     log("="*70)
-    
-    # Run immediately
-    run_etl()
-    
-    # Then every 5 minutes
+
+    # Runs in subprocess mode record their metrics in their own process (metrics_file only)
+    if ETL_CONFIG['metrics_port'] and args.mode != 'subprocess':
+        from scripts.etl_metrics import serve
+        serve(ETL_CONFIG['metrics_port'])
+        log(f"Metrics on http://127.0.0.1:{ETL_CONFIG['metrics_port']}/metrics")
+
+    connections = None
+    if args.mode == 'subprocess':
+        job = run_etl
+    elif args.mode == 'pipelines':
+        job = run_pipelines_job
+    else:
+        job, connections = make_in_process_runner()
+
     try:
-        while True:
-            next_run = datetime.fromtimestamp(datetime.now().timestamp() + 300)
-            log(f"Next run at {next_run.strftime('%H:%M:%S')}")
-            time.sleep(300)
-            run_etl()
-    except KeyboardInterrupt:
-        log("\nScheduler stopped by user")
-        sys.exit(0)
\ No newline at end of file
+        if args.mode == 'poll':
+            poll_for_events(connections, job)
+        else:
+            run_every(interval, job)
+    finally:
+        if connections is not None:
+            connections.reset()
+        log("Scheduler stopped")
+    sys.exit(0)
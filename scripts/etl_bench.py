@@ -0,0 +1,435 @@
+"""
+ETL Benchmark
+Runs the incremental sync end to end against local stand-ins - a fake MySQL
+connection serving synthetic order_logs ⋈ orders rows and a ClickHouse client
+that serializes every insert to Native (as the real client would) and records
+the bytes - so a change to extract/transform/load can be measured without
+touching a database.
+
+The synthetic orders have every ORDER_COLUMNS column with MySQL-like values:
+DECIMAL money as Decimal, DATE/DATETIME objects next to string dates in mixed
+formats, and NULLs. Each (mode, rows) case runs in its own process so peak RSS
+is that case's alone. Building the fake rows counts toward extract, so numbers
+are for comparing modes and changes, not for predicting production throughput.
+
+Usage:
+  python3 scripts/etl_bench.py                               # 10k and 100k, all modes
+  python3 scripts/etl_bench.py --rows 10000 100000 1000000 --modes pandas columnar --repeat 1
+  python3 scripts/etl_bench.py --save-baseline               # later runs compare against it
+"""
+
+import argparse
+import contextlib
+import json
+import operator
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from datetime import datetime, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import ETL_CONFIG
+
+MODES = {
+    'pandas': {},
+    'narrow': {'narrow_dtypes': True},
+    'stream': {'streaming_extract': True},
+    'columnar': {'columnar_fast_path': True},
+    'columnar-narrow': {'columnar_fast_path': True, 'narrow_dtypes': True},
+    'cache': {'columnar_fast_path': True, 'orders_cache': True},
+    'pipelined': {'columnar_fast_path': True, 'pipelined': True},
+}
+
+DEFAULT_ROWS = [10000, 100000]
+
+MONEY_COLUMNS = {
+    'grand_total', 'vat', 'delivery_fee', 'discount', 'wallet_amount', 'wallet_discount',
+    'wallet_cashback', 'invoice_amount', 'reward', 'qitaf_rewardpoints'
+}
+TEXT_COLUMNS = {
+    'order_number', 'customer_type', 'delivery_type', 'device_type', 'app_version',
+    'corporate_invoice', 'loyalty_programs', 'delivery_time'
+}
+DATE_COLUMNS = {'delivery_date', 'invoice_date'}
+DATETIME_COLUMNS = {'created_at', 'updated_at'}
+
+def bench_schema(order_columns):
+    """events_data as the ETL sees it from DESCRIBE: ids, flags, money, text, dates"""
+    schema = [
+        ('event_id', 'UInt64'),
+        ('order_id', 'UInt64'),
+        ('event_type', 'UInt8'),
+        ('order_status_id', 'UInt8'),
+        ('event_timestamp', 'DateTime'),
+    ]
+    for col in order_columns:
+        if col in MONEY_COLUMNS:
+            schema.append((col, 'Float64'))
+        elif col in TEXT_COLUMNS:
+            schema.append((col, 'String'))
+        elif col in DATE_COLUMNS:
+            schema.append((col, 'Nullable(Date)'))
+        elif col in DATETIME_COLUMNS:
+            schema.append((col, 'Nullable(DateTime)'))
+        else:
+            schema.append((col, 'UInt32'))
+    return schema
+
+def synthetic_order(order_id, order_columns):
+    """One orders row (without order_id) - deterministic in order_id"""
+    k = order_id * 2654435761 % 2**32  # cheap reproducible hash
+    created = datetime(2024, 1, 1) + timedelta(seconds=k % (365 * 86400))
+    values = []
+    for i, col in enumerate(order_columns):
+        h = (k >> (i % 24)) + i
+        if h % 11 == 0 and col not in ('order_number', 'created_at'):
+            values.append(None)  # ~9% NULLs everywhere
+        elif col == 'order_number':
+            values.append(f"ORD{order_id:09d}")
+        elif col in MONEY_COLUMNS:
+            values.append(Decimal(h % 100000) / 100)
+        elif col in DATE_COLUMNS:
+            day = created.date() + timedelta(days=h % 5)
+            # The same column holds DATE values and legacy string formats
+            values.append((day, day.isoformat(), day.strftime('%Y/%m/%d 00:00'))[h % 3])
+        elif col in DATETIME_COLUMNS:
+            values.append(created if col == 'created_at' else created + timedelta(hours=h % 48))
+        elif col == 'delivery_time':
+            values.append(f"{8 + h % 12:02d}:00-{10 + h % 12:02d}:00")
+        elif col in TEXT_COLUMNS:
+            values.append(('ios', 'android', 'web', 'standard', 'express', 'new', 'old')[h % 7])
+        elif col.startswith('is_') or col in ('new_customer_foc',):
+            values.append(h % 2)
+        else:
+            values.append(h % 5000)
+    return tuple(values)
+
+class FakeMySQL:
+    """
+    Connection stand-in holding `rows` order_logs (ids 1..rows) over a pool of
+    orders; answers the queries the sync issues, rows built on demand
+    """
+
+    def __init__(self, rows, order_columns, orders=20000):
+        self.rows = rows
+        self.order_columns = list(order_columns)
+        self.orders = [None] + [synthetic_order(i, self.order_columns) for i in range(1, orders + 1)]
+        self.num_orders = orders
+        self.base = datetime(2024, 1, 1)
+
+    def log_row(self, log_id):
+        """(order_log_id, order_id, order_status_id, created_at)"""
+        return (log_id, log_id * 7919 % self.num_orders + 1, log_id * 31 % 14 + 1,
+                self.base + timedelta(seconds=log_id))
+
+    def cursor(self, *args, **kwargs):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+SELECTED = re.compile(r'\b(ol|o)\.(\w+)(?:\s+as\s+(\w+))?', re.IGNORECASE)
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.description = None
+        self._rows = iter(())
+
+    def execute(self, query, params=None):
+        db = self.db
+        params = list(params or ())
+        if 'information_schema' in query:
+            self._result([('fingerprint',)], [(len(db.order_columns) + 1, 1)])
+        elif query.startswith('DESCRIBE'):
+            self._result([('Field',)], [(col,) for col in ['order_id'] + db.order_columns])
+        elif 'MAX(order_log_id)' in query:
+            self._result([('max',)], [(db.rows,)])
+        elif 'UTC_TIMESTAMP()' in query:
+            self._result([('offset',)], [(0,)])
+        elif 'MAX(updated_at)' in query:
+            self._result([('max',)], [(db.base,)])
+        elif 'FROM orders WHERE updated_at' in query:
+            self._result([('order_id',), ('updated_at',)], [])  # orders never change mid-benchmark
+        elif 'FROM orders WHERE order_id IN' in query:
+            cols = [c.strip() for c in query.split('SELECT', 1)[1].split('FROM', 1)[0].split(',')]
+            pick = operator.itemgetter(*[db.order_columns.index(c) for c in cols[1:]])
+            self._result([(c,) for c in cols],
+                         [(order_id,) + _as_tuple(pick(db.orders[order_id])) for order_id in params])
+        elif 'FROM order_logs' in query:
+            self._logs(query, params)
+        else:
+            raise NotImplementedError(f"FakeMySQL can't answer: {query.strip()[:80]}")
+
+    def _result(self, description, rows):
+        self.description = description
+        self._rows = iter(rows)
+
+    def _logs(self, query, params):
+        """The keyset page: WHERE order_log_id > %s [AND <= %s] [AND status IN (...)] LIMIT %s"""
+        db = self.db
+        select = query.split('FROM', 1)[0]
+        names, picks = [], []
+        for table, col, alias in SELECTED.findall(select):
+            names.append(alias or col)
+            if table == 'ol':
+                picks.append(('order_log_id', 'order_id', 'order_status_id', 'created_at').index(col))
+            else:
+                picks.append(4 + db.order_columns.index(col))
+        after_id, limit = params[0], params[-1]
+        end_id = params[1] if len(params) == 3 else db.rows
+        statuses = re.search(r'order_status_id IN \(([\d, ]+)\)', query)
+        statuses = set(int(s) for s in statuses.group(1).split(',')) if statuses else None
+        joined = 'JOIN orders' in query
+        pick = operator.itemgetter(*picks)
+
+        def rows():
+            sent = 0
+            for log_id in range(after_id + 1, min(end_id, db.rows) + 1):
+                if sent >= limit:
+                    return
+                log = db.log_row(log_id)
+                if statuses is not None and log[2] not in statuses:
+                    continue
+                sent += 1
+                yield pick(log + db.orders[log[1]]) if joined else pick(log)
+
+        self._result([(name,) for name in names], rows())
+
+    def fetchone(self):
+        return next(self._rows, None)
+
+    def fetchmany(self, size=1):
+        return [row for _, row in zip(range(size), self._rows)]
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def close(self):
+        pass
+
+def _as_tuple(value):
+    return value if isinstance(value, tuple) else (value,)
+
+class RecordingClickHouse:
+    """
+    ClickHouse client stand-in: DESCRIBE answers with `schema`, inserts are
+    serialized to Native like the real client does and only counted
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.types = dict(schema)
+        self.rows = 0
+        self.bytes = 0
+        self.inserts = 0
+        self.crc = 0  # of everything inserted - equal across modes that load the same data
+
+    def query(self, query, parameters=None, **kwargs):
+        if 'system.columns' in query:
+            return SimpleNamespace(result_rows=[(len(self.schema), 1)])
+        if query.startswith('DESCRIBE'):
+            return SimpleNamespace(result_rows=list(self.schema))
+        return SimpleNamespace(result_rows=[])
+
+    def command(self, query, **kwargs):
+        return None
+
+    def insert_df(self, table, df, settings=None, **kwargs):
+        names = list(df.columns)
+        return self._record(table, names, [self.types[name] for name in names], df, False)
+
+    def insert(self, table, data, column_names=None, column_type_names=None, column_oriented=False,
+               settings=None, **kwargs):
+        return self._record(table, column_names, column_type_names, data, column_oriented)
+
+    def _record(self, table, names, type_names, data, column_oriented):
+        from clickhouse_connect.datatypes.registry import get_from_name
+        from clickhouse_connect.driver.insert import InsertContext
+        from clickhouse_connect.driver.transform import NativeTransform
+        context = InsertContext(table, names, [get_from_name(t) for t in type_names], data,
+                                column_oriented=column_oriented)
+        written = 0
+        for i, block in enumerate(NativeTransform().build_insert(context)):
+            block = bytes(block)
+            if i == 0:
+                block = block.split(b" FORMAT Native\n", 1)[1]  # the INSERT statement
+            written += len(block)
+            self.crc = zlib.crc32(block, self.crc)
+        if context.insert_exception is not None:
+            raise context.insert_exception
+        self.rows += context.row_count
+        self.bytes += written
+        self.inserts += 1
+        return SimpleNamespace(written_rows=context.row_count, written_bytes=lambda: written)
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(int(q / 100 * len(values)), len(values) - 1)]
+
+def run_case(mode, rows, batch_size, repeat=1):
+    """
+    Sync `rows` events from scratch `repeat` times in this process; returns the
+    result dict of the fastest run (the least disturbed by the rest of the machine)
+    """
+    import scripts.etl_events_main as etl
+    from scripts.etl_metrics import collect_samples, peak_rss_mb, take_samples
+
+    workdir = tempfile.mkdtemp(prefix='etl-bench-')
+    ETL_CONFIG.update(
+        metrics_file=None,
+        quarantine_file=os.path.join(workdir, 'quarantine.jsonl'),
+        staging_dir=os.path.join(workdir, 'staging'),
+        checkpoint_table=None, staging=False, order_updates=False, reconcile_recent=False,
+        streaming_extract=False, columnar_fast_path=False, orders_cache=False, pipelined=False, narrow_dtypes=False,
+        catch_up=True, max_run_seconds=10**9,
+        batch_size=batch_size, min_batch_size=batch_size, max_batch_size=batch_size,
+        insert_block_rows=batch_size, pipeline_max_batches=10**9
+    )
+    ETL_CONFIG.update(MODES[mode])
+
+    conn = FakeMySQL(rows, etl.ORDER_COLUMNS)
+    ch_client = RecordingClickHouse(bench_schema(etl.ORDER_COLUMNS))
+    base_rss = peak_rss_mb()
+
+    best = None
+    for attempt in range(repeat):
+        ETL_CONFIG['tracking_file'] = os.path.join(workdir, f"last_sync_id-{attempt}.txt")
+        ch_client = RecordingClickHouse(ch_client.schema)
+        collect_samples()
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            synced = etl.run_sync(ch_client, conn)
+        seconds = time.perf_counter() - started
+        samples = take_samples()
+        collect_samples(False)
+        if best is None or seconds < best[0]:
+            best = (seconds, synced, samples, ch_client)
+    seconds, synced, samples, ch_client = best
+
+    stages = {}
+    for name in sorted({name for name, _, _ in samples}):
+        # Percentiles over calls that handled rows (not the empty read that ends a run)
+        walls = [wall * 1000 for stage, wall, n in samples if stage == name and n]
+        stages[name] = {
+            'calls': len(walls),
+            'p50_ms': round(percentile(walls, 50), 2),
+            'p95_ms': round(percentile(walls, 95), 2),
+            'p99_ms': round(percentile(walls, 99), 2),
+            'total_s': round(sum(wall for stage, wall, _ in samples if stage == name), 3),
+        }
+    return {
+        'mode': mode,
+        'rows': rows,
+        'repeat': repeat,
+        'synced': synced,
+        'seconds': round(seconds, 3),
+        'rows_per_s': round(synced / max(seconds, 1e-9)),
+        'loaded_rows': ch_client.rows,
+        'native_mb': round(ch_client.bytes / 1024 / 1024, 2),
+        'native_crc': f"{ch_client.crc:08x}",
+        'base_rss_mb': round(base_rss, 1),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'stages': stages,
+    }
+
+def run_isolated(mode, rows, batch_size, repeat):
+    """run_case in a fresh interpreter, so peak RSS isn't inherited from other cases"""
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--case', mode, str(rows),
+         '--batch-size', str(batch_size), '--repeat', str(repeat)],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"{mode}/{rows} failed:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def compare(result, baseline, tolerance):
+    """Lines describing how far result moved from its baseline, ⚠ past tolerance"""
+    notes = []
+    for key, higher_is_better in (('rows_per_s', True), ('peak_rss_mb', False), ('native_mb', False)):
+        old, new = baseline.get(key), result[key]
+        if not old:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        mark = "⚠" if worse > tolerance else "✓"
+        notes.append(f"{mark} {key} {old:,} → {new:,} ({change:+.0%})")
+    return notes
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the sync against synthetic data")
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS)
+    parser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES))
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=3, help="runs per case, the fastest is reported")
+    parser.add_argument('--save-baseline', action='store_true', help="store these results as the baseline")
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help="flag changes worse than this fraction against the baseline")
+    parser.add_argument('--case', nargs=2, metavar=('MODE', 'ROWS'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(args.case[0], int(args.case[1]), args.batch_size, args.repeat)))
+        return 0
+
+    from scripts.etl_events_main import log
+
+    log("="*70)
+    log("EVENTS ETL - BENCHMARK")
+    log("="*70)
+
+    try:
+        baseline_file = ETL_CONFIG['bench_baseline_file']
+        baseline = {}
+        if os.path.exists(baseline_file):
+            with open(baseline_file) as f:
+                baseline = json.load(f)
+
+        results = {}
+        for rows in args.rows:
+            for mode in args.modes:
+                result = run_isolated(mode, rows, args.batch_size, args.repeat)
+                key = f"{mode}/{rows}"
+                results[key] = result
+                log(f"\n{key}: {result['rows_per_s']:,} rows/s, {result['seconds']:.2f}s, "
+                    f"peak RSS {result['peak_rss_mb']:.0f} MB ({result['base_rss_mb']:.0f} MB before the sync), "
+                    f"Native {result['native_mb']:.1f} MB (crc {result['native_crc']})")
+                for name, entry in result['stages'].items():
+                    log(f"  {name:<10} p50 {entry['p50_ms']:>9.2f} ms  p95 {entry['p95_ms']:>9.2f} ms  "
+                        f"p99 {entry['p99_ms']:>9.2f} ms  ({entry['calls']} calls, {entry['total_s']:.2f}s)")
+                if result['loaded_rows'] != result['synced'] or result['synced'] == 0:
+                    log(f"  ✗ loaded {result['loaded_rows']} rows, synced {result['synced']}")
+                if key in baseline:
+                    for note in compare(result, baseline[key], args.tolerance):
+                        log(f"  {note}")
+
+        if args.save_baseline:
+            baseline.update(results)
+            os.makedirs(os.path.dirname(baseline_file) or '.', exist_ok=True)
+            with open(baseline_file, 'w') as f:
+                json.dump(baseline, f, indent=2, sort_keys=True)
+            log(f"\n✓ Baseline saved to {baseline_file}")
+        return 0
+    except Exception as e:
+        log(f"\n✗ FAILED: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
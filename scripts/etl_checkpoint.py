@@ -0,0 +1,108 @@
+"""
+Checkpoint Storage
+Atomic checkpoint files (temp file + fsync + rename), an optional ClickHouse
+state table, and the pending-batch intent that makes retried inserts
+deduplicate: before a batch is inserted its id range is recorded, so a
+crash between insert and checkpoint replays exactly the same range with the
+same insert_deduplication_token.
+"""
+
+import os
+import threading
+
+class CheckpointError(Exception):
+    """A checkpoint exists but can't be read - never silently restart from 0"""
+
+def write_atomic(path, text):
+    """Replace path with text so readers only ever see the old or the new content"""
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    # Persist the rename itself
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+def read_checkpoint(path):
+    """Last synced id from path, None if there is no checkpoint yet"""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        content = f.read().strip()
+    try:
+        return int(content)
+    except ValueError:
+        raise CheckpointError(f"Corrupt checkpoint in {path}: {content[:50]!r}") from None
+
+def pending_path(tracking_file):
+    return f"{tracking_file}.pending"
+
+def write_pending(tracking_file, after_id, last_id):
+    """Record the id range (after_id, last_id] that is about to be inserted"""
+    write_atomic(pending_path(tracking_file), f"{after_id} {last_id}")
+
+def read_pending(tracking_file):
+    """(after_id, last_id) of the last batch that started inserting, or None"""
+    path = pending_path(tracking_file)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        parts = f.read().split()
+    if len(parts) != 2:
+        return None
+    return int(parts[0]), int(parts[1])
+
+def dedup_settings(table, after_id, last_id, scope=None):
+    """
+    Insert settings that make a retry of the same id range a no-op
+    (ClickHouse keeps recent tokens per table; non-replicated MergeTree
+    tables need non_replicated_deduplication_window > 0)
+    scope separates loads that must not dedup against each other, e.g. a
+    full reload after TRUNCATE re-inserting ranges an earlier run used
+    """
+    prefix = f"{table}:{scope}" if scope else table
+    return {
+        'insert_deduplicate': 1,
+        'insert_deduplication_token': f"{prefix}:{after_id}-{last_id}"
+    }
+
+class ClickHouseCheckpointStore:
+    """Checkpoints kept in a small ReplacingMergeTree table next to the data"""
+
+    _created = set()  # tables this process has created - stores are made per client
+    _created_lock = threading.Lock()
+
+    def __init__(self, ch_client, table):
+        self.ch_client = ch_client
+        self.table = table
+        with self._created_lock:
+            if table in self._created:
+                return
+            self.ch_client.command(f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    pipeline String,
+                    last_id UInt64,
+                    updated_at DateTime64(3) DEFAULT now64(3)
+                )
+                ENGINE = ReplacingMergeTree(updated_at)
+                ORDER BY pipeline
+            """)
+            self._created.add(table)
+
+    def get(self, pipeline):
+        result = self.ch_client.query(
+            f"SELECT argMax(last_id, updated_at), count() FROM {self.table} WHERE pipeline = {{pipeline:String}}",
+            parameters={'pipeline': pipeline}
+        )
+        last_id, rows = result.result_rows[0]
+        return int(last_id) if rows else None
+
+    def save(self, pipeline, last_id):
+        self.ch_client.insert(self.table, [[pipeline, last_id]], column_names=['pipeline', 'last_id'])
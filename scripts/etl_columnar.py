@@ -0,0 +1,196 @@
+"""
+Columnar Fast Path
+Skips DataFrames entirely: rows are fetched from an unbuffered MySQL cursor into
+per-column lists, coerced to the ClickHouse type as whole NumPy arrays, and
+sent with a column-oriented insert with explicit column types (so the client
+never has to DESCRIBE the table or convert a DataFrame back to columns).
+"""
+
+import numpy as np
+import pandas as pd
+
+from scripts.etl_event_types import map_event_types, quarantine, unmapped_policy
+from scripts.etl_transform_plan import NARROW_DTYPES, column_kind, parse_clickhouse_type
+
+RENAMES = {'order_log_id': 'event_id', 'created_at_log': 'event_timestamp'}
+
+class ColumnBatch:
+    """A batch of rows held as {column name: list or NumPy array}"""
+
+    def __init__(self, columns, num_rows, attrs=None):
+        self.columns = columns
+        self.num_rows = num_rows
+        self.attrs = attrs or {}  # batch metadata, like DataFrame.attrs
+
+    @property
+    def empty(self):
+        return self.num_rows == 0
+
+    def __len__(self):
+        return self.num_rows
+
+    def nbytes(self):
+        """Approximate in-memory size: array buffers plus 8-byte list slots"""
+        return sum(
+            col.nbytes if isinstance(col, np.ndarray) else 8 * len(col)
+            for col in self.columns.values()
+        )
+
+def fetch_columns(conn, query, params=None, fetch_size=10000):
+    """Stream a result set from an unbuffered cursor straight into column lists"""
+    cursor = conn.cursor(buffered=False)
+    try:
+        if params is None:
+            cursor.execute(query)
+        else:
+            cursor.execute(query, params)
+        names = [d[0] for d in cursor.description]
+        columns = [[] for _ in names]
+        num_rows = 0
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            for column, values in zip(columns, zip(*rows)):
+                column.extend(values)
+            num_rows += len(rows)
+    finally:
+        cursor.close()
+    return ColumnBatch(dict(zip(names, columns)), num_rows)
+
+def concat_batches(batches):
+    """One ColumnBatch from several with the same columns"""
+    columns = {}
+    for name, first in batches[0].columns.items():
+        parts = [batch.columns[name] for batch in batches]
+        if isinstance(first, np.ndarray):
+            columns[name] = np.concatenate(parts)
+        else:
+            columns[name] = [v for part in parts for v in part]
+    return ColumnBatch(columns, sum(batch.num_rows for batch in batches))
+
+def _float_array(values):
+    try:
+        return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+    except (TypeError, ValueError):
+        # Cold path: some values aren't numeric
+        def to_float(v):
+            try:
+                return float(v)
+            except (TypeError, ValueError):
+                return np.nan
+        return np.fromiter((to_float(v) for v in values), dtype=np.float64, count=len(values))
+
+def _int_array(values):
+    if isinstance(values, np.ndarray):
+        return values.astype(np.int64, copy=False)
+    try:
+        return np.array([0 if v is None else v for v in values], dtype=np.int64)
+    except (TypeError, ValueError, OverflowError):
+        floats = _float_array(values)
+        floats[~np.isfinite(floats)] = 0
+        return floats.astype(np.int64)
+
+def _epoch_array(values, unit):
+    """Epoch seconds (unit 's') or days (unit 'D') as int64, NaT → -1"""
+    # pandas' datetime parser works on the plain list (no DataFrame) and is far
+    # faster than NumPy at converting datetime objects
+    try:
+        stamps = pd.to_datetime(values)
+    except (TypeError, ValueError):
+        # Mixed-format strings go through the same parser as the pandas path
+        stamps = pd.to_datetime(values, format='mixed', errors='coerce')
+    stamps = np.asarray(stamps.values).astype(f'datetime64[{unit}]')
+    epochs = stamps.astype(np.int64)
+    epochs[np.isnat(stamps)] = -1
+    return epochs
+
+def coerce_column(values, type_name):
+    """Convert one column to what the ClickHouse type writes fastest"""
+    base, nullable = parse_clickhouse_type(type_name)
+    kind = column_kind(base)
+    nulls = [v is None for v in values] if nullable else None
+
+    if kind == 'int':
+        column = _int_array(values)
+    elif kind == 'float':
+        column = _float_array(values)
+        if not nullable:
+            column[np.isnan(column)] = 0.0
+    elif kind in ('datetime', 'date'):
+        epochs = _epoch_array(values, 's' if kind == 'datetime' else 'D')
+        if nullable:
+            nulls = list(epochs == -1)
+        epochs[epochs < 0] = 0
+        # Plain ints select the client's integer write path for Date/DateTime
+        column = epochs.tolist()
+    elif kind == 'string':
+        column = ['' if v is None else v if isinstance(v, str) else str(v) for v in values]
+    else:
+        column = list(values)
+
+    if nullable and any(nulls):
+        column = [None if is_null else v for v, is_null in zip(list(column), nulls)]
+    return column
+
+def transform_columns(batch, ch_schema):
+    """Map event_type, rename and coerce every ClickHouse column, in column order"""
+    columns = batch.columns
+    n = batch.num_rows
+
+    event_types, keep = map_event_types(columns['order_status_id'])
+    if keep is not None:
+        # Unmapped statuses under 'drop' / 'quarantine' don't reach events_data
+        rows = np.flatnonzero(keep)
+        if unmapped_policy() == 'quarantine':
+            names = list(columns)
+            skipped = np.flatnonzero(~keep)
+            quarantine(dict(zip(names, (columns[name][i] for name in names))) for i in skipped)
+        columns = {
+            name: values[rows] if isinstance(values, np.ndarray) else [values[i] for i in rows]
+            for name, values in columns.items()
+        }
+        event_types = event_types[rows]
+        n = len(rows)
+
+    columns = {RENAMES.get(name, name): values for name, values in columns.items()}
+    columns['event_type'] = event_types
+
+    out = {}
+    for name, type_name in ch_schema:
+        values = columns.get(name)
+        if values is None:
+            values = [None] * n  # missing column → type default (or NULL)
+        out[name] = coerce_column(values, type_name)
+    return ColumnBatch(out, n, batch.attrs)
+
+def narrow_columns(batch, ch_schema):
+    """
+    Each NumPy column in the narrowest dtype of its ClickHouse type, and equal
+    strings sharing one object (the driver returns a new str per value)
+    ClickHouse gets the same bytes - only the batch's memory shrinks
+    """
+    columns = dict(batch.columns)
+    for name, type_name in ch_schema:
+        values = columns[name]
+        base, _ = parse_clickhouse_type(type_name)
+        if isinstance(values, np.ndarray):
+            dtype = NARROW_DTYPES.get(base)
+            if dtype is not None and values.dtype != dtype:
+                columns[name] = values.astype(dtype)
+        elif column_kind(base) == 'string':
+            seen = {}
+            columns[name] = [seen.setdefault(v, v) for v in values]
+    return ColumnBatch(columns, batch.num_rows, batch.attrs)
+
+def insert_columns(ch_client, batch, ch_schema, table='events_data', settings=None):
+    """Column-oriented insert with explicit types - no DESCRIBE, no DataFrame"""
+    names = [name for name, _ in ch_schema]
+    return ch_client.insert(
+        table,
+        [batch.columns[name] for name in names],
+        column_names=names,
+        column_type_names=[type_name for _, type_name in ch_schema],
+        column_oriented=True,
+        settings=settings
+    )
@@ -0,0 +1,82 @@
+"""
+Event Type Mapping
+EVENT_TYPE_MAPPING is compiled once into a dense NumPy table indexed by
+order_status_id, so mapping a batch is a single take(). Statuses missing
+from the mapping come out as UNMAPPED and are handled by
+ETL_CONFIG['unmapped_status_policy']:
+  'pass'        loaded with event_type = order_status_id (the original behaviour)
+  'drop'        never extracted - the filter is pushed into the SQL WHERE
+  'quarantine'  extracted, but appended to quarantine_file instead of loaded
+"""
+
+import json
+import os
+import threading
+
+import numpy as np
+
+from config.config import ETL_CONFIG, EVENT_TYPE_MAPPING
+
+UNMAPPED = -1
+
+POLICIES = ('pass', 'drop', 'quarantine')
+
+def build_lookup(mapping):
+    """lookup[status] = event_type, UNMAPPED elsewhere, plus a spare UNMAPPED slot at the end"""
+    lookup = np.full(max(mapping) + 2, UNMAPPED, dtype=np.int64)
+    for status, event_type in mapping.items():
+        lookup[status] = event_type
+    return lookup
+
+EVENT_TYPE_LOOKUP = build_lookup(EVENT_TYPE_MAPPING)
+
+_quarantine_lock = threading.Lock()  # pipelines quarantine from several threads
+
+def unmapped_policy():
+    policy = ETL_CONFIG['unmapped_status_policy']
+    if policy not in POLICIES:
+        raise ValueError(f"unmapped_status_policy must be one of {POLICIES}, not {policy!r}")
+    return policy
+
+def _status_array(statuses):
+    """order_status_id as int64, NULL → -1"""
+    if hasattr(statuses, 'to_numpy'):
+        return statuses.to_numpy(dtype=np.int64, na_value=-1)
+    try:
+        return np.asarray(statuses, dtype=np.int64)
+    except TypeError:
+        return np.array([-1 if s is None else s for s in statuses], dtype=np.int64)
+
+def map_event_types(statuses):
+    """
+    (event_type per row, mask of rows to load or None when all are loaded)
+    Statuses past the table clip onto its last slot, which is always UNMAPPED
+    """
+    statuses = _status_array(statuses)
+    event_types = EVENT_TYPE_LOOKUP.take(statuses, mode='clip')
+    unmapped = event_types == UNMAPPED
+    if not unmapped.any():
+        return event_types, None
+    if unmapped_policy() == 'pass':
+        return np.where(unmapped, np.maximum(statuses, 0), event_types), None
+    return event_types, ~unmapped
+
+def quarantine(records):
+    """Append extracted rows (dicts) to quarantine_file as JSON lines"""
+    path = ETL_CONFIG['quarantine_file']
+    lines = "".join(json.dumps(record, default=str) + "\n" for record in records)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with _quarantine_lock, open(path, 'a') as f:
+        f.write(lines)
+
+def _mapped_statuses_sql(column):
+    statuses = ", ".join(str(int(status)) for status in sorted(EVENT_TYPE_MAPPING))
+    return f" AND {column} IN ({statuses})"
+
+def extract_filter_sql(column='ol.order_status_id'):
+    """WHERE addition for extraction queries: under 'drop', unmapped rows are never read"""
+    return _mapped_statuses_sql(column) if unmapped_policy() == 'drop' else ""
+
+def loaded_filter_sql(column='ol.order_status_id'):
+    """WHERE addition matching what events_data holds (for reconciliation)"""
+    return _mapped_statuses_sql(column) if unmapped_policy() != 'pass' else ""
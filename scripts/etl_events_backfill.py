@@ -0,0 +1,197 @@
+"""
+Parallel Backfill - Range-Sharded Initial Load
+Splits the order_log_id space into N ranges and loads them concurrently,
+each shard with its own MySQL connection and ClickHouse client.
+Progress is checkpointed per shard, so a crashed run resumes only the
+unfinished ranges instead of truncating and starting over.
+"""
+
+import argparse
+import json
+import threading
+import time
+import clickhouse_connect
+import sys
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import CH_CONFIG, ETL_CONFIG
+from scripts.etl_transform_plan import get_clickhouse_schema
+from scripts.etl_checkpoint import write_atomic
+from scripts.etl_source import SourceThrottle, connect_source
+from scripts.etl_events_full import (
+    log, get_mysql_columns, iter_event_batches,
+    transform_events, load_events_batch, make_block_coalescer
+)
+
+state_lock = threading.Lock()
+
+def get_id_bounds(conn):
+    """MIN/MAX order_log_id - both answered from the primary key"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT MIN(order_log_id), MAX(order_log_id) FROM order_logs")
+    min_id, max_id = cursor.fetchone()
+    cursor.close()
+    return min_id, max_id
+
+def split_ranges(min_id, max_id, shards):
+    """
+    Split [min_id, max_id] into contiguous shards
+    Each shard covers start < order_log_id <= end
+    """
+    span = max_id - min_id + 1
+    step = -(-span // shards)  # ceil
+    ranges = []
+    start = min_id - 1
+    while start < max_id:
+        end = min(start + step, max_id)
+        ranges.append({'start': start, 'end': end, 'last_id': start, 'done': False})
+        start = end
+    return ranges
+
+def load_state(state_file):
+    if not os.path.exists(state_file):
+        return None
+    with open(state_file, 'r') as f:
+        return json.load(f)
+
+def save_state(state, state_file):
+    """Write the shard state to a temp file and rename it over the old one"""
+    write_atomic(state_file, json.dumps(state, indent=2))
+
+def run_shard(index, state, state_file, ch_schema, batch_size):
+    shard = state['shards'][index]
+    name = f"shard {index + 1}/{len(state['shards'])}"
+    log(f"[{name}] Starting at order_log_id > {shard['last_id']} (end: {shard['end']})")
+
+    conn = connect_source()
+    ch_client = clickhouse_connect.get_client(**CH_CONFIG)
+    loaded = 0
+
+    def commit(last_id):
+        with state_lock:
+            shard['last_id'] = last_id
+            save_state(state, state_file)
+
+    # A resumed shard re-reads the same pages into the same blocks, so retried blocks deduplicate
+    coalescer = make_block_coalescer(
+        lambda block, ids: load_events_batch(block, ch_client, ids[0], state.get('run_id')),
+        commit
+    )
+    try:
+        orders_cols = get_mysql_columns(conn, 'orders')
+        extracted_id = shard['last_id']
+        for df in iter_event_batches(conn, orders_cols, batch_size,
+                                     start_id=shard['last_id'], end_id=shard['end'],
+                                     throttle=SourceThrottle(conn)):
+            # Batches without a matching order still advance the shard
+            batch_last_id = int(df['order_log_id'].iloc[-1])
+            df = transform_events(df, ch_schema)
+            if not df.empty:  # (every row quarantined)
+                coalescer.add(df, (extracted_id, batch_last_id))
+            extracted_id = batch_last_id
+            loaded += len(df)
+        coalescer.flush()
+
+        with state_lock:
+            shard['last_id'] = shard['end']
+            shard['done'] = True
+            save_state(state, state_file)
+    finally:
+        conn.close()
+        ch_client.close()
+
+    log(f"[{name}] ✓ Done - {loaded:,} events loaded")
+    return loaded
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel range-sharded backfill of events_data")
+    parser.add_argument('--shards', type=int, default=ETL_CONFIG['backfill_shards'],
+                        help="number of order_log_id ranges (fresh runs only)")
+    parser.add_argument('--workers', type=int, default=ETL_CONFIG['backfill_workers'],
+                        help="number of shards loaded concurrently")
+    args = parser.parse_args()
+
+    state_file = ETL_CONFIG['backfill_state_file']
+    batch_size = ETL_CONFIG['full_load_batch_size']
+
+    log("="*70)
+    log("EVENTS ETL - PARALLEL BACKFILL")
+    log("="*70)
+
+    try:
+        log("\n[1/4] Connecting to ClickHouse...")
+        ch_client = clickhouse_connect.get_client(**CH_CONFIG)
+        ch_schema = get_clickhouse_schema(ch_client)
+        log(f"✓ ClickHouse table has {len(ch_schema)} columns")
+
+        log("\n[2/4] Planning shards...")
+        state = load_state(state_file)
+        if state is not None:
+            pending = [s for s in state['shards'] if not s['done']]
+            log(f"✓ Resuming backfill: {len(pending)}/{len(state['shards'])} shards unfinished")
+        else:
+            conn = connect_source()
+            min_id, max_id = get_id_bounds(conn)
+            conn.close()
+
+            if min_id is None:
+                log("✓ order_logs is empty - nothing to backfill")
+                return 0
+
+            state = {
+                'run_id': f"backfill-{int(time.time())}",  # dedup token scope, kept across resumes
+                'min_id': min_id,
+                'max_id': max_id,
+                'shards': split_ranges(min_id, max_id, args.shards)
+            }
+            log(f"✓ order_log_id {min_id} to {max_id} → {len(state['shards'])} shards")
+
+            log("Clearing existing data...")
+            ch_client.command("TRUNCATE TABLE events_data")
+            save_state(state, state_file)
+            log("✓ Table truncated")
+
+        log(f"\n[3/4] Loading shards ({args.workers} workers)...")
+        pending = [i for i, s in enumerate(state['shards']) if not s['done']]
+        total = 0
+        failed = 0
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            futures = {
+                pool.submit(run_shard, i, state, state_file, ch_schema, batch_size): i
+                for i in pending
+            }
+            for future in as_completed(futures):
+                try:
+                    total += future.result()
+                except Exception as e:
+                    failed += 1
+                    log(f"✗ Shard {futures[future] + 1} failed: {e}")
+
+        if failed:
+            log(f"\n✗ {failed} shard(s) failed - re-run to resume them ({total:,} events loaded this run)")
+            return 1
+
+        # Every shard is done, so everything up to max_id is in ClickHouse
+        log("\n[4/4] Saving high-water mark...")
+        write_atomic(ETL_CONFIG['tracking_file'], str(state['max_id']))
+        log(f"✓ Saved last_sync_id: {state['max_id']}")
+        os.remove(state_file)
+
+        if ETL_CONFIG['rollups']:
+            log("⚠ Rollups don't follow a reload - rebuild them: python3 scripts/etl_rollups.py rebuild")
+
+        log("\n" + "="*70)
+        log(f"✓ BACKFILL COMPLETED - {total:,} events loaded this run")
+        log("="*70)
+        return 0
+
+    except Exception as e:
+        log(f"\n✗ FAILED: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,335 @@
+"""
+CDC Streaming ETL for Events Data
+Reads MySQL row events for order_logs and orders from the binlog (or from a
+local JSON-lines file for offline testing) and syncs them to events_data:
+  - order_logs INSERT → new event
+  - orders INSERT/UPDATE → corrected copies of that order's existing events
+Progress is checkpointed by binlog position, not by last_sync_id.txt.
+
+Corrections re-use the original event_id and carry orders.updated_at as their
+version, so a ReplacingMergeTree(version) keeps the latest copy.
+
+Usage:
+  python3 scripts/etl_events_cdc.py                         # follow the binlog
+  python3 scripts/etl_events_cdc.py --file events.jsonl --offline --once
+"""
+
+import argparse
+import json
+import time
+import pandas as pd
+import mysql.connector
+import clickhouse_connect
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import MYSQL_CONFIG, CH_CONFIG, CDC_CONFIG, ORDER_COLUMNS
+from scripts.etl_transform_plan import get_clickhouse_schema
+from scripts.etl_checkpoint import dedup_settings, write_atomic
+from scripts.etl_rollups import mark_stale, rollup_mode, update_rollups
+from scripts.etl_events_updates import add_version
+from scripts.etl_events_main import (
+    log, get_mysql_columns,
+    transform_events, load_events
+)
+
+LOG_COLUMNS = ['order_log_id', 'order_id', 'order_status_id', 'created_at_log']
+
+class FileEventSource:
+    """
+    Local stand-in for the binlog: one JSON row event per line, e.g.
+    {"table": "order_logs", "type": "insert", "row": {"order_log_id": 7, ...}}
+    The position is the number of lines already consumed
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def read(self, position, max_events):
+        start = position['log_pos'] if position and position.get('log_file') == self.path else 0
+        events = []
+        with open(self.path, 'r') as f:
+            for line_no, line in enumerate(f, start=1):
+                if line_no <= start or not line.strip():
+                    continue
+                event = json.loads(line)
+                event['position'] = {'log_file': self.path, 'log_pos': line_no}
+                events.append(event)
+                if len(events) >= max_events:
+                    break
+        return events
+
+    def close(self):
+        pass
+
+class BinlogEventSource:
+    """
+    MySQL binlog reader (requires the mysql-replication package and
+    binlog_format=ROW on the server)
+    Events are handed out a whole transaction at a time, all with the position
+    after its XID: resuming mid-transaction would start past the table map event
+    the remaining rows events need to be decoded
+    """
+
+    def __init__(self, position):
+        from pymysqlreplication import BinLogStreamReader
+        from pymysqlreplication.event import XidEvent
+        from pymysqlreplication.row_event import WriteRowsEvent, UpdateRowsEvent
+
+        self._reader = BinLogStreamReader
+        self._write_event = WriteRowsEvent
+        self._update_event = UpdateRowsEvent
+        self._xid_event = XidEvent
+        self._stream = None
+        self._open(position)
+
+    def _open(self, position):
+        if self._stream is not None:
+            self._stream.close()
+        self._stream = self._reader(
+            connection_settings={
+                'host': MYSQL_CONFIG['host'],
+                'port': MYSQL_CONFIG.get('port', 3306),
+                'user': MYSQL_CONFIG['user'],
+                'passwd': MYSQL_CONFIG['password'],
+            },
+            server_id=CDC_CONFIG['server_id'],
+            only_schemas=[MYSQL_CONFIG['database']],
+            only_tables=['order_logs', 'orders'],
+            only_events=[self._write_event, self._update_event, self._xid_event],
+            log_file=position['log_file'] if position else None,
+            log_pos=position['log_pos'] if position else None,
+            # Without a saved position this starts at the server's current binlog position
+            resume_stream=True,
+            blocking=False
+        )
+        self._position = position
+        self._transaction = []  # rows of the transaction whose XID hasn't been read yet
+
+    def read(self, position, max_events):
+        # Reopen at the caller's position if it isn't where the stream stopped
+        # (e.g. the previous batch failed before its position was saved)
+        if position != self._position:
+            self._open(position)
+        events = []
+        for binlog_event in self._stream:
+            if isinstance(binlog_event, self._xid_event):
+                # Committed: its rows resume after the XID
+                position = {'log_file': self._stream.log_file, 'log_pos': self._stream.log_pos}
+                for event in self._transaction:
+                    event['position'] = position
+                events += self._transaction
+                self._transaction = []
+                # Batches are cut only between transactions
+                if len(events) >= max_events:
+                    break
+                continue
+            is_insert = isinstance(binlog_event, self._write_event)
+            for row in binlog_event.rows:
+                self._transaction.append({
+                    'table': binlog_event.table,
+                    'type': 'insert' if is_insert else 'update',
+                    'row': row['values'] if is_insert else row['after_values']
+                })
+        if events:
+            self._position = events[-1]['position']
+        return events
+
+    def close(self):
+        self._stream.close()
+
+class MySQLLookup:
+    """Fetches orders rows and existing order_logs rows the stream hasn't carried"""
+
+    def __init__(self, conn, order_cols):
+        self.conn = conn
+        self.order_cols = order_cols
+
+    def _query(self, sql, ids):
+        placeholders = ", ".join(["%s"] * len(ids))
+        cursor = self.conn.cursor(dictionary=True)
+        cursor.execute(sql.format(ids=placeholders), list(ids))
+        rows = cursor.fetchall()
+        cursor.close()
+        return rows
+
+    def orders(self, order_ids):
+        if not order_ids:
+            return {}
+        cols = ", ".join(['order_id'] + self.order_cols)
+        rows = self._query(f"SELECT {cols} FROM orders WHERE order_id IN ({{ids}})", order_ids)
+        return {row['order_id']: row for row in rows}
+
+    def logs_for_orders(self, order_ids):
+        if not order_ids:
+            return []
+        return self._query(
+            "SELECT order_log_id, order_id, order_status_id, created_at AS created_at_log "
+            "FROM order_logs WHERE order_id IN ({ids}) ORDER BY order_log_id",
+            order_ids
+        )
+
+class StreamLookup:
+    """Offline lookup that only knows the rows seen in the stream so far"""
+
+    def __init__(self):
+        self.orders_seen = {}
+        self.logs_seen = {}
+
+    def remember(self, event):
+        row = event['row']
+        if event['table'] == 'orders':
+            self.orders_seen[row['order_id']] = row
+        elif event['table'] == 'order_logs':
+            self.logs_seen.setdefault(row['order_id'], []).append(_log_row(row))
+
+    def orders(self, order_ids):
+        return {i: self.orders_seen[i] for i in order_ids if i in self.orders_seen}
+
+    def logs_for_orders(self, order_ids):
+        return [log_row for i in order_ids for log_row in self.logs_seen.get(i, [])]
+
+def _log_row(row):
+    return {
+        'order_log_id': row['order_log_id'],
+        'order_id': row['order_id'],
+        'order_status_id': row['order_status_id'],
+        'created_at_log': row.get('created_at_log', row.get('created_at'))
+    }
+
+def build_event_rows(events, lookup, order_cols):
+    """
+    Turn a batch of row events into rows shaped like extract_events() output
+    Returns (rows for new events, rows for corrected events)
+    """
+    new_logs = []
+    changed_orders = {}
+    for event in events:
+        if event['table'] == 'order_logs' and event['type'] == 'insert':
+            new_logs.append(_log_row(event['row']))
+        elif event['table'] == 'orders':
+            changed_orders[event['row']['order_id']] = event['row']
+
+    # Orders changed in this batch are already current; fetch the rest
+    missing = {r['order_id'] for r in new_logs} - set(changed_orders)
+    orders = lookup.orders(sorted(missing))
+    orders.update(changed_orders)
+
+    def join(log_row):
+        order = orders.get(log_row['order_id'])
+        if order is None:
+            return None  # same as the INNER JOIN in the polling extractor
+        row = dict(log_row)
+        row.update({col: order.get(col) for col in order_cols})
+        return row
+
+    new_rows = [r for r in map(join, new_logs) if r is not None]
+
+    # Re-emit the order's earlier events with the updated order attributes
+    new_ids = {r['order_log_id'] for r in new_logs}
+    earlier_logs = [
+        r for r in lookup.logs_for_orders(sorted(changed_orders))
+        if r['order_log_id'] not in new_ids
+    ]
+    corrected_rows = [r for r in map(join, earlier_logs) if r is not None]
+    return new_rows, corrected_rows
+
+def load_position():
+    position_file = CDC_CONFIG['position_file']
+    if not os.path.exists(position_file):
+        log("✓ No CDC position - starting from the current binlog position")
+        return None
+    with open(position_file, 'r') as f:
+        position = json.load(f)
+    log(f"✓ Resuming CDC at {position['log_file']}:{position['log_pos']}")
+    return position
+
+def save_position(position):
+    """Write to a temp file and rename, so a crash never leaves a torn position"""
+    write_atomic(CDC_CONFIG['position_file'], json.dumps(position))
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream order_logs/orders row events into events_data")
+    parser.add_argument('--file', help="read row events from a JSON-lines file instead of the binlog")
+    parser.add_argument('--offline', action='store_true',
+                        help="don't query MySQL; join only against rows seen in the stream")
+    parser.add_argument('--once', action='store_true', help="stop when no events are pending")
+    args = parser.parse_args()
+
+    log("="*70)
+    log("EVENTS ETL - CDC STREAM")
+    log("="*70)
+
+    conn = None
+    source = None
+    try:
+        ch_client = clickhouse_connect.get_client(**CH_CONFIG)
+        ch_schema = get_clickhouse_schema(ch_client)
+        log(f"✓ ClickHouse table has {len(ch_schema)} columns")
+
+        if args.offline:
+            lookup = StreamLookup()
+            order_cols = list(ORDER_COLUMNS)
+        else:
+            conn = mysql.connector.connect(**MYSQL_CONFIG)
+            conn.autocommit = True
+            orders_cols = get_mysql_columns(conn, 'orders')
+            order_cols = [col for col in ORDER_COLUMNS if col in orders_cols]
+            lookup = MySQLLookup(conn, order_cols)
+
+        position = load_position()
+        source = FileEventSource(args.file) if args.file else BinlogEventSource(position)
+
+        while True:
+            events = source.read(position, CDC_CONFIG['max_events'])
+            if not events:
+                if args.once:
+                    break
+                time.sleep(CDC_CONFIG['poll_interval'])
+                continue
+
+            if args.offline:
+                for event in events:
+                    lookup.remember(event)
+
+            new_rows, corrected_rows = build_event_rows(events, lookup, order_cols)
+            rows = new_rows + corrected_rows
+            end_position = events[-1]['position']
+            if rows:
+                df = pd.DataFrame(rows, columns=LOG_COLUMNS + order_cols)
+                if 'updated_at' in df.columns:
+                    # Same version as etl_events_updates.py, so the newest order row wins
+                    df = add_version(df)
+                df = transform_events(df, ch_schema)
+                # Re-reading from the saved position after a crash yields the same token
+                start = f"{position['log_file']}:{position['log_pos']}" if position else 'start'
+                end = f"{end_position['log_file']}:{end_position['log_pos']}"
+                load_events(df, ch_client, dedup_settings('events_data', start, end))
+                corrected = df['event_id'].isin([row['order_log_id'] for row in corrected_rows])
+                if rollup_mode() == 'load':
+                    update_rollups(ch_client, df[~corrected], (start, end), ch_schema)
+                mark_stale(df[corrected], "CDC corrections")
+
+            position = end_position
+            save_position(position)
+            log(f"✓ {len(events)} row events → {len(new_rows)} new, {len(corrected_rows)} corrected "
+                f"(position {position['log_file']}:{position['log_pos']})")
+
+        return 0
+    except KeyboardInterrupt:
+        log("CDC stream stopped by user")
+        return 0
+    except Exception as e:
+        log(f"\n✗ FAILED: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+    finally:
+        if source is not None:
+            source.close()
+        if conn is not None:
+            conn.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
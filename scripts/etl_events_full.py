@@ -3,17 +3,27 @@
 Full ETL - Initial Load
 Loads ALL historical events from order_logs to ClickHouse
 Run this ONCE before starting incremental sync
+
+  python3 scripts/etl_events_full.py               # truncate and load events_data
+  python3 scripts/etl_events_full.py --stage-only  # write staged files instead (see etl_staging.py)
 """
 
+import argparse
 import pandas as pd
-import mysql.connector
 import clickhouse_connect
 import sys
 import os
+import time
 from datetime import datetime
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from config.config import MYSQL_CONFIG, CH_CONFIG, EVENT_TYPE_MAPPING
+from config.config import CH_CONFIG, ETL_CONFIG, ORDER_COLUMNS
+from scripts.etl_transform_plan import get_clickhouse_schema, get_transform_plan
+from scripts.etl_checkpoint import dedup_settings, write_atomic
+from scripts.etl_event_types import extract_filter_sql, map_event_types, quarantine, unmapped_policy
+from scripts.etl_insert import BlockCoalescer, InsertPool, describe_insert, insert_settings
+from scripts.etl_source import SourceThrottle, connect_source, source_table
+from scripts.etl_staging import stage_path, write_stage
 
 def log(message):
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -27,16 +37,12 @@ def get_mysql_columns(conn, table_name):
     cursor.close()
     return columns
 
-def get_clickhouse_columns(ch_client):
-    """Get list of columns from ClickHouse events_data table"""
-    query = "DESCRIBE TABLE events_data"
-    result = ch_client.query(query)
-    columns = [row[0] for row in result.result_rows]
-    return columns
-
-def build_select_query(orders_cols, ch_cols, offset, batch_size):
+def build_select_query(orders_cols, last_id, batch_size, end_id=None):
     """
     Build SELECT query with only columns that exist in both MySQL and ClickHouse
+    Uses keyset pagination on order_log_id so every batch is an index range scan
+    end_id optionally caps the range (inclusive) for sharded backfills
+    Returns (query, params)
     """
     
     # Required columns from order_logs
@@ -47,174 +53,132 @@ def build_select_query(orders_cols, ch_cols, offset, batch_size):
         "ol.created_at as created_at_log"
     ]
     
-    # Target columns for ClickHouse (excluding the ones we already have from order_logs)
-    target_cols = [
-        'order_number', 'order_type_id', 'customer_id', 'segment_id', 
-        'customer_type', 'is_first_order', 'is_favourite_order', 'new_customer_foc',
-        'grand_total', 'vat', 'delivery_fee', 'discount', 
-        'wallet_amount', 'wallet_discount', 'wallet_cashback', 'is_cash_back',
-        'invoice_amount', 'payment_method_id', 'promocode_id', 'promotion_id',
-        'coupon_quantity', 'reward', 'qitaf_rewardpoints',
-        'delivery_date', 'delivery_time', 'delivery_type', 'delivered_quantity',
-        'country_id', 'city_id', 'area_id', 'store_id', 'sale_office_id',
-        'route_id', 'agent_id', 'address_id', 'source_id', 'channel_id',
-        'sub_channel_id', 'device_type', 'app_version',
-        'total_items_quantity', 'total_unique_item_count',
-        'gift_item_quantity', 'foc_item_quantity',
-        'is_recurring', 'is_split_order', 'corporate_invoice', 'loyalty_programs',
-        'is_bfm_customer', 'order_customer_bfm_club_id', 'is_stc_tayamouz_customer',
-        'fulfilment_id', 'invoice_date', 'created_at', 'updated_at'
-    ]
-    
     # Only select columns that exist in MySQL orders table
-    for col in target_cols:
+    for col in ORDER_COLUMNS:
         if col in orders_cols:
             select_parts.append(f"o.{col}")
     
     select_clause = ",\n            ".join(select_parts)
     
+    where_clause = "ol.order_log_id > %s"
+    params = [last_id]
+    if end_id is not None:
+        where_clause += " AND ol.order_log_id <= %s"
+        params.append(end_id)
+    where_clause += extract_filter_sql()
+    params.append(batch_size)
+    
+    # STRAIGHT_JOIN keeps order_logs as the driving table under force_index
     query = f"""
-        SELECT 
+        SELECT {'STRAIGHT_JOIN' if ETL_CONFIG['force_index'] else ''}
             {select_clause}
-        FROM order_logs ol
+        FROM {source_table('ol')}
         INNER JOIN orders o ON ol.order_id = o.order_id
+        WHERE {where_clause}
         ORDER BY ol.order_log_id
-        LIMIT {batch_size} OFFSET {offset}
+        LIMIT %s
         """
     
-    return query
+    return query, tuple(params)
 
-def extract_all_events():
-    log("Connecting to MySQL...")
-    conn = mysql.connector.connect(**MYSQL_CONFIG)
-    
-    # Get column information
-    log("Discovering MySQL table columns...")
-    orders_cols = get_mysql_columns(conn, 'orders')
-    log(f"✓ Found {len(orders_cols)} columns in orders table")
-    
-    # Get total count
-    cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*) FROM order_logs")
-    total_count = cursor.fetchone()[0]
-    log(f"✓ Total events to sync: {total_count:,}")
-    cursor.close()
-    
-    # Extract in batches
-    batch_size = 1000
-    all_data = []
-    
-    for offset in range(0, total_count, batch_size):
-        log(f"  → Extracting batch: {offset+1} to {min(offset+batch_size, total_count)}")
+def iter_event_batches(conn, orders_cols, batch_size, start_id=0, end_id=None, throttle=None):
+    """
+    Stream events from MySQL one batch at a time
+    Each batch resumes after the last order_log_id seen (no OFFSET re-scans)
+    throttle (a SourceThrottle on conn) paces the pages to the source's load
+    """
+    last_id = start_id
+    while True:
+        if throttle is not None and not throttle.before_query():
+            raise RuntimeError(f"Replica too far behind - stopped after order_log_id {last_id}")
+        query, params = build_select_query(orders_cols, last_id, batch_size, end_id)
+        started = time.monotonic()
+        df = pd.read_sql(query, conn, params=params)
+        if throttle is not None:
+            throttle.after_query(len(df), time.monotonic() - started)
+        if df.empty:
+            return
         
-        # Build dynamic query based on available columns
-        query = build_select_query(orders_cols, None, offset, batch_size)
+        log(f"  → Extracted {len(df):,} events: order_log_id {df['order_log_id'].iloc[0]} to {df['order_log_id'].iloc[-1]}")
+        last_id = int(df['order_log_id'].iloc[-1])
+        yield df
         
-        df = pd.read_sql(query, conn)
-        all_data.append(df)
-    
-    conn.close()
-    
-    # Combine all batches
-    final_df = pd.concat(all_data, ignore_index=True)
-    log(f"✓ Extracted {len(final_df):,} total events")
-    
-    return final_df
+        if len(df) < batch_size:
+            return
 
-def transform_events(df, ch_cols):
+def transform_events(df, ch_schema):
     log("Transforming data...")
     
+    # Map event_type with the lookup table; unmapped statuses may be dropped or quarantined
+    event_types, keep = map_event_types(df['order_status_id'])
+    if keep is not None:
+        if unmapped_policy() == 'quarantine':
+            quarantine(df[~keep].to_dict('records'))
+        log(f"  ⚠ {int((~keep).sum())} events with unmapped statuses left out ({unmapped_policy()})")
+        df = df[keep]
+        event_types = event_types[keep]
+    
     # Rename
     df = df.rename(columns={
         'order_log_id': 'event_id',
         'created_at_log': 'event_timestamp'
     })
+    df['event_type'] = event_types
     
-    # Add event_type
-    df['event_type'] = df['order_status_id'].replace(EVENT_TYPE_MAPPING)
-    
-    # Add missing columns with default values
-    for col in ch_cols:
-        if col not in df.columns:
-            # Determine default value based on column name
-            if 'id' in col.lower() or 'quantity' in col.lower():
-                df[col] = 0
-            elif 'date' in col.lower() or 'time' in col.lower():
-                df[col] = pd.NaT
-            elif any(x in col.lower() for x in ['total', 'amount', 'fee', 'discount', 'reward', 'vat']):
-                df[col] = 0.0
-            elif col.lower().startswith('is_'):
-                df[col] = 0
-            else:
-                df[col] = ''
+    # Convert every ClickHouse column by its declared type (plan compiled once per schema)
+    plan = get_transform_plan(ch_schema, df.columns)
+    if not plan.reported:
+        for col in plan.missing:
             log(f"  ⚠ Added missing column '{col}' with default value")
-    
-    # Convert columns that should be numeric to numeric type
-    # These are columns that end with _id, quantity, or are boolean flags
-    numeric_pattern_cols = [col for col in df.columns if 
-                           col.endswith('_id') or 
-                           'quantity' in col.lower() or 
-                           col.startswith('is_') or
-                           col in ['segment_id', 'new_customer_foc', 'coupon_quantity', 
-                                   'delivered_quantity', 'app_version']]
-    
-    for col in numeric_pattern_cols:
-        if col in df.columns:
-            # Convert to numeric, replacing non-numeric values with 0
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype('int64')
-    
-    # Convert monetary columns to float
-    monetary_cols = [col for col in df.columns if any(x in col.lower() for x in 
-                    ['total', 'amount', 'fee', 'discount', 'reward', 'vat', 'wallet', 'cashback', 'invoice'])]
-    
-    for col in monetary_cols:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0.0).astype('float64')
-    
-    # Fill remaining NULLs for numeric columns
-    for col in df.select_dtypes(include=['number']).columns:
-        df[col] = df[col].fillna(0)
-    
-    # Fill NULLs for string columns (only true string columns, not IDs)
-    for col in df.select_dtypes(include=['object', 'string']).columns:
-        if not col.endswith('_id') and 'quantity' not in col.lower():
-            df[col] = df[col].fillna('')
-    
-    # Convert datetimes
-    for col in ['event_timestamp', 'created_at', 'updated_at']:
-        if col in df.columns:
-            df[col] = pd.to_datetime(df[col], errors='coerce')
-    
-    # Convert delivery_date to date (with format to suppress warning)
-    if 'delivery_date' in df.columns:
-        df['delivery_date'] = pd.to_datetime(df['delivery_date'], format='mixed', errors='coerce')
-    
-    # Convert delivery_time to datetime (ClickHouse expects DateTime, not Time)
-    if 'delivery_time' in df.columns:
-        df['delivery_time'] = pd.to_datetime(df['delivery_time'], format='mixed', errors='coerce')
-    
-    # Convert invoice_date to date
-    if 'invoice_date' in df.columns:
-        df['invoice_date'] = pd.to_datetime(df['invoice_date'], format='mixed', errors='coerce')
-    
-    # Reorder columns to match ClickHouse table
-    df = df[[col for col in ch_cols if col in df.columns]]
+        plan.reported = True
+    df = plan.apply(df)
+    if ETL_CONFIG['narrow_dtypes']:
+        before = df.memory_usage(deep=True).sum()
+        df = plan.narrow(df)
+        after = df.memory_usage(deep=True).sum()
+        log(f"  ✓ Narrowed dtypes: {before / 1024 / 1024:.1f} MB → {after / 1024 / 1024:.1f} MB "
+            f"({(after - before) / max(before, 1):+.0%})")
     
     log(f"✓ Transformed - shape: {df.shape}")
     return df
 
-def load_events_batch(df, ch_client):
-    log(f"Loading {len(df):,} events in batches...")
-    
-    batch_size = 1000
-    for i in range(0, len(df), batch_size):
-        batch = df.iloc[i:i+batch_size]
-        ch_client.insert_df('events_data', batch)
-        log(f"  ✓ Loaded batch {i//batch_size + 1}: rows {i+1}-{min(i+batch_size, len(df))}")
+def load_events_batch(df, ch_client, after_id, run_id):
+    """
+    Insert one block, with a dedup token for its (after_id, last event_id] range
+    run_id scopes the token to this load (see dedup_settings)
+    """
+    last_id = int(df['event_id'].iloc[-1])
+    settings = insert_settings(dedup_settings('events_data', after_id, last_id, run_id))
+    started = time.monotonic()
+    summary = ch_client.insert_df('events_data', df, settings=settings)
     
-    log("✓ All batches loaded!")
+    log(f"  ✓ Loaded {len(df):,} events - max event_id: {last_id} "
+        f"({describe_insert(summary, len(df), time.monotonic() - started)})")
+
+def make_block_coalescer(load_block, commit):
+    """Coalesces transformed pages into insert_block_rows / insert_block_mb blocks"""
+    return BlockCoalescer(
+        load_block,
+        commit,
+        lambda dfs: pd.concat(dfs, ignore_index=True),
+        ETL_CONFIG['insert_block_rows'],
+        ETL_CONFIG['insert_block_mb'] * 1024 * 1024,
+        lambda df: df.memory_usage(deep=True).sum()
+    )
+
+def stage_events_batch(df, ch_schema, after_id, run_id):
+    """Write one block to a staged file of scope run_id instead of inserting it"""
+    last_id = int(df['event_id'].iloc[-1])
+    path = stage_path(run_id, after_id, last_id)
+    size = write_stage(path, df, ch_schema)
+    log(f"  ✓ Staged {len(df):,} events in {os.path.basename(path)} ({size / 1024 / 1024:.1f} MB)")
 
 def main():
+    parser = argparse.ArgumentParser(description="Load all historical events into events_data")
+    parser.add_argument('--stage-only', action='store_true',
+                        help="write staged files to ship later instead of truncating and inserting")
+    args = parser.parse_args()
+    
     log("="*70)
     log("EVENTS ETL - FULL INITIAL LOAD")
     log("="*70)
@@ -227,41 +191,76 @@ def main():
         
         # Get ClickHouse columns
         log("\n[2/5] Getting ClickHouse table schema...")
-        ch_cols = get_clickhouse_columns(ch_client)
-        log(f"✓ ClickHouse table has {len(ch_cols)} columns")
+        ch_schema = get_clickhouse_schema(ch_client)
+        log(f"✓ ClickHouse table has {len(ch_schema)} columns")
         
         # Clear existing data
         log("\n[3/5] Clearing existing data...")
-        ch_client.command("TRUNCATE TABLE events_data")
-        log("✓ Table truncated")
-        
-        # Extract
-        log("\n[4/5] Extracting from MySQL...")
-        df = extract_all_events()
+        if args.stage_only:
+            log("✓ Staging only - events_data is left as is")
+        else:
+            ch_client.command("TRUNCATE TABLE events_data")
+            log("✓ Table truncated")
         
-        # Transform
-        df = transform_events(df, ch_cols)
+        # Extract, transform and load batch by batch
+        log("\n[4/5] Connecting to MySQL...")
+        conn = connect_source()
         
-        # Load
-        log("\n[5/5] Loading to ClickHouse...")
-        load_events_batch(df, ch_client)
+        log("Discovering MySQL table columns...")
+        orders_cols = get_mysql_columns(conn, 'orders')
+        log(f"✓ Found {len(orders_cols)} columns in orders table")
         
-        # Verify
-        total = ch_client.command("SELECT COUNT(*) FROM events_data")
-        max_id = ch_client.command("SELECT MAX(event_id) FROM events_data")
+        log("\n[5/5] Streaming MySQL → ClickHouse...")
+        batch_size = ETL_CONFIG['full_load_batch_size']
+        loaded = 0
+        last_id = 0
+        # Blocks are inserted by insert_workers threads, each with its own client
+        run_id = f"full-{int(time.time())}"
+        pool = InsertPool(ETL_CONFIG['insert_workers'], lambda: clickhouse_connect.get_client(**CH_CONFIG))
+        if args.stage_only:
+            load_block = lambda block, ids: stage_events_batch(block, ch_schema, ids[0], run_id)
+        else:
+            load_block = lambda block, ids: pool.submit(
+                lambda client, block, after_id: load_events_batch(block, client, after_id, run_id),
+                block, ids[0]
+            )
+        coalescer = make_block_coalescer(
+            load_block,
+            lambda committed: None  # the checkpoint is written once everything is loaded
+        )
+        try:
+            for df in iter_event_batches(conn, orders_cols, batch_size, throttle=SourceThrottle(conn)):
+                # Paged on the extracted ids: a page can transform to nothing (all quarantined)
+                batch_last_id = int(df['order_log_id'].iloc[-1])
+                df = transform_events(df, ch_schema)
+                if not df.empty:
+                    coalescer.add(df, (last_id, batch_last_id))
+                loaded += len(df)
+                last_id = batch_last_id
+                log(f"✓ Progress: {loaded:,} events streamed")
+            coalescer.flush()
+            pool.wait()
+        finally:
+            conn.close()
+            pool.close()
         
+        # Counted while streaming - run scripts/etl_reconcile.py --deep to verify
         log("\n" + "="*70)
         log(f"✓ FULL LOAD COMPLETED!")
-        log(f"  Total events: {total:,}")
-        log(f"  Max event_id: {max_id}")
+        log(f"  Total events: {loaded:,}")
+        log(f"  Max event_id: {last_id}")
         log("="*70)
         
-        # Save last ID for incremental sync
-        tracking_file = 'logs/last_sync_id.txt'
-        os.makedirs('logs', exist_ok=True)
-        with open(tracking_file, 'w') as f:
-            f.write(str(max_id))
-        log(f"✓ Saved last_sync_id: {max_id}")
+        if args.stage_only:
+            log(f"Ship with: python3 scripts/etl_staging.py --scope {run_id} --set-checkpoint")
+            return 0
+        
+        if ETL_CONFIG['rollups']:
+            log("⚠ Rollups don't follow a reload - rebuild them: python3 scripts/etl_rollups.py rebuild")
+        
+        # Save last streamed ID for incremental sync
+        write_atomic(ETL_CONFIG['tracking_file'], str(last_id))
+        log(f"✓ Saved last_sync_id: {last_id}")
         
         return 0
         
@@ -4,16 +4,39 @@ Main Incremental ETL for Events Data
 Fetches from order_logs + orders → syncs to ClickHouse events_data
 """
 
+import argparse
 import pandas as pd
-import mysql.connector
 import clickhouse_connect
 import sys
 import os
+import time
 from datetime import datetime
+from functools import lru_cache
 
 # Add parent directory to path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from config.config import MYSQL_CONFIG, CH_CONFIG, ETL_CONFIG, EVENT_TYPE_MAPPING
+from config.config import CH_CONFIG, ETL_CONFIG, ORDER_COLUMNS
+from scripts.etl_pipeline import AdaptiveBatchSizer, run_pipeline, run_sequential
+from scripts.etl_transform_plan import get_clickhouse_schema, get_transform_plan
+from scripts.etl_columnar import fetch_columns, transform_columns, narrow_columns, insert_columns, concat_batches
+from scripts.etl_event_types import extract_filter_sql, map_event_types, quarantine, unmapped_policy
+from scripts.etl_metrics import (
+    emit, finish_run, frame_bytes, get_gauge, peak_rss_mb, profile_call, set_gauge, stage, start_run
+)
+from scripts.etl_insert import BlockCoalescer, describe_insert, insert_settings
+from scripts.etl_schema import high_water_mark
+from scripts.etl_schema_cache import SchemaCache
+from scripts.etl_orders_cache import OrdersCache
+from scripts.etl_staging import INCREMENTAL, ship_chain, ship_file, stage_path, staged_bytes, write_stage
+from scripts.etl_rollups import mark_stale, rollup_mode, update_rollups
+from scripts.etl_source import SourceThrottle, connect_source, source_table
+from scripts.etl_checkpoint import (
+    ClickHouseCheckpointStore, dedup_settings, read_checkpoint,
+    read_pending, write_atomic, write_pending
+)
+
+# Schemas survive between runs of a long-lived process (see etl_schema_cache)
+schema_cache = SchemaCache(ETL_CONFIG['schema_check_interval'])
 
 def log(message):
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -27,17 +50,9 @@ def get_mysql_columns(conn, table_name):
     cursor.close()
     return columns
 
-def get_clickhouse_columns(ch_client):
-    """Get list of columns from ClickHouse events_data table"""
-    query = "DESCRIBE TABLE events_data"
-    result = ch_client.query(query)
-    columns = [row[0] for row in result.result_rows]
-    return columns
-
-def build_select_query(orders_cols, last_synced_id, batch_size):
-    """
-    Build SELECT query with only columns that exist in both MySQL and ClickHouse
-    """
+@lru_cache(maxsize=16)
+def select_clause(orders_cols):
+    """Column list for the order_logs ⋈ orders SELECT, built once per orders columns"""
     
     # Required columns from order_logs
     select_parts = [
@@ -47,221 +62,695 @@ def build_select_query(orders_cols, last_synced_id, batch_size):
         "ol.created_at as created_at_log"
     ]
     
-    # Target columns for ClickHouse (excluding the ones we already have from order_logs)
-    target_cols = [
-        'order_number', 'order_type_id', 'customer_id', 'segment_id',
-        'customer_type', 'is_first_order', 'is_favourite_order', 'new_customer_foc',
-        'grand_total', 'vat', 'delivery_fee', 'discount',
-        'wallet_amount', 'wallet_discount', 'wallet_cashback', 'is_cash_back',
-        'invoice_amount', 'payment_method_id', 'promocode_id', 'promotion_id',
-        'coupon_quantity', 'reward', 'qitaf_rewardpoints',
-        'delivery_date', 'delivery_time', 'delivery_type', 'delivered_quantity',
-        'country_id', 'city_id', 'area_id', 'store_id', 'sale_office_id',
-        'route_id', 'agent_id', 'address_id', 'source_id', 'channel_id',
-        'sub_channel_id', 'device_type', 'app_version',
-        'total_items_quantity', 'total_unique_item_count',
-        'gift_item_quantity', 'foc_item_quantity',
-        'is_recurring', 'is_split_order', 'corporate_invoice', 'loyalty_programs',
-        'is_bfm_customer', 'order_customer_bfm_club_id', 'is_stc_tayamouz_customer',
-        'fulfilment_id', 'invoice_date', 'created_at', 'updated_at'
-    ]
-    
     # Only select columns that exist in MySQL orders table
-    for col in target_cols:
+    for col in ORDER_COLUMNS:
         if col in orders_cols:
             select_parts.append(f"o.{col}")
     
-    select_clause = ",\n        ".join(select_parts)
+    return ",\n        ".join(select_parts)
+
+@lru_cache(maxsize=16)
+def _select_template(orders_cols, bounded, status_filter, force_index):
+    """SELECT with %s placeholders, built once per (orders columns, bounded, status filter, force_index)"""
+    where_clause = "ol.order_log_id > %s"
+    if bounded:
+        where_clause += " AND ol.order_log_id <= %s"
+    where_clause += status_filter
     
+    # STRAIGHT_JOIN keeps order_logs as the driving table, so the pinned range scan is the plan
     query = f"""
-    SELECT 
-        {select_clause}
-    FROM order_logs ol
+    SELECT {'STRAIGHT_JOIN' if force_index else ''}
+        {select_clause(orders_cols)}
+    FROM {source_table('ol', force_index)}
     INNER JOIN orders o ON ol.order_id = o.order_id
-    WHERE ol.order_log_id > {last_synced_id}
+    WHERE {where_clause}
     ORDER BY ol.order_log_id
-    LIMIT {batch_size}
+    LIMIT %s
     """
     
     return query
 
-def get_last_synced_id():
-    tracking_file = ETL_CONFIG['tracking_file']
-    try:
-        if os.path.exists(tracking_file):
-            with open(tracking_file, 'r') as f:
-                last_id = int(f.read().strip())
-                log(f"✓ Last synced order_log_id: {last_id}")
-                return last_id
-        else:
+def build_select_query(orders_cols, last_synced_id, batch_size, end_id=None):
+    """
+    Build SELECT query with only columns that exist in both MySQL and ClickHouse
+    end_id caps the range at order_log_id <= end_id (used to replay a batch)
+    Returns (query, params) - the query text is cached, only params change
+    """
+    query = _select_template(tuple(orders_cols), end_id is not None, extract_filter_sql(), ETL_CONFIG['force_index'])
+    if end_id is None:
+        return query, (last_synced_id, batch_size)
+    return query, (last_synced_id, end_id, batch_size)
+
+_checkpoint_stores = {}
+
+def get_checkpoint_store(ch_client):
+    """ClickHouse state table for this client, None unless checkpoint_table is set"""
+    table = ETL_CONFIG['checkpoint_table']
+    if not table or ch_client is None:
+        return None
+    store = _checkpoint_stores.get(id(ch_client))
+    if store is None or store.ch_client is not ch_client:
+        store = ClickHouseCheckpointStore(ch_client, table)
+        _checkpoint_stores[id(ch_client)] = store
+    return store
+
+def get_last_synced_id(quiet=False, ch_client=None):
+    """
+    Newest checkpoint from the tracking file and (if configured) ClickHouse
+    A corrupt tracking file raises CheckpointError rather than re-syncing from 0
+    """
+    last_id = read_checkpoint(ETL_CONFIG['tracking_file'])
+    store = get_checkpoint_store(ch_client)
+    if store is not None:
+        stored_id = store.get('events_data')
+        if stored_id is not None and (last_id is None or stored_id > last_id):
+            last_id = stored_id
+    
+    if last_id is None and ch_client is not None:
+        # No checkpoint but events already loaded: continue after them rather than reloading
+        last_id = high_water_mark(ch_client)
+        if last_id is not None and not quiet:
+            log(f"⚠ No checkpoint - continuing after the highest event_id in events_data ({last_id})")
+    
+    if last_id is None:
+        if not quiet:
             log("✓ No previous sync - starting from beginning")
-            return 0
-    except:
         return 0
+    if not quiet:
+        log(f"✓ Last synced order_log_id: {last_id}")
+    return last_id
 
-def save_last_synced_id(last_id):
-    tracking_file = ETL_CONFIG['tracking_file']
-    os.makedirs(os.path.dirname(tracking_file), exist_ok=True)
-    with open(tracking_file, 'w') as f:
-        f.write(str(last_id))
+def save_last_synced_id(last_id, ch_client=None):
+    write_atomic(ETL_CONFIG['tracking_file'], str(last_id))
+    store = get_checkpoint_store(ch_client)
+    if store is not None:
+        store.save('events_data', last_id)
     log(f"✓ Saved last synced ID: {last_id}")
 
-def extract_events(last_synced_id):
-    log("Connecting to MySQL...")
-    conn = mysql.connector.connect(**MYSQL_CONFIG)
-    batch_size = ETL_CONFIG['batch_size']
+def extract_events(last_synced_id, conn=None, orders_cols=None, batch_size=None, end_id=None):
+    """
+    Extract one batch of events after last_synced_id
+    Pass an open conn (and orders_cols) to reuse a connection across batches
+    """
+    own_conn = conn is None
+    if own_conn:
+        log("Connecting to MySQL...")
+        conn = connect_source()
+    batch_size = batch_size or ETL_CONFIG['batch_size']
     
     # Get column information
-    orders_cols = get_mysql_columns(conn, 'orders')
+    if orders_cols is None:
+        orders_cols = get_mysql_columns(conn, 'orders')
     
     # Build dynamic query
-    query = build_select_query(orders_cols, last_synced_id, batch_size)
+    query, params = build_select_query(orders_cols, last_synced_id, batch_size, end_id)
     
     log(f"✓ Querying order_logs > {last_synced_id} (batch: {batch_size})")
-    df = pd.read_sql(query, conn)
-    conn.close()
+    with stage('extract') as sample:
+        df = pd.read_sql(query, conn, params=params)
+        sample['rows'], sample['bytes'] = len(df), frame_bytes(df)
+    if own_conn:
+        conn.close()
     
     log(f"✓ Extracted {len(df)} events")
     return df
 
-def transform_events(df, ch_cols):
-    if df.empty:
-        return df
-    
-    log("Transforming...")
+def iter_event_chunks(conn, query, params, chunk_rows):
+    """Yield the result set as DataFrames of up to chunk_rows rows as they arrive"""
+    cursor = conn.cursor(buffered=False)
+    try:
+        cursor.execute(query, params)
+        names = [d[0] for d in cursor.description]
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                break
+            # coerce_float like read_sql, so DECIMAL columns arrive as float
+            yield pd.DataFrame.from_records(rows, columns=names, coerce_float=True)
+    finally:
+        cursor.close()
+
+def stream_events(last_synced_id, conn, orders_cols, batch_size, end_id=None):
+    """Streaming mode: one batch as an iterator of stream_chunk_rows-row DataFrames"""
+    query, params = build_select_query(orders_cols, last_synced_id, batch_size, end_id)
+    log(f"✓ Querying order_logs > {last_synced_id} (batch: {batch_size}, streamed)")
+    return iter_event_chunks(conn, query, params, ETL_CONFIG['stream_chunk_rows'])
+
+def transform_chunk(df, ch_schema):
+    # Map event_type with the lookup table; unmapped statuses may be dropped or quarantined
+    event_types, keep = map_event_types(df['order_status_id'])
+    if keep is not None:
+        skipped = df[~keep]
+        if unmapped_policy() == 'quarantine':
+            quarantine(skipped.to_dict('records'))
+        log(f"⚠ {len(skipped)} events with unmapped statuses {sorted(skipped['order_status_id'].unique().tolist())} "
+            f"{'quarantined' if unmapped_policy() == 'quarantine' else 'dropped'}")
+        df = df[keep]
+        event_types = event_types[keep]
     
     # Rename key columns
     df = df.rename(columns={
         'order_log_id': 'event_id',
         'created_at_log': 'event_timestamp'
     })
+    df['event_type'] = event_types
     
-    # Add event_type
-    df['event_type'] = df['order_status_id'].replace(EVENT_TYPE_MAPPING)
-    
-    # Add missing columns with default values
-    for col in ch_cols:
-        if col not in df.columns:
-            # Determine default value based on column name
-            if 'id' in col.lower() or 'quantity' in col.lower():
-                df[col] = 0
-            elif 'date' in col.lower() or 'time' in col.lower():
-                df[col] = pd.NaT
-            elif any(x in col.lower() for x in ['total', 'amount', 'fee', 'discount', 'reward', 'vat']):
-                df[col] = 0.0
-            elif col.lower().startswith('is_'):
-                df[col] = 0
-            else:
-                df[col] = ''
-    
-    # Convert columns that should be numeric to numeric type
-    # These are columns that end with _id, quantity, or are boolean flags
-    numeric_pattern_cols = [col for col in df.columns if 
-                           col.endswith('_id') or 
-                           'quantity' in col.lower() or 
-                           col.startswith('is_') or
-                           col in ['segment_id', 'new_customer_foc', 'coupon_quantity', 
-                                   'delivered_quantity', 'app_version']]
-    
-    for col in numeric_pattern_cols:
-        if col in df.columns:
-            # Convert to numeric, replacing non-numeric values with 0
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype('int64')
-    
-    # Convert monetary columns to float
-    monetary_cols = [col for col in df.columns if any(x in col.lower() for x in 
-                    ['total', 'amount', 'fee', 'discount', 'reward', 'vat', 'wallet', 'cashback', 'invoice'])]
-    
-    for col in monetary_cols:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0.0).astype('float64')
-    
-    # Fill remaining NULLs for numeric columns
-    for col in df.select_dtypes(include=['number']).columns:
-        df[col] = df[col].fillna(0)
-    
-    # Fill NULLs for string columns (only true string columns, not IDs)
-    for col in df.select_dtypes(include=['object', 'string']).columns:
-        if not col.endswith('_id') and 'quantity' not in col.lower():
-            df[col] = df[col].fillna('')
-    
-    # Convert datetimes
-    for col in ['event_timestamp', 'created_at', 'updated_at']:
-        if col in df.columns:
-            df[col] = pd.to_datetime(df[col], errors='coerce')
-    
-    # Convert delivery_date to date (with format to suppress warning)
-    if 'delivery_date' in df.columns:
-        df['delivery_date'] = pd.to_datetime(df['delivery_date'], format='mixed', errors='coerce')
-    
-    # Convert delivery_time to datetime (ClickHouse expects DateTime, not Time)
-    if 'delivery_time' in df.columns:
-        df['delivery_time'] = pd.to_datetime(df['delivery_time'], format='mixed', errors='coerce')
-    
-    # Convert invoice_date to date
-    if 'invoice_date' in df.columns:
-        df['invoice_date'] = pd.to_datetime(df['invoice_date'], format='mixed', errors='coerce')
+    # Convert every ClickHouse column by its declared type (plan compiled once per schema)
+    plan = get_transform_plan(ch_schema, df.columns)
+    df = plan.apply(df)
+    if ETL_CONFIG['narrow_dtypes']:
+        before = df.memory_usage(deep=True).sum()
+        df = plan.narrow(df)
+        df.attrs['narrowed'] = (before, df.memory_usage(deep=True).sum())
+    return df
+
+def log_narrowed(before, after):
+    """Report what narrow_dtypes saved on a batch"""
+    set_gauge('narrowed_bytes_saved', int(before - after))
+    log(f"✓ Narrowed dtypes: {before / 1024 / 1024:.1f} MB → {after / 1024 / 1024:.1f} MB "
+        f"({(after - before) / max(before, 1):+.0%})")
+
+def transform_events(df, ch_schema):
+    """
+    Transform a DataFrame, or an iterator of DataFrame chunks (stream_events)
+    Chunks are transformed as they are read, so only one chunk of raw rows is
+    in memory at a time, next to the much smaller typed columns
+    """
+    if not isinstance(df, pd.DataFrame):
+        chunks = []
+        scanned_rows = 0
+        rows = iter(df)
+        while True:
+            # Reading and transforming alternate, so each is timed as its own stage
+            with stage('extract') as sample:
+                chunk = next(rows, None)
+                if chunk is not None:
+                    sample['rows'], sample['bytes'] = len(chunk), frame_bytes(chunk)
+            if chunk is None:
+                break
+            scanned_rows += len(chunk)
+            scanned_last_id = int(chunk['order_log_id'].iloc[-1])
+            with stage('transform') as sample:
+                chunks.append(transform_chunk(chunk, ch_schema))
+                sample['rows'], sample['bytes'] = len(chunks[-1]), frame_bytes(chunks[-1])
+        if not chunks:
+            return pd.DataFrame()
+        df = chunks[0] if len(chunks) == 1 else pd.concat(chunks, ignore_index=True)
+        if ETL_CONFIG['narrow_dtypes']:
+            before = sum(chunk.attrs['narrowed'][0] for chunk in chunks)
+            if len(chunks) > 1:
+                # Chunks with different categories concatenate to object columns
+                df = get_transform_plan(ch_schema, df.columns).narrow(df)
+            log_narrowed(before, df.memory_usage(deep=True).sum())
+        # Rows read, for paging past events the status policy left out
+        df.attrs['scanned'] = (scanned_rows, scanned_last_id)
+        log(f"✓ Extracted and transformed {len(chunks)} chunks - shape: {df.shape}")
+        return df
     
-    # Reorder columns to match ClickHouse table
-    df = df[[col for col in ch_cols if col in df.columns]]
+    if df.empty:
+        return df
     
+    log("Transforming...")
+    with stage('transform') as sample:
+        df = transform_chunk(df, ch_schema)
+        sample['rows'], sample['bytes'] = len(df), frame_bytes(df)
     log(f"✓ Transformed - shape: {df.shape}")
+    if 'narrowed' in df.attrs:
+        log_narrowed(*df.attrs['narrowed'])
     return df
 
-def load_events(df, ch_client):
+def load_events(df, ch_client, settings=None):
     if df.empty:
         return 0
     
     log(f"Loading {len(df)} events to ClickHouse...")
-    ch_client.insert_df('events_data', df)
+    started = time.monotonic()
+    with stage('load') as sample:
+        summary = ch_client.insert_df('events_data', df, settings=insert_settings(settings))
+        sample['rows'] = len(df)
+        sample['bytes'] = summary.written_bytes() if summary is not None else 0
+    set_gauge('max_event_timestamp', _event_epoch(_epoch(df['event_timestamp'].max())))
     
     max_id = df['event_id'].max()
-    log(f"✓ Loaded - max event_id: {max_id}")
+    log(f"✓ Loaded - max event_id: {max_id} ({describe_insert(summary, len(df), time.monotonic() - started)})")
     return max_id
 
-def main():
-    log("="*70)
-    log("EVENTS ETL - INCREMENTAL")
-    log("="*70)
+def build_log_query(last_synced_id, batch_size, end_id=None):
+    """Narrow order_logs-only query for the orders cache mode, returns (query, params)"""
+    query = f"""
+    SELECT ol.order_log_id, ol.order_id, ol.order_status_id, ol.created_at AS created_at_log
+    FROM {source_table('ol')}
+    WHERE ol.order_log_id > %s"""
+    params = [last_synced_id]
+    if end_id is not None:
+        query += " AND ol.order_log_id <= %s"
+        params.append(end_id)
+    query += extract_filter_sql()
+    query += """
+    ORDER BY ol.order_log_id
+    LIMIT %s"""
+    params.append(batch_size)
+    return query, tuple(params)
+
+_orders_cache = None
+
+def get_orders_cache(conn, order_cols):
+    """Process-wide orders cache, rebuilt when the orders columns change"""
+    global _orders_cache
+    if _orders_cache is None or _orders_cache.order_cols != order_cols:
+        _orders_cache = OrdersCache(order_cols, ETL_CONFIG['orders_cache_size'])
+        _orders_cache.start(conn)
+    return _orders_cache
+
+def extract_cached_columns(last_synced_id, conn, orders_cols, batch_size, end_id=None):
+    """
+    Orders cache mode: narrow order_logs batch enriched from memory
+    Events without an order are dropped after the LIMIT, so attrs['scanned']
+    carries the (rows, last order_log_id) actually read for paging
+    """
+    cache = get_orders_cache(conn, [col for col in ORDER_COLUMNS if col in orders_cols])
+    log(f"✓ Querying order_logs > {last_synced_id} (batch: {batch_size}, orders cache)")
+    while True:
+        query, params = build_log_query(last_synced_id, batch_size, end_id)
+        with stage('extract') as sample:
+            logs = fetch_columns(conn, query, params)
+            if not logs.empty:
+                logs.attrs['scanned'] = (len(logs), int(logs.columns['order_log_id'][-1]))
+            batch = cache.enrich(conn, logs)
+            sample['rows'], sample['bytes'] = len(batch), batch.nbytes()
+        # Keep paging past a batch made only of orphaned events
+        if not batch.empty or len(logs) < batch_size:
+            break
+        last_synced_id = logs.attrs['scanned'][1]
+    log(f"✓ Extracted {len(batch)} events ({cache.stats()})")
+    return batch
+
+def extract_cached_events(*args):
+    """Orders cache mode as a DataFrame"""
+    batch = extract_cached_columns(*args)
+    df = pd.DataFrame(batch.columns)
+    df.attrs.update(batch.attrs)
+    return df
+
+def extract_event_columns(last_synced_id, conn, orders_cols, batch_size, end_id=None):
+    """Columnar fast path: one batch as per-column lists from an unbuffered cursor"""
+    query, params = build_select_query(orders_cols, last_synced_id, batch_size, end_id)
+    log(f"✓ Querying order_logs > {last_synced_id} (batch: {batch_size}, columnar)")
+    with stage('extract') as sample:
+        batch = fetch_columns(conn, query, params)
+        sample['rows'], sample['bytes'] = len(batch), batch.nbytes()
+    log(f"✓ Extracted {len(batch)} events")
+    return batch
+
+def transform_event_columns(batch, ch_schema):
+    narrowed = None
+    with stage('transform') as sample:
+        batch = transform_columns(batch, ch_schema)
+        if ETL_CONFIG['narrow_dtypes']:
+            # Column buffers only - shared strings save more than this shows
+            before = batch.nbytes()
+            batch = narrow_columns(batch, ch_schema)
+            narrowed = (before, batch.nbytes())
+        sample['rows'], sample['bytes'] = len(batch), batch.nbytes()
+    if narrowed is not None:
+        log_narrowed(*narrowed)
+    return batch
+
+def load_event_columns(batch, ch_client, ch_schema, settings=None):
+    if batch.empty:
+        return 0
+    
+    log(f"Loading {len(batch)} events to ClickHouse (columnar)...")
+    started = time.monotonic()
+    with stage('load') as sample:
+        summary = insert_columns(ch_client, batch, ch_schema, settings=insert_settings(settings))
+        sample['rows'] = len(batch)
+        sample['bytes'] = summary.written_bytes() if summary is not None else 0
+    set_gauge('max_event_timestamp', _event_epoch(max(batch.columns['event_timestamp'])))
+    
+    max_id = int(batch.columns['event_id'].max())
+    log(f"✓ Loaded - max event_id: {max_id} ({describe_insert(summary, len(batch), time.monotonic() - started)})")
+    return max_id
+
+def _epoch(timestamp):
+    """Epoch seconds of a pandas Timestamp (None for NaT)"""
+    return None if pd.isna(timestamp) else int(pd.Timestamp(timestamp).timestamp())
+
+def _event_epoch(seconds):
+    """
+    Real epoch seconds of an event_timestamp: it holds MySQL's local time sent
+    as UTC (see etl_rollups), so MySQL's UTC offset is taken back off
+    """
+    return None if seconds is None else seconds - get_gauge('mysql_utc_offset', 0)
+
+def get_head_id(conn):
+    """Latest order_log_id in MySQL (primary key lookup)"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT MAX(order_log_id) FROM order_logs")
+    head_id = cursor.fetchone()[0] or 0
+    cursor.close()
+    return head_id
+
+def get_utc_offset(conn):
+    """Seconds MySQL's session time zone is ahead of UTC"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT TIMESTAMPDIFF(SECOND, UTC_TIMESTAMP(), NOW())")
+    offset = int(cursor.fetchone()[0] or 0)
+    cursor.close()
+    return offset
+
+def sync_batches(ch_client, ch_schema, last_id, conn=None, stop_event=None):
+    """
+    Sync events batch by batch, committing last_sync_id after each inserted block
+    Every insert carries a dedup token for its id range, and a batch that was
+    inserted but never checkpointed is re-extracted over exactly that range,
+    so the retry is dropped by ClickHouse instead of duplicating rows
+    With staging on, blocks are shipped from local files (see etl_staging)
+    In catch-up mode, keeps going until the MySQL head or the run's time
+    budget is reached, adapting the batch size as it goes
+    Pass an open conn to reuse it; set stop_event to finish after the current batch
+    Returns (events synced, committed order_log_id)
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = connect_source()
+    catch_up = ETL_CONFIG['catch_up']
+    stopping = lambda: stop_event is not None and stop_event.is_set()
     
     try:
-        # Connect
-        log("\n[1/6] Connecting...")
-        ch_client = clickhouse_connect.get_client(**CH_CONFIG)
-        log("✓ Connected")
+        orders_cols = schema_cache.mysql_columns(conn, 'orders', get_mysql_columns)
+        set_gauge('mysql_utc_offset', get_utc_offset(conn))
         
-        # Get ClickHouse columns
-        log("\n[2/6] Getting ClickHouse table schema...")
-        ch_cols = get_clickhouse_columns(ch_client)
-        log(f"✓ ClickHouse table has {len(ch_cols)} columns")
+        if catch_up:
+            head_id = get_head_id(conn)
+            log(f"✓ Lag at start: {max(head_id - last_id, 0):,} ids (head: {head_id}, checkpoint: {last_id})")
+            sizer = AdaptiveBatchSizer(
+                ETL_CONFIG['batch_size'],
+                ETL_CONFIG['min_batch_size'],
+                ETL_CONFIG['max_batch_size'],
+                ETL_CONFIG['target_batch_seconds'],
+                ETL_CONFIG['max_batch_memory_mb']
+            )
+            deadline = time.monotonic() + ETL_CONFIG['max_run_seconds']
+            should_continue = lambda: time.monotonic() < deadline and not stopping()
+            max_batches = None
+        else:
+            sizer = None
+            should_continue = lambda: not stopping()
+            max_batches = ETL_CONFIG['pipeline_max_batches'] if ETL_CONFIG['pipelined'] else 1
         
-        # Get last ID
-        log("\n[3/6] Checking last sync...")
-        last_id = get_last_synced_id()
+        # Replica lag and MySQL load are checked before each batch is read
+        throttle = SourceThrottle(conn, stop_event)
+        keep_going = should_continue
+        should_continue = lambda: keep_going() and throttle.before_query()
         
-        # Extract
-        log("\n[4/6] Extracting...")
-        df = extract_events(last_id)
+        use_orders_cache = ETL_CONFIG['orders_cache']
+        if use_orders_cache and 'updated_at' not in orders_cols:
+            log("⚠ orders.updated_at missing - orders cache can't refresh, joining in MySQL")
+            use_orders_cache = False
         
-        if df.empty:
-            log("\n✓ No new events - up to date!")
-            return 0
+        if ETL_CONFIG['columnar_fast_path']:
+            extract = extract_cached_columns if use_orders_cache else extract_event_columns
+            transform = lambda batch: transform_event_columns(batch, ch_schema)
+            load = lambda batch, settings: load_event_columns(batch, ch_client, ch_schema, settings)
+            last_id_of = lambda batch: int(batch.columns['order_log_id'][-1])
+            batch_bytes = lambda batch: batch.nbytes()
+            concat = concat_batches
+        elif ETL_CONFIG['streaming_extract'] and not use_orders_cache:
+            implementation = "C extension" if type(conn).__name__.startswith('CMySQL') else "pure Python"
+            log(f"✓ Streaming extraction in {ETL_CONFIG['stream_chunk_rows']:,}-row chunks ({implementation})")
+            # Chunks are transformed as they arrive, so the extract stage returns the finished batch
+            extract = lambda *args: transform_events(stream_events(*args), ch_schema)
+            transform = lambda df: df
+            load = lambda df, settings: load_events(df, ch_client, settings)
+            last_id_of = lambda df: int(df['event_id'].iloc[-1])
+            batch_bytes = lambda df: df.memory_usage(deep=True).sum()
+            concat = lambda dfs: pd.concat(dfs, ignore_index=True)
+        else:
+            if use_orders_cache:
+                extract = extract_cached_events
+            else:
+                extract = extract_events
+            transform = lambda df: transform_events(df, ch_schema)
+            load = lambda df, settings: load_events(df, ch_client, settings)
+            last_id_of = lambda df: int(df['order_log_id'].iloc[-1])
+            batch_bytes = lambda df: df.memory_usage(deep=True).sum()
+            concat = lambda dfs: pd.concat(dfs, ignore_index=True)
+        
+        tracking_file = ETL_CONFIG['tracking_file']
+        staging = ETL_CONFIG['staging']
+        rollups = rollup_mode()
+        committed_id = last_id
+        load_error = None  # set once ClickHouse fails - later blocks are only staged
+        
+        def commit(loaded_id):
+            nonlocal committed_id
+            save_last_synced_id(loaded_id, ch_client)
+            committed_id = loaded_id
+        
+        start_id = last_id
+        if staging:
+            # Blocks staged by earlier runs go first, so their rows aren't read from MySQL again
+            committed_id, start_id, load_error = ship_chain(ch_client, last_id, commit)
+            if start_id > last_id:
+                log(f"✓ Staged files: shipped up to {committed_id}, staged up to {start_id}")
+        
+        replay = read_pending(tracking_file)
+        if replay is not None and replay[0] != start_id:
+            replay = None  # that batch was checkpointed
+        replay_ids = None
+        drained = None  # (committed by then, scanned up to) once a read reaches the end
+        
+        def throttled_extract(*args):
+            started = time.monotonic()
+            batch = extract(*args)
+            throttle.after_query(len(batch), time.monotonic() - started)
+            return batch
+        
+        def extract_batch(after_id):
+            nonlocal replay, replay_ids, drained
+            batch_size = sizer.batch_size if sizer else ETL_CONFIG['batch_size']
+            if replay is not None:
+                end_id = replay[1]
+                replay = None
+                log(f"⚠ Replaying unconfirmed batch {after_id}-{end_id}")
+                batch = throttled_extract(after_id, conn, orders_cols, max(batch_size, end_id - after_id), end_id)
+                if not batch.empty:
+                    replay_ids = (after_id, end_id)
+                    return batch, end_id, False
+            first_after_id = after_id
+            while True:
+                # The INNER JOIN (and the WHERE under 'drop') hide rows, so the head
+                # read before the page is how far a page that comes back short has scanned
+                head_id = get_head_id(conn)
+                batch = throttled_extract(after_id, conn, orders_cols, batch_size)
+                if 'scanned' in batch.attrs:
+                    scanned_rows, scanned_last_id = batch.attrs['scanned']
+                elif batch.empty:
+                    scanned_rows, scanned_last_id = 0, after_id
+                else:
+                    scanned_rows, scanned_last_id = len(batch), last_id_of(batch)
+                # Keep paging past a full page whose rows were all left out
+                if not batch.empty or scanned_rows < batch_size:
+                    break
+                after_id = scanned_last_id
+            if scanned_rows < batch_size:
+                # Reached the end: the rows left out past the batch (all of them, for
+                # an empty batch the runner doesn't commit) are committed once it's done
+                drained = (first_after_id if batch.empty else scanned_last_id, max(scanned_last_id, head_id))
+            return batch, scanned_last_id, scanned_rows < batch_size
         
-        # Transform
-        log("\n[5/6] Transforming...")
-        df = transform_events(df, ch_cols)
+        def load_block(block, ids):
+            if not staging:
+                # Record the range first: a crash after the insert replays it with the same token
+                write_pending(tracking_file, *ids)
+                load(block, dedup_settings('events_data', *ids))
+                if rollups == 'load':
+                    update_rollups(ch_client, block, ids, ch_schema)
+                return
+            
+            # The staged file is the record: until it's shipped and deleted, a retry ships it again
+            nonlocal load_error
+            path = stage_path(INCREMENTAL, *ids)
+            size = write_stage(path, block, ch_schema)
+            if load_error is None:
+                started = time.monotonic()
+                try:
+                    with stage('load') as sample:
+                        summary = ship_file(ch_client, path)
+                        sample['rows'] = len(block)
+                        sample['bytes'] = summary.written_bytes() if summary is not None else 0
+                except Exception as e:
+                    load_error = e
+                    log(f"⚠ ClickHouse load failed, staging until it recovers: {e}")
+                else:
+                    log(f"✓ Loaded {len(block)} events from {os.path.basename(path)} "
+                        f"({describe_insert(summary, len(block), time.monotonic() - started)})")
+                    if rollups == 'load':
+                        update_rollups(ch_client, block, ids, ch_schema)
+                    return
+            if rollups == 'load':
+                # Shipped by a later run, without the block in memory to aggregate
+                mark_stale(block, "blocks staged while ClickHouse was down")
+            if staged_bytes() > ETL_CONFIG['staging_max_mb'] * 1024 * 1024:
+                raise load_error
+            log(f"✓ Staged {len(block)} events in {os.path.basename(path)} ({size / 1024 / 1024:.1f} MB)")
         
-        # Load
-        log("\n[6/6] Loading...")
-        max_id = load_events(df, ch_client)
+        # Small batches are inserted together (and checkpointed together) as one block
+        coalescer = BlockCoalescer(
+            load_block,
+            lambda loaded_id: commit(loaded_id) if load_error is None else None,
+            concat,
+            ETL_CONFIG['insert_block_rows'],
+            ETL_CONFIG['insert_block_mb'] * 1024 * 1024,
+            batch_bytes
+        )
         
-        # Save
-        save_last_synced_id(max_id)
+        def add_batch(batch, ids):
+            if ids != replay_ids:
+                coalescer.add(batch, ids)
+                return
+            # The replayed range is loaded alone, with the token it was first inserted
+            # under - merged into a wider block, ClickHouse wouldn't recognise the repeat
+            coalescer.flush()
+            coalescer.add(batch, ids)
+            coalescer.flush()
         
-        total = ch_client.command("SELECT COUNT(*) FROM events_data")
-        log(f"\n✓ Total events in ClickHouse: {total:,}")
-        log(f"✓ COMPLETED - Synced {len(df)} events")
+        def on_batch(batch, seconds):
+            memory = batch_bytes(batch)
+            peak_mb = peak_rss_mb()
+            log(f"✓ Batch of {len(batch)} took {seconds:.2f}s ({len(batch) / max(seconds, 1e-6):,.0f} events/s), "
+                f"{memory / 1024 / 1024:.1f} MB, peak RSS {peak_mb:.0f} MB")
+            emit({'event': 'batch', 'rows': len(batch), 'seconds': round(seconds, 4),
+                  'bytes': int(memory), 'peak_rss_mb': round(peak_mb, 1)})
+            if sizer:
+                log(f"  → next batch: {sizer.record(len(batch), seconds, memory)}")
         
+        runner_args = dict(max_batches=max_batches, should_continue=should_continue, on_batch=on_batch)
+        if ETL_CONFIG['pipelined']:
+            runner = run_pipeline
+            runner_args['queue_size'] = ETL_CONFIG['pipeline_queue_size']
+        else:
+            runner = run_sequential
+        
+        rows, batches, _ = runner(
+            extract_batch,
+            transform,
+            add_batch,
+            lambda loaded_id: None,  # the coalescer commits once its block is loaded
+            start_id,
+            **runner_args
+        )
+        coalescer.flush()
+        if load_error is not None:
+            # Everything read is on disk; the next run ships it before extracting more
+            raise load_error
+        if drained is not None and drained[0] == committed_id and drained[1] > committed_id:
+            # Only left-out rows (unmapped under 'drop', or without an order under any
+            # policy) past the last load - they're skipped for good, like the ones before
+            # a loaded row; without this the checkpoint, and the poller's lag, stay behind them
+            commit(drained[1])
+        
+        head_id = get_head_id(conn)
+        set_gauge('lag_ids', max(head_id - committed_id, 0))
+        if catch_up:
+            log(f"✓ Lag at end: {max(head_id - committed_id, 0):,} ids (head: {head_id}, checkpoint: {committed_id})")
+    finally:
+        if own_conn:
+            conn.close()
+    
+    log(f"✓ Synced {rows} events in {batches} batches")
+    return rows, committed_id
+
+def get_lag_seconds(ch_client, committed_id, lag_ids):
+    """Age of the newest checkpointed event while MySQL is ahead of it, else 0"""
+    if not lag_ids:
+        return 0
+    # Not against ClickHouse's now(): event_timestamp is MySQL's local time, not UTC
+    result = ch_client.query(
+        "SELECT toUnixTimestamp(event_timestamp) FROM events_data "
+        "WHERE event_id <= {id:UInt64} ORDER BY event_id DESC LIMIT 1",
+        parameters={'id': committed_id}
+    )
+    if not result.result_rows:
+        return None
+    return max(int(time.time()) - _event_epoch(int(result.result_rows[0][0])), 0)
+
+def run_sync(ch_client, conn=None, stop_event=None):
+    """
+    One incremental sync over already-open connections
+    Used by main() and by the in-process scheduler; returns events synced
+    The run's per-stage timings, rows and lag are appended to metrics_file
+    """
+    start_run()
+    try:
+        # Get ClickHouse columns
+        log("\n[2/4] Getting ClickHouse table schema...")
+        ch_schema = schema_cache.clickhouse_schema(ch_client, 'events_data', get_clickhouse_schema)
+        log(f"✓ ClickHouse table has {len(ch_schema)} columns")
+        
+        # Get last ID
+        log("\n[3/4] Checking last sync...")
+        last_id = get_last_synced_id(ch_client=ch_client)
+        
+        # Extract → Transform → Load
+        log("\n[4/4] Syncing...")
+        try:
+            synced, committed_id = sync_batches(ch_client, ch_schema, last_id, conn, stop_event)
+            
+            if ETL_CONFIG['order_updates']:
+                from scripts.etl_events_updates import sync_order_updates
+                sync_order_updates(ch_client, ch_schema, committed_id, conn)
+        except Exception:
+            # The failure may be a schema change - re-read both schemas next run
+            schema_cache.invalidate()
+            raise
+        
+        if synced == 0 and committed_id == last_id:
+            log("\n✓ No new events - up to date!")
+        else:
+            # Check just the id ranges this run wrote instead of counting the whole table
+            if ETL_CONFIG['reconcile_recent']:
+                from scripts.etl_reconcile import reconcile
+                with stage('reconcile'):
+                    reconcile(ch_client, last_id + 1, committed_id, conn, ETL_CONFIG['reconcile_repair'], ch_schema)
+            log(f"\n✓ COMPLETED - Synced {synced} events")
+        
+        lag_ids = get_gauge('lag_ids')
+        set_gauge('lag_seconds', get_lag_seconds(ch_client, committed_id, lag_ids))
+    except Exception as e:
+        finish_run('failed', error=str(e))
+        raise
+    
+    record = finish_run('ok', rows=synced, checkpoint=committed_id, batch_size=ETL_CONFIG['batch_size'])
+    if record is not None and record['stages']:
+        log("✓ Stages: " + ", ".join(
+            f"{name} {entry['wall_s']:.2f}s ({entry['rows_per_s']:,} rows/s)"
+            for name, entry in record['stages'].items()
+        ))
+    return synced
+
+def main():
+    parser = argparse.ArgumentParser(description="Incremental events sync")
+    parser.add_argument('--profile', choices=['cpu', 'memory'],
+                        help="run under cProfile (cpu) or tracemalloc (memory), dumped to profile_dir")
+    args = parser.parse_args()
+    
+    log("="*70)
+    log("EVENTS ETL - INCREMENTAL")
+    log("="*70)
+    
+    try:
+        # Connect
+        log("\n[1/4] Connecting...")
+        ch_client = clickhouse_connect.get_client(**CH_CONFIG)
+        log("✓ Connected")
+        
+        if args.profile:
+            _, path = profile_call(args.profile, run_sync, ch_client)
+            log(f"✓ {args.profile} profile written to {path}")
+        else:
+            run_sync(ch_client)
         return 0
     except Exception as e:
         log(f"\n✗ FAILED: {e}")
@@ -0,0 +1,170 @@
+"""
+Order Updates Stream
+Keeps events_data current when an orders row changes after its events were
+synced (an invoice amount set after delivery, a corrected delivery_date, ...).
+Changed orders are found by keyset on (orders.updated_at, order_id) with their
+own watermark, and their already-synced events are inserted again with
+version = the order's updated_at, so a ReplacingMergeTree(version) ordered by
+event_id keeps only the newest copy.
+
+Runs after every incremental sync when ETL_CONFIG['order_updates'] is on,
+or on its own:
+  python3 scripts/etl_events_updates.py
+"""
+
+import json
+import pandas as pd
+import clickhouse_connect
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import CH_CONFIG, ETL_CONFIG
+from scripts.etl_checkpoint import write_atomic
+from scripts.etl_event_types import loaded_filter_sql
+from scripts.etl_rollups import mark_stale
+from scripts.etl_source import connect_source
+from scripts.etl_transform_plan import get_clickhouse_schema
+from scripts.etl_events_main import (
+    log, get_mysql_columns, get_last_synced_id, select_clause,
+    transform_events, load_events, schema_cache
+)
+
+_version_warned = False
+
+def load_watermark():
+    """(updated_at, order_id) of the last changed order handled, None on first run"""
+    path = ETL_CONFIG['order_updates_file']
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        watermark = json.load(f)
+    return watermark['updated_at'], watermark['order_id']
+
+def save_watermark(updated_at, order_id):
+    write_atomic(
+        ETL_CONFIG['order_updates_file'],
+        json.dumps({'updated_at': str(updated_at), 'order_id': order_id})
+    )
+
+def get_update_cutoff(conn):
+    """MySQL's clock minus the lag - newer updates wait for the next run"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT NOW() - INTERVAL %s SECOND", (ETL_CONFIG['order_updates_lag_seconds'],))
+    cutoff = cursor.fetchone()[0]
+    cursor.close()
+    return cutoff
+
+def get_changed_orders(conn, watermark, cutoff, limit):
+    """
+    Next page of [(order_id, updated_at)] after the watermark
+    An index on orders.updated_at serves this (InnoDB appends the primary key)
+    """
+    updated_at, order_id = watermark
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT order_id, updated_at
+        FROM orders
+        WHERE (updated_at > %s OR (updated_at = %s AND order_id > %s))
+          AND updated_at < %s
+        ORDER BY updated_at, order_id
+        LIMIT %s
+    """, (updated_at, updated_at, order_id, cutoff, limit))
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+def extract_order_events(conn, orders_cols, order_ids, max_log_id):
+    """Already-synced events (order_log_id <= max_log_id) of the given orders, as loaded"""
+    placeholders = ", ".join(["%s"] * len(order_ids))
+    query = f"""
+    SELECT
+        {select_clause(tuple(orders_cols))}
+    FROM order_logs ol
+    INNER JOIN orders o ON ol.order_id = o.order_id
+    WHERE ol.order_id IN ({placeholders}) AND ol.order_log_id <= %s{loaded_filter_sql()}
+    ORDER BY ol.order_log_id
+    """
+    return pd.read_sql(query, conn, params=[*order_ids, max_log_id])
+
+def add_version(df):
+    """version = orders.updated_at in epoch seconds, so the newest order row wins"""
+    stamps = pd.to_datetime(df['updated_at'], format='mixed', errors='coerce')
+    seconds = (stamps - pd.Timestamp(0)) // pd.Timedelta(seconds=1)
+    df['version'] = seconds.fillna(0).astype('int64')
+    return df
+
+def sync_order_updates(ch_client, ch_schema, max_log_id, conn=None):
+    """
+    Rewrite the synced events of every order changed since the watermark
+    Events past max_log_id are left to the main stream, which reads the
+    current order row anyway. Returns events rewritten
+    """
+    global _version_warned
+    own_conn = conn is None
+    if own_conn:
+        conn = connect_source()
+    batch_size = ETL_CONFIG['order_updates_batch_size']
+
+    try:
+        cutoff = get_update_cutoff(conn)
+        watermark = load_watermark()
+        if watermark is None:
+            # Nothing to rewrite yet - everything synced so far is current
+            save_watermark(cutoff, 0)
+            log(f"✓ Order updates: watermark started at {cutoff}")
+            return 0
+
+        if not _version_warned and 'version' not in [name for name, _ in ch_schema]:
+            log("⚠ events_data has no version column - rewritten events rely on "
+                "ReplacingMergeTree keeping the last insert")
+            _version_warned = True
+
+        orders_cols = schema_cache.mysql_columns(conn, 'orders', get_mysql_columns)
+        changed_orders = 0
+        rewritten = 0
+        while True:
+            changed = get_changed_orders(conn, watermark, cutoff, batch_size)
+            if not changed:
+                break
+
+            order_ids = sorted({order_id for order_id, _ in changed})
+            df = extract_order_events(conn, orders_cols, order_ids, max_log_id)
+            if not df.empty:
+                df = transform_events(add_version(df), ch_schema)
+                load_events(df, ch_client)
+                mark_stale(df, "order updates")
+                rewritten += len(df)
+
+            last_order_id, last_updated_at = changed[-1]
+            watermark = (last_updated_at, last_order_id)
+            save_watermark(*watermark)
+            changed_orders += len(changed)
+            if len(changed) < batch_size:
+                break
+    finally:
+        if own_conn:
+            conn.close()
+
+    log(f"✓ Order updates: {changed_orders} changed orders → {rewritten} events rewritten")
+    return rewritten
+
+def main():
+    log("="*70)
+    log("EVENTS ETL - ORDER UPDATES")
+    log("="*70)
+
+    try:
+        ch_client = clickhouse_connect.get_client(**CH_CONFIG)
+        ch_schema = get_clickhouse_schema(ch_client)
+        max_log_id = get_last_synced_id(ch_client=ch_client)
+        sync_order_updates(ch_client, ch_schema, max_log_id)
+        return 0
+    except Exception as e:
+        log(f"\n✗ FAILED: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+"""
+ClickHouse Insert Tuning
+Settings for every insert (async inserts), coalescing of small batches into
+larger blocks (fewer parts for the server to merge), a pool of clients for
+concurrent inserts, and a one-line summary of what each insert wrote.
+Transport compression is set on the client itself (CH_CONFIG['compress']).
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from config.config import ETL_CONFIG
+
+def insert_settings(extra=None):
+    """Per-insert settings from ETL_CONFIG, plus e.g. a dedup token"""
+    settings = {}
+    if ETL_CONFIG['async_insert']:
+        settings['async_insert'] = 1
+        settings['wait_for_async_insert'] = 1 if ETL_CONFIG['wait_for_async_insert'] else 0
+        settings['async_insert_deduplicate'] = 1
+    if ETL_CONFIG['rollups'] == 'view':
+        # A retried insert is dropped by the rollups' materialized views too
+        settings['deduplicate_blocks_in_dependent_materialized_views'] = 1
+    if extra:
+        settings.update(extra)
+    return settings
+
+def describe_insert(summary, rows, seconds):
+    """'12.3 MB written, 45,000 rows/s, 10.1 MB/s' from the insert's QuerySummary"""
+    written = summary.written_bytes() if summary is not None else 0
+    seconds = max(seconds, 1e-6)
+    return (f"{written / 1024 / 1024:.1f} MB written, {rows / seconds:,.0f} rows/s, "
+            f"{written / 1024 / 1024 / seconds:.1f} MB/s")
+
+class BlockCoalescer:
+    """
+    Buffers consecutive batches and loads them as one block once it holds
+    block_rows rows or block_bytes bytes; the checkpoint is committed per block
+    load_block(block, (after_id, last_id)) and commit(last_id) run on flush
+    """
+
+    def __init__(self, load_block, commit, concat, block_rows, block_bytes, nbytes):
+        self.load_block = load_block
+        self.commit = commit
+        self.concat = concat
+        self.block_rows = block_rows
+        self.block_bytes = block_bytes
+        self.nbytes = nbytes
+        self.committed_id = None
+        self._batches = []
+        self._rows = 0
+        self._bytes = 0
+        self._after_id = None
+        self._last_id = None
+
+    def add(self, batch, ids):
+        if not self._batches:
+            self._after_id = ids[0]
+        self._batches.append(batch)
+        self._last_id = ids[1]
+        self._rows += len(batch)
+        self._bytes += self.nbytes(batch)
+        if self._rows >= self.block_rows or self._bytes >= self.block_bytes:
+            self.flush()
+
+    def flush(self):
+        """Load and commit whatever is buffered"""
+        if not self._batches:
+            return
+        block = self._batches[0] if len(self._batches) == 1 else self.concat(self._batches)
+        ids = (self._after_id, self._last_id)
+        self._batches = []
+        self._rows = 0
+        self._bytes = 0
+        self.load_block(block, ids)
+        self.commit(ids[1])
+        self.committed_id = ids[1]
+
+class InsertPool:
+    """
+    Runs inserts on up to `workers` threads, each with its own ClickHouse
+    client (one client can't run two queries at once)
+    submit() blocks while `workers` inserts are already in flight
+    """
+
+    def __init__(self, workers, make_client):
+        self.make_client = make_client
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ch-insert")
+        self._slots = threading.Semaphore(workers)
+        self._local = threading.local()
+        self._clients = []
+        self._clients_lock = threading.Lock()
+        self._futures = []
+
+    def _client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.make_client()
+            with self._clients_lock:
+                self._clients.append(client)
+        return client
+
+    def _raise_failed(self):
+        """Re-raise the first insert that has failed so far; forget the finished ones"""
+        pending = []
+        for future in self._futures:
+            if not future.done():
+                pending.append(future)
+            elif future.exception() is not None:
+                raise future.exception()
+        self._futures = pending
+
+    def submit(self, insert, *args):
+        """
+        Run insert(client, *args) on a pool thread
+        Raises an earlier insert's failure instead, so the caller stops reading
+        rather than finding out in wait()
+        """
+        self._slots.acquire()
+        try:
+            self._raise_failed()
+        except BaseException:
+            self._slots.release()
+            raise
+
+        def run():
+            try:
+                return insert(self._client(), *args)
+            finally:
+                self._slots.release()
+
+        self._futures.append(self._executor.submit(run))
+
+    def wait(self):
+        """Block until every submitted insert is done; re-raise the first failure"""
+        futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        for client in self._clients:
+            client.close()
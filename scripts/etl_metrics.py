@@ -0,0 +1,252 @@
+"""
+ETL Metrics
+Per-stage wall/CPU time, rows and bytes, collected while a run executes and
+written as one JSON line per run (and per batch) to ETL_CONFIG['metrics_file'].
+A long-running scheduler can also serve the totals in Prometheus text format
+on ETL_CONFIG['metrics_port'], and a single run can be profiled with cProfile
+(cpu) or tracemalloc (memory):
+
+  python3 scripts/etl_events_main.py --profile cpu
+  curl -s localhost:9108/metrics
+"""
+
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config.config import ETL_CONFIG
+
+_lock = threading.Lock()
+_run = None      # stage totals of the sync run in progress (stages on any thread)
+_thread = threading.local()  # .run: a named run started on this thread (pipelines run side by side)
+_totals = {}     # stage totals since the process started
+_gauges = {}     # latest value of each gauge
+_runs = {'ok': 0, 'failed': 0}
+_samples = None  # (stage, wall_s, rows) of every call while collect_samples() is on
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS reports bytes
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+def _add(totals, name, wall, cpu, rows, nbytes):
+    entry = totals.setdefault(name, {'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'rows': 0, 'bytes': 0})
+    entry['calls'] += 1
+    entry['wall_s'] += wall
+    entry['cpu_s'] += cpu
+    entry['rows'] += rows
+    entry['bytes'] += nbytes
+
+@contextmanager
+def stage(name):
+    """
+    Time a block as one call of stage `name`; set sample['rows'] / sample['bytes']
+    inside it. CPU time is that of the calling thread, so pipelined stages
+    running on their own threads are measured separately
+    """
+    sample = {'rows': 0, 'bytes': 0}
+    wall_started = time.perf_counter()
+    cpu_started = time.thread_time()
+    try:
+        yield sample
+    finally:
+        wall = time.perf_counter() - wall_started
+        cpu = time.thread_time() - cpu_started
+        with _lock:
+            _add(_totals, name, wall, cpu, sample['rows'], sample['bytes'])
+            run = getattr(_thread, 'run', None) or _run
+            if run is not None:
+                _add(run['stages'], name, wall, cpu, sample['rows'], sample['bytes'])
+            if _samples is not None:
+                _samples.append((name, wall, sample['rows']))
+
+def collect_samples(enabled=True):
+    """Keep every stage call (for latency percentiles) until take_samples()"""
+    global _samples
+    with _lock:
+        _samples = [] if enabled else None
+
+def take_samples():
+    """[(stage, wall_s, rows)] collected so far; collection stays on"""
+    global _samples
+    with _lock:
+        samples, _samples = _samples or [], ([] if _samples is not None else None)
+    return samples
+
+def set_gauge(name, value):
+    with _lock:
+        _gauges[name] = value
+
+def get_gauge(name, default=None):
+    with _lock:
+        return _gauges.get(name, default)
+
+def frame_bytes(df):
+    """Shallow in-memory size of a DataFrame (object columns count 8 bytes a value)"""
+    return int(df.memory_usage(index=False).sum())
+
+def emit(record):
+    """Append one JSON line to metrics_file (if set)"""
+    path = ETL_CONFIG['metrics_file']
+    if not path:
+        return
+    record = {'ts': datetime.now().isoformat(timespec='seconds'), **record}
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with _lock, open(path, 'a') as f:
+        f.write(json.dumps(record, default=str) + "\n")
+
+def start_run(name=None):
+    """
+    Start collecting a run's stages: the sync's own run (stages from any
+    thread), or a named run that only collects the calling thread's stages,
+    so pipelines running side by side each get their own
+    """
+    global _run
+    # A named run's CPU time is its thread's - the process's includes the other pipelines
+    clock = time.thread_time if name else time.process_time
+    run = {'name': name, 'started': time.perf_counter(), 'clock': clock, 'cpu_started': clock(), 'stages': {}}
+    with _lock:
+        if name:
+            _thread.run = run
+        else:
+            _run = run
+
+def finish_run(status, **fields):
+    """Close the calling thread's named run (else the sync's run), emit its JSON line and return it"""
+    global _run
+    with _lock:
+        run = getattr(_thread, 'run', None)
+        if run is not None:
+            _thread.run = None
+        else:
+            run, _run = _run, None
+        _runs[status] = _runs.get(status, 0) + 1
+        # The gauges (lag, max timestamp) describe events_data's sync
+        gauges = dict(_gauges) if run is None or not run['name'] else {}
+    if run is None:
+        return None
+
+    stages = {}
+    for name, entry in run['stages'].items():
+        wall = max(entry['wall_s'], 1e-9)
+        stages[name] = {
+            **entry,
+            'wall_s': round(entry['wall_s'], 4),
+            'cpu_s': round(entry['cpu_s'], 4),
+            'rows_per_s': round(entry['rows'] / wall),
+            'mb_per_s': round(entry['bytes'] / 1024 / 1024 / wall, 2)
+        }
+    record = {
+        'event': 'run',
+        **({'pipeline': run['name']} if run['name'] else {}),
+        'status': status,
+        'wall_s': round(time.perf_counter() - run['started'], 4),
+        'cpu_s': round(run['clock']() - run['cpu_started'], 4),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        **gauges,
+        **fields,
+        'stages': stages
+    }
+    set_gauge('last_run_timestamp', time.time())
+    if status == 'ok':
+        set_gauge('last_success_timestamp', time.time())
+    emit(record)
+    return record
+
+def prometheus_text():
+    """All totals and gauges in Prometheus text exposition format"""
+    lines = []
+    with _lock:
+        totals = {name: dict(entry) for name, entry in _totals.items()}
+        gauges = dict(_gauges)
+        runs = dict(_runs)
+
+    for metric, key, help_text in (
+        ('etl_stage_seconds_total', 'wall_s', 'Wall time spent in each stage'),
+        ('etl_stage_cpu_seconds_total', 'cpu_s', 'CPU time spent in each stage'),
+        ('etl_stage_rows_total', 'rows', 'Rows handled by each stage'),
+        ('etl_stage_bytes_total', 'bytes', 'Bytes handled by each stage'),
+        ('etl_stage_calls_total', 'calls', 'Calls of each stage'),
+    ):
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+        for name, entry in sorted(totals.items()):
+            lines.append(f'{metric}{{stage="{name}"}} {entry[key]}')
+
+    lines += ["# HELP etl_runs_total Runs by outcome", "# TYPE etl_runs_total counter"]
+    for status, count in sorted(runs.items()):
+        lines.append(f'etl_runs_total{{status="{status}"}} {count}')
+
+    gauges['peak_rss_mb'] = peak_rss_mb()
+    for name, value in sorted(gauges.items()):
+        if isinstance(value, (int, float)):
+            lines += [f"# TYPE etl_{name} gauge", f"etl_{name} {value}"]
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = prometheus_text().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes would flood the scheduler log
+
+def serve(port, host='127.0.0.1'):
+    """Serve /metrics from a daemon thread; returns the server"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+def profile_call(kind, func, *args):
+    """
+    Run func(*args) under cProfile ('cpu') or tracemalloc ('memory') and dump
+    the profile to profile_dir; returns (func's result, dump path)
+    cProfile only sees the calling thread - profile with pipelined off
+    """
+    os.makedirs(ETL_CONFIG['profile_dir'], exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+
+    if kind == 'cpu':
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        try:
+            result = profiler.runcall(func, *args)
+        finally:
+            path = os.path.join(ETL_CONFIG['profile_dir'], f"etl-{stamp}.prof")
+            profiler.dump_stats(path)
+            # Also a readable top-30 next to it (open the .prof with snakeviz/pstats for more)
+            with open(f"{path}.txt", 'w') as f:
+                pstats.Stats(profiler, stream=f).sort_stats('cumulative').print_stats(30)
+        return result, path
+
+    if kind == 'memory':
+        import tracemalloc
+        tracemalloc.start(25)
+        try:
+            result = func(*args)
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            path = os.path.join(ETL_CONFIG['profile_dir'], f"etl-{stamp}-memory.txt")
+            with open(path, 'w') as f:
+                f.write(f"traced peak {peak / 1024 / 1024:.1f} MB, current {current / 1024 / 1024:.1f} MB\n\n")
+                for stat in snapshot.statistics('lineno')[:30]:
+                    f.write(f"{stat}\n")
+        return result, path
+
+    raise ValueError(f"Unknown profile kind: {kind!r} (use 'cpu' or 'memory')")
@@ -0,0 +1,119 @@
+"""
+Orders Dimension Cache
+Lets the incremental sync read only the narrow order_logs rows and copy the
+wide orders columns from memory. Orders are kept in an LRU keyed by order_id,
+misses are fetched in bulk with WHERE order_id IN (...), and rows changed in
+MySQL are found through orders.updated_at and evicted, so the next event for
+that order fetches the current row.
+"""
+
+import threading
+from collections import OrderedDict
+
+from scripts.etl_columnar import ColumnBatch
+
+class OrdersCache:
+    """LRU of orders rows (tuples in order_cols order) bounded by max_orders"""
+
+    def __init__(self, order_cols, max_orders, fetch_chunk=1000):
+        self.order_cols = list(order_cols)
+        self.max_orders = max_orders
+        self.fetch_chunk = fetch_chunk
+        self.watermark = None
+        self.hits = 0
+        self.misses = 0
+        self._rows = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start(self, conn):
+        """Take the updated_at watermark - must run before the first fill"""
+        cursor = conn.cursor()
+        cursor.execute("SELECT MAX(updated_at) FROM orders")
+        self.watermark = cursor.fetchone()[0]
+        cursor.close()
+
+    def refresh(self, conn):
+        """
+        Evict cached orders updated since the watermark
+        Only order_id/updated_at are read (needs an index on orders.updated_at)
+        """
+        cursor = conn.cursor()
+        if self.watermark is None:
+            cursor.execute("SELECT order_id, updated_at FROM orders WHERE updated_at IS NOT NULL")
+        else:
+            # >= so rows written later within the same second aren't missed
+            cursor.execute(
+                "SELECT order_id, updated_at FROM orders WHERE updated_at >= %s",
+                (self.watermark,)
+            )
+        changed = cursor.fetchall()
+        cursor.close()
+
+        with self._lock:
+            for order_id, updated_at in changed:
+                self._rows.pop(order_id, None)
+                if self.watermark is None or updated_at > self.watermark:
+                    self.watermark = updated_at
+        return len(changed)
+
+    def _fetch(self, conn, order_ids):
+        cols = ", ".join(['order_id'] + self.order_cols)
+        rows = {}
+        cursor = conn.cursor()
+        for i in range(0, len(order_ids), self.fetch_chunk):
+            chunk = order_ids[i:i + self.fetch_chunk]
+            placeholders = ", ".join(["%s"] * len(chunk))
+            cursor.execute(f"SELECT {cols} FROM orders WHERE order_id IN ({placeholders})", chunk)
+            for row in cursor.fetchall():
+                rows[row[0]] = tuple(row[1:])
+        cursor.close()
+        return rows
+
+    def get_many(self, conn, order_ids):
+        """{order_id: row} for every id that exists in orders"""
+        found = {}
+        missing = []
+        with self._lock:
+            for order_id in order_ids:
+                row = self._rows.get(order_id)
+                if row is None:
+                    missing.append(order_id)
+                else:
+                    self._rows.move_to_end(order_id)
+                    found[order_id] = row
+            self.hits += len(found)
+            self.misses += len(missing)
+
+        if missing:
+            fetched = self._fetch(conn, sorted(missing))
+            found.update(fetched)
+            with self._lock:
+                self._rows.update(fetched)
+                while len(self._rows) > self.max_orders:
+                    self._rows.popitem(last=False)
+        return found
+
+    def enrich(self, conn, logs):
+        """
+        Add the orders columns to a ColumnBatch of order_logs rows
+        Rows whose order doesn't exist are dropped, like the INNER JOIN
+        """
+        self.refresh(conn)
+        order_ids = logs.columns['order_id']
+        orders = self.get_many(conn, set(order_ids))
+
+        keep = [i for i, order_id in enumerate(order_ids) if order_id in orders]
+        if len(keep) == logs.num_rows:
+            columns = dict(logs.columns)
+        else:
+            columns = {name: [values[i] for i in keep] for name, values in logs.columns.items()}
+
+        matched = [orders[order_ids[i]] for i in keep]
+        for j, col in enumerate(self.order_cols):
+            columns[col] = [row[j] for row in matched]
+        return ColumnBatch(columns, len(keep), logs.attrs)
+
+    def stats(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0.0
+        return f"{len(self._rows):,} orders cached, hit rate {hit_rate:.0%}"
@@ -0,0 +1,228 @@
+"""
+Pipelined ETL Engine
+Runs extract → transform → load as three overlapping stages connected by
+bounded queues, so MySQL is read while ClickHouse is still ingesting the
+previous batch. The checkpoint only advances over a contiguous prefix of
+batches the loader has confirmed.
+"""
+
+import queue
+import threading
+import time
+
+_DONE = object()
+
+class CheckpointTracker:
+    """
+    Tracks batches by sequence number and exposes the highest order_log_id
+    whose batch - and every batch before it - has been loaded
+    """
+
+    def __init__(self, start_id):
+        self.committed_id = start_id
+        self._next_seq = 0
+        self._pending = {}
+        self._acked = set()
+        self._lock = threading.Lock()
+
+    def register(self, last_id):
+        """Record a newly extracted batch and return its sequence number"""
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+            self._pending[seq] = last_id
+            return seq
+
+    def ack(self, seq):
+        """
+        Mark a batch as loaded
+        Returns the new committed id if the contiguous prefix grew, else None
+        """
+        with self._lock:
+            self._acked.add(seq)
+            advanced = False
+            head = min(self._pending) if self._pending else None
+            while head is not None and head in self._acked:
+                self.committed_id = self._pending.pop(head)
+                self._acked.discard(head)
+                advanced = True
+                head = min(self._pending) if self._pending else None
+            return self.committed_id if advanced else None
+
+class AdaptiveBatchSizer:
+    """
+    Grows the batch size while batches stay under the latency and memory
+    targets and shrinks it as soon as one of them is exceeded
+    """
+
+    def __init__(self, initial, min_size, max_size, target_seconds, max_memory_mb,
+                 grow_factor=1.5, shrink_factor=0.5):
+        self.batch_size = initial
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_seconds = target_seconds
+        self.max_memory_bytes = max_memory_mb * 1024 * 1024
+        self.grow_factor = grow_factor
+        self.shrink_factor = shrink_factor
+        self._lock = threading.Lock()
+
+    def record(self, rows, seconds, memory_bytes):
+        """Feed back one batch and return the batch size to use next"""
+        with self._lock:
+            if seconds > self.target_seconds or memory_bytes > self.max_memory_bytes:
+                self.batch_size = max(self.min_size, int(self.batch_size * self.shrink_factor))
+            elif rows >= self.batch_size:
+                # Only a full batch proves a bigger one would have had rows to fill it
+                self.batch_size = min(self.max_size, int(self.batch_size * self.grow_factor))
+            return self.batch_size
+
+def _put(q, item, stop):
+    """Blocking put that gives up once another stage has failed"""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _get(q, stop):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.5)
+        except queue.Empty:
+            continue
+    return _DONE
+
+def run_sequential(extract_batch, transform_batch, load_batch, commit, start_id,
+                   max_batches=None, should_continue=None, on_batch=None):
+    """
+    Same contract as run_pipeline, one stage at a time on the calling thread
+    on_batch receives the summed stage time of each batch
+    """
+    last_id = start_id
+    rows = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        if should_continue is not None and not should_continue():
+            break
+        started = time.monotonic()
+        df, batch_last_id, is_last = extract_batch(last_id)
+        if df.empty:
+            break
+        df = transform_batch(df)
+        load_batch(df, (last_id, batch_last_id))
+        commit(batch_last_id)
+        last_id = batch_last_id
+        rows += len(df)
+        batches += 1
+        if on_batch is not None:
+            on_batch(df, time.monotonic() - started)
+        if is_last:
+            break
+    return rows, batches, last_id
+
+def run_pipeline(extract_batch, transform_batch, load_batch, commit, start_id,
+                 queue_size=2, max_batches=None, should_continue=None, on_batch=None):
+    """
+    Run the three stages concurrently until the source is drained
+
+    extract_batch(last_id) -> (df, last_id, is_last) ; df empty when nothing is left
+    transform_batch(df)    -> transformed df
+    load_batch(df, ids)    -> None, raises on failure; ids is the batch's
+                              (after_id, last_id] range, the same on a retry
+    commit(last_id)        -> persist the checkpoint
+    should_continue()      -> optional, checked before each extraction
+    on_batch(df, seconds)  -> optional, called after each load with the
+                              slowest stage time of that batch
+
+    Returns (rows_loaded, batches_loaded, committed_id)
+    """
+    tracker = CheckpointTracker(start_id)
+    extracted = queue.Queue(maxsize=queue_size)
+    transformed = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+
+    def extractor():
+        last_id = start_id
+        count = 0
+        try:
+            while max_batches is None or count < max_batches:
+                if should_continue is not None and not should_continue():
+                    break
+                started = time.monotonic()
+                after_id = last_id
+                df, last_id, is_last = extract_batch(after_id)
+                if df.empty:
+                    break
+                seq = tracker.register(last_id)
+                count += 1
+                ids = (after_id, last_id)
+                if not _put(extracted, (seq, ids, df, time.monotonic() - started), stop):
+                    return
+                if is_last:
+                    break
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(extracted, _DONE, stop)
+
+    def transformer():
+        try:
+            while True:
+                item = _get(extracted, stop)
+                if item is _DONE:
+                    break
+                seq, ids, df, extract_seconds = item
+                started = time.monotonic()
+                df = transform_batch(df)
+                stage_seconds = max(extract_seconds, time.monotonic() - started)
+                if not _put(transformed, (seq, ids, df, stage_seconds), stop):
+                    return
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(transformed, _DONE, stop)
+
+    threads = [
+        threading.Thread(target=extractor, name="etl-extract", daemon=True),
+        threading.Thread(target=transformer, name="etl-transform", daemon=True),
+    ]
+    for t in threads:
+        t.start()
+
+    # Loader runs on the calling thread so commits happen here
+    rows = 0
+    batches = 0
+    try:
+        while True:
+            item = _get(transformed, stop)
+            if item is _DONE:
+                break
+            seq, ids, df, stage_seconds = item
+            started = time.monotonic()
+            load_batch(df, ids)
+            stage_seconds = max(stage_seconds, time.monotonic() - started)
+            rows += len(df)
+            batches += 1
+            committed = tracker.ack(seq)
+            if committed is not None:
+                commit(committed)
+            if on_batch is not None:
+                on_batch(df, stage_seconds)
+    except Exception as e:
+        errors.append(e)
+        stop.set()
+    finally:
+        if errors:
+            stop.set()
+        for t in threads:
+            t.join()
+
+    if errors:
+        raise errors[0]
+
+    return rows, batches, tracker.committed_id
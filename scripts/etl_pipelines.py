@@ -0,0 +1,327 @@
+"""
+Config-Driven Pipelines
+Runs every pipeline in config.PIPELINES - one MySQL table (optionally joined
+to another) synced to one ClickHouse table by keyset paging on an increasing
+key - concurrently on a shared pool of pipeline_workers threads. Each
+pipeline keeps its own checkpoint and insert tokens; max_mysql_connections and
+max_clickhouse_connections cap the connections open across all of them.
+
+Usage:
+  python3 scripts/etl_pipelines.py                 # one sync of every enabled pipeline
+  python3 scripts/etl_pipelines.py --only events   # just these
+  python3 scripts/etl_pipelines.py --list
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+import clickhouse_connect
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import MYSQL_CONFIG, CH_CONFIG, ETL_CONFIG, PIPELINES
+from scripts.etl_checkpoint import (
+    ClickHouseCheckpointStore, dedup_settings, read_checkpoint,
+    read_pending, write_atomic, write_pending
+)
+from scripts.etl_event_types import extract_filter_sql, map_event_types, quarantine, unmapped_policy
+from scripts.etl_insert import describe_insert, insert_settings
+from scripts.etl_metrics import finish_run, frame_bytes, stage, start_run
+from scripts.etl_pipeline import run_sequential
+from scripts.etl_rollups import SOURCE_TABLE as ROLLUP_SOURCE, rollup_mode, update_rollups
+from scripts.etl_schema_cache import SchemaCache
+from scripts.etl_source import SourceThrottle, connect_source, source_table
+from scripts.etl_transform_plan import get_clickhouse_schema, get_transform_plan
+
+PIPELINE_DEFAULTS = {
+    'enabled': True,
+    'mysql': {},
+    'replicas': [],  # Overrides of the pipeline's MySQL config to read from (read_from_replica)
+    'join': None,  # {'table': ..., 'on': ..., 'columns': [...]}
+    'key_index': 'PRIMARY',  # Index on key, pinned with FORCE INDEX when force_index is on
+    'where': None,  # Extra SQL condition on the source row (alias s), e.g. "s.is_test = 0"
+    'event_type': None,  # ClickHouse column mapped through EVENT_TYPE_MAPPING into event_type
+    'batch_size': 5000,
+    'max_batches': None,  # Per run; None runs until the source is drained
+    'tracking_file': None,  # Default logs/pipelines/<name>.txt
+    'checkpoint_key': None,  # Default <name>
+    'dedup_scope': '',  # Default <name>, so pipelines into one table never share tokens
+}
+
+_schema_caches = {}
+
+def log(message, name=None):
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    prefix = f"[{name}] " if name else ""
+    print(f"[{timestamp}] {prefix}{message}", flush=True)
+
+def pipeline_spec(name):
+    """PIPELINES[name] with defaults filled in"""
+    spec = {**PIPELINE_DEFAULTS, **PIPELINES[name], 'name': name}
+    if spec['tracking_file'] is None:
+        spec['tracking_file'] = os.path.join('logs', 'pipelines', f"{name}.txt")
+    if spec['checkpoint_key'] is None:
+        spec['checkpoint_key'] = name
+    if spec['dedup_scope'] == '':
+        spec['dedup_scope'] = name
+    for required in ('source', 'key', 'columns', 'target'):
+        if not spec.get(required):
+            raise ValueError(f"Pipeline '{name}' has no '{required}'")
+    if spec['key'] not in spec['columns']:
+        raise ValueError(f"Pipeline '{name}': key '{spec['key']}' must be one of its columns")
+    return spec
+
+def get_mysql_columns(conn, table_name):
+    cursor = conn.cursor()
+    cursor.execute(f"DESCRIBE {table_name}")
+    columns = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    return columns
+
+def build_pipeline_query(spec, join_cols, after_id, batch_size, end_id=None):
+    """
+    Keyset page of the source (joined if configured), columns already named as
+    in ClickHouse; returns (query, params)
+    """
+    select_parts = [f"s.{source} AS {target}" for source, target in spec['columns'].items()]
+    select_parts += [f"j.{col}" for col in join_cols]
+
+    from_clause = source_table('s', table=spec['source'], index=spec['key_index'])
+    join = spec['join']
+    if join:
+        from_clause += f"\n    INNER JOIN {join['table']} j ON s.{join['on']} = j.{join['on']}"
+
+    key = spec['key']
+    where_clause = f"s.{key} > %s"
+    params = [after_id]
+    if end_id is not None:
+        where_clause += f" AND s.{key} <= %s"
+        params.append(end_id)
+    if spec['where']:
+        where_clause += f" AND ({spec['where']})"
+    if spec['event_type']:
+        status_col = next(source for source, target in spec['columns'].items() if target == spec['event_type'])
+        where_clause += extract_filter_sql(f"s.{status_col}")
+    params.append(batch_size)
+
+    select_clause = ",\n        ".join(select_parts)
+    # STRAIGHT_JOIN keeps the source as the driving table under force_index
+    query = f"""
+    SELECT {'STRAIGHT_JOIN' if join and ETL_CONFIG['force_index'] else ''}
+        {select_clause}
+    FROM {from_clause}
+    WHERE {where_clause}
+    ORDER BY s.{key}
+    LIMIT %s
+    """
+    return query, tuple(params)
+
+def transform_pipeline_batch(df, spec, ch_schema):
+    """event_type mapping (if configured), then every column converted by its ClickHouse type"""
+    if spec['event_type']:
+        event_types, keep = map_event_types(df[spec['event_type']])
+        if keep is not None:
+            if unmapped_policy() == 'quarantine':
+                quarantine(df[~keep].to_dict('records'))
+            df = df[keep]
+            event_types = event_types[keep]
+        df = df.assign(event_type=event_types)
+    plan = get_transform_plan(ch_schema, df.columns)
+    if not plan.reported:
+        for col in plan.missing:
+            log(f"⚠ Added missing column '{col}' with default value", spec['name'])
+        plan.reported = True
+    df = plan.apply(df)
+    if ETL_CONFIG['narrow_dtypes']:
+        df = plan.narrow(df)
+    return df
+
+def sync_pipeline(spec, conn, ch_client, stop_event=None):
+    """
+    Sync one pipeline from its checkpoint until the source is drained (or
+    max_batches); returns (rows loaded, committed key)
+    A batch inserted but never checkpointed is replayed over the same range
+    with the same token, so ClickHouse drops the repeat
+    """
+    name = spec['name']
+    tracking_file = spec['tracking_file']
+    key_column = spec['columns'][spec['key']]
+    schema_cache = _schema_caches.setdefault(name, SchemaCache(ETL_CONFIG['schema_check_interval']))
+    update_rollup_tables = rollup_mode() == 'load' and spec['target'] == ROLLUP_SOURCE
+
+    ch_schema = schema_cache.clickhouse_schema(ch_client, spec['target'], get_clickhouse_schema)
+    join_cols = []
+    if spec['join']:
+        available = schema_cache.mysql_columns(conn, spec['join']['table'], get_mysql_columns)
+        join_cols = [col for col in spec['join']['columns'] if col in available]
+
+    store = None
+    if ETL_CONFIG['checkpoint_table']:
+        store = ClickHouseCheckpointStore(ch_client, ETL_CONFIG['checkpoint_table'])
+    last_id = read_checkpoint(tracking_file) or 0
+    if store is not None:
+        last_id = max(last_id, store.get(spec['checkpoint_key']) or 0)
+    log(f"✓ {spec['source']} → {spec['target']} from {spec['key']} > {last_id}", name)
+
+    replay = read_pending(tracking_file)
+    if replay is not None and replay[0] != last_id:
+        replay = None  # that batch was checkpointed
+    throttle = SourceThrottle(conn, stop_event)
+
+    def read_page(query, params):
+        started = time.monotonic()
+        with stage('extract') as sample:
+            df = pd.read_sql(query, conn, params=params)
+            sample['rows'], sample['bytes'] = len(df), frame_bytes(df)
+        throttle.after_query(len(df), time.monotonic() - started)
+        return df
+
+    def transform_batch(df):
+        with stage('transform') as sample:
+            df = transform_pipeline_batch(df, spec, ch_schema)
+            sample['rows'], sample['bytes'] = len(df), frame_bytes(df)
+        return df
+
+    def extract_batch(after_id):
+        nonlocal replay
+        batch_size = spec['batch_size']
+        if replay is not None:
+            end_id = replay[1]
+            replay = None
+            log(f"⚠ Replaying unconfirmed batch {after_id}-{end_id}", name)
+            query, params = build_pipeline_query(spec, join_cols, after_id, max(batch_size, end_id - after_id), end_id)
+            df = read_page(query, params)
+            if not df.empty:
+                return df, end_id, False
+        query, params = build_pipeline_query(spec, join_cols, after_id, batch_size)
+        df = read_page(query, params)
+        if df.empty:
+            return df, after_id, True
+        return df, int(df[key_column].iloc[-1]), len(df) < batch_size
+
+    def load_batch(df, ids):
+        # Every batch is its own block, so a replayed range is inserted with exactly
+        # the recorded ids (and token) - never merged with the batches after it
+        if df.empty:
+            return  # every row left out by the unmapped status policy
+        write_pending(tracking_file, *ids)
+        started = time.monotonic()
+        with stage('load') as sample:
+            summary = ch_client.insert_df(
+                spec['target'], df,
+                settings=insert_settings(dedup_settings(spec['target'], *ids, spec['dedup_scope']))
+            )
+            sample['rows'] = len(df)
+            sample['bytes'] = summary.written_bytes() if summary is not None else 0
+        if update_rollup_tables:
+            update_rollups(ch_client, df, ids, ch_schema, spec['dedup_scope'])
+        log(f"✓ Loaded {len(df)} rows up to {ids[1]} "
+            f"({describe_insert(summary, len(df), time.monotonic() - started)})", name)
+
+    def commit(loaded_id):
+        write_atomic(tracking_file, str(loaded_id))
+        if store is not None:
+            store.save(spec['checkpoint_key'], loaded_id)
+
+    rows, batches, committed_id = run_sequential(
+        extract_batch,
+        transform_batch,
+        load_batch,
+        commit,
+        last_id,
+        max_batches=spec['max_batches'],
+        should_continue=lambda: (stop_event is None or not stop_event.is_set()) and throttle.before_query()
+    )
+    return rows, committed_id
+
+class ConnectionLimiter:
+    """Caps the MySQL and ClickHouse connections open across all pipelines"""
+
+    def __init__(self, max_mysql, max_clickhouse):
+        self._mysql = threading.BoundedSemaphore(max_mysql)
+        self._clickhouse = threading.BoundedSemaphore(max_clickhouse)
+
+    @contextmanager
+    def connections(self, mysql_config, replicas):
+        # Always MySQL first, so two pipelines never each hold one kind waiting for the other
+        with self._mysql:
+            conn = connect_source(mysql_config, replicas)
+            try:
+                with self._clickhouse:
+                    ch_client = clickhouse_connect.get_client(**CH_CONFIG)
+                    try:
+                        yield conn, ch_client
+                    finally:
+                        ch_client.close()
+            finally:
+                conn.close()
+
+def run_pipelines(names=None, stop_event=None):
+    """
+    One sync of each named (default: every enabled) pipeline, concurrently
+    Returns {name: rows loaded, or the exception it failed with}
+    """
+    specs = [pipeline_spec(name) for name in (names or PIPELINES)]
+    specs = [spec for spec in specs if names or spec['enabled']]
+    limiter = ConnectionLimiter(ETL_CONFIG['max_mysql_connections'], ETL_CONFIG['max_clickhouse_connections'])
+
+    def run(spec):
+        # Each pipeline's stages go to its own run record (one pipeline per worker thread at a time)
+        start_run(spec['name'])
+        started = time.monotonic()
+        try:
+            with limiter.connections({**MYSQL_CONFIG, **spec['mysql']}, spec['replicas']) as (conn, ch_client):
+                rows, committed_id = sync_pipeline(spec, conn, ch_client, stop_event)
+        except Exception as e:
+            log(f"✗ FAILED: {e}", spec['name'])
+            finish_run('failed', error=str(e))
+            return e
+        seconds = time.monotonic() - started
+        log(f"✓ Synced {rows} rows in {seconds:.2f}s (checkpoint {committed_id})", spec['name'])
+        finish_run('ok', rows=rows, checkpoint=committed_id)
+        return rows
+
+    with ThreadPoolExecutor(max_workers=ETL_CONFIG['pipeline_workers'], thread_name_prefix="pipeline") as pool:
+        results = list(pool.map(run, specs))
+    return {spec['name']: result for spec, result in zip(specs, results)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync the pipelines in config.PIPELINES")
+    parser.add_argument('--only', nargs='+', choices=list(PIPELINES), help="pipelines to run")
+    parser.add_argument('--list', action='store_true', help="list pipelines and checkpoints and exit")
+    args = parser.parse_args()
+
+    log("="*70)
+    log("EVENTS ETL - PIPELINES")
+    log("="*70)
+
+    try:
+        if args.list:
+            for name in PIPELINES:
+                spec = pipeline_spec(name)
+                log(f"  {name}: {spec['source']} → {spec['target']}, {spec['key']} > "
+                    f"{read_checkpoint(spec['tracking_file']) or 0}{'' if spec['enabled'] else ' (disabled)'}")
+            return 0
+
+        results = run_pipelines(args.only)
+        failed = [name for name, result in results.items() if isinstance(result, Exception)]
+        rows = sum(result for result in results.values() if not isinstance(result, Exception))
+        log(f"\n✓ {len(results) - len(failed)}/{len(results)} pipelines synced, {rows} rows")
+        if failed:
+            log(f"✗ Failed: {', '.join(failed)}")
+            return 1
+        return 0
+    except Exception as e:
+        log(f"\n✗ FAILED: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,220 @@
+"""
+Reconciliation - events_data vs MySQL per id range
+Splits order_log_id into fixed ranges (reconcile_range_size) and compares,
+per range, the row count and sum of ids in MySQL (order_logs ⋈ orders,
+exactly what the ETL extracts) with the distinct count, row count and sum
+of distinct event_ids in ClickHouse. Both sides are answered from the
+primary key, so checking only the ranges a sync touched is cheap.
+Rows are compared with distinct (event_id, version) copies: rewritten
+versions are expected until ReplacingMergeTree merges them, identical
+copies (a replayed insert) are duplicates.
+
+Usage:
+  python3 scripts/etl_reconcile.py --deep            # every range up to the checkpoint
+  python3 scripts/etl_reconcile.py --from-id 5000000 --to-id 6000000 --repair
+"""
+
+import argparse
+import clickhouse_connect
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import CH_CONFIG, ETL_CONFIG
+from scripts.etl_event_types import loaded_filter_sql
+from scripts.etl_rollups import MONTH_SQL, mark_months_stale, mark_stale, rollup_mode
+from scripts.etl_source import connect_source
+from scripts.etl_transform_plan import get_clickhouse_schema
+from scripts.etl_events_main import (
+    log, get_mysql_columns, get_last_synced_id, extract_events,
+    transform_events, load_events
+)
+
+def mysql_range_stats(conn, lo_id, hi_id, range_size):
+    """
+    {range: (events, sum of ids)} for lo_id <= order_log_id <= hi_id
+    Unmapped statuses are left out when the status policy keeps them out of events_data
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT ol.order_log_id DIV %s AS bucket, COUNT(*), SUM(ol.order_log_id)
+        FROM order_logs ol
+        INNER JOIN orders o ON ol.order_id = o.order_id
+        WHERE ol.order_log_id BETWEEN %s AND %s{loaded_filter_sql()}
+        GROUP BY bucket
+    """, (range_size, lo_id, hi_id))
+    stats = {int(bucket): (int(count), int(id_sum)) for bucket, count, id_sum in cursor.fetchall()}
+    cursor.close()
+    return stats
+
+def copy_key(ch_schema):
+    """What tells one stored copy of an event from another"""
+    return "event_id, version" if 'version' in dict(ch_schema) else "event_id"
+
+def clickhouse_range_stats(ch_client, lo_id, hi_id, range_size, copies="event_id"):
+    """{range: (rows, distinct ids, sum of distinct ids, distinct copies)} for the same id span"""
+    result = ch_client.query(f"""
+        SELECT intDiv(event_id, {{size:UInt64}}) AS bucket, count(), uniqExact(event_id), sum(DISTINCT event_id),
+               uniqExact({copies})
+        FROM events_data
+        WHERE event_id BETWEEN {{lo:UInt64}} AND {{hi:UInt64}}
+        GROUP BY bucket
+    """, parameters={'size': range_size, 'lo': lo_id, 'hi': hi_id})
+    return {int(row[0]): tuple(int(value) for value in row[1:]) for row in result.result_rows}
+
+def compare_ranges(mysql_stats, ch_stats, range_size, lo_id, hi_id):
+    """
+    One problem dict per range whose ids or checksum differ, or that has duplicates
+    The first and last ranges are clipped to lo_id..hi_id, the span both sides counted
+    """
+    problems = []
+    for bucket in sorted(set(mysql_stats) | set(ch_stats)):
+        expected, expected_sum = mysql_stats.get(bucket, (0, 0))
+        rows, ids, id_sum, copies = ch_stats.get(bucket, (0, 0, 0, 0))
+        if ids < expected:
+            status = 'missing'
+        elif ids > expected or id_sum != expected_sum:
+            status = 'extra'  # ids in ClickHouse that MySQL doesn't have (or a mix)
+        elif rows > copies:
+            # (distinct versions of an event are rewrites, not duplicates)
+            status = 'duplicates'
+        else:
+            continue
+        problems.append({
+            'lo_id': max(bucket * range_size, lo_id),
+            'hi_id': min((bucket + 1) * range_size - 1, hi_id),
+            'status': status,
+            'mysql_events': expected,
+            'ch_events': ids,
+            'ch_rows': rows
+        })
+    return problems
+
+def repair_missing(conn, ch_client, ch_schema, lo_id, hi_id):
+    """Insert the events of lo_id..hi_id that ClickHouse doesn't have"""
+    result = ch_client.query(
+        "SELECT DISTINCT event_id FROM events_data WHERE event_id BETWEEN {lo:UInt64} AND {hi:UInt64}",
+        parameters={'lo': lo_id, 'hi': hi_id}
+    )
+    present = {row[0] for row in result.result_rows}
+    df = extract_events(lo_id - 1, conn, get_mysql_columns(conn, 'orders'), hi_id - lo_id + 1, hi_id)
+    df = df[~df['order_log_id'].isin(present)]
+    if df.empty:
+        return 0
+    df = transform_events(df, ch_schema)
+    load_events(df, ch_client)
+    if rollup_mode() == 'load':
+        # (materialized views count them on insert)
+        mark_stale(df, "repaired events")
+    return len(df)
+
+def repair_duplicates(ch_client, lo_id, hi_id):
+    """
+    Merge away the identical copies in lo_id..hi_id: OPTIMIZE ... FINAL
+    DEDUPLICATE on each partition holding events of the range
+    Returns the partitions merged
+    """
+    result = ch_client.query(
+        "SELECT DISTINCT _partition_id FROM events_data WHERE event_id BETWEEN {lo:UInt64} AND {hi:UInt64}",
+        parameters={'lo': lo_id, 'hi': hi_id}
+    )
+    partitions = [row[0] for row in result.result_rows]
+    for partition_id in partitions:
+        ch_client.command(f"OPTIMIZE TABLE events_data PARTITION ID '{partition_id}' FINAL DEDUPLICATE")
+    if partitions:
+        # The rollups counted every copy
+        result = ch_client.query(
+            f"SELECT DISTINCT {MONTH_SQL} FROM events_data WHERE event_id BETWEEN {{lo:UInt64}} AND {{hi:UInt64}}",
+            parameters={'lo': lo_id, 'hi': hi_id}
+        )
+        mark_months_stale([row[0] for row in result.result_rows], "duplicated events")
+    return partitions
+
+def reconcile(ch_client, lo_id, hi_id, conn=None, repair=False, ch_schema=None):
+    """
+    Compare lo_id..hi_id range by range; optionally re-insert missing events
+    and merge away duplicated ones
+    Returns the list of problem ranges
+    """
+    if hi_id < lo_id:
+        return []
+    own_conn = conn is None
+    if own_conn:
+        conn = connect_source()
+    range_size = ETL_CONFIG['reconcile_range_size']
+
+    try:
+        if ch_schema is None:
+            ch_schema = get_clickhouse_schema(ch_client)
+        # Both sides count only lo_id..hi_id, so a sync's check reads just the ids it wrote
+        problems = compare_ranges(
+            mysql_range_stats(conn, lo_id, hi_id, range_size),
+            clickhouse_range_stats(ch_client, lo_id, hi_id, range_size, copy_key(ch_schema)),
+            range_size,
+            lo_id,
+            hi_id
+        )
+
+        for p in problems:
+            log(f"⚠ Reconcile {p['lo_id']}-{p['hi_id']}: {p['status']} "
+                f"(MySQL {p['mysql_events']:,}, ClickHouse {p['ch_events']:,} ids / {p['ch_rows']:,} rows)")
+            if repair and p['status'] == 'missing':
+                inserted = repair_missing(conn, ch_client, ch_schema, p['lo_id'], p['hi_id'])
+                log(f"  → Re-inserted {inserted:,} missing events")
+            elif repair and p['status'] == 'duplicates':
+                partitions = repair_duplicates(ch_client, p['lo_id'], p['hi_id'])
+                log(f"  → Deduplicated {len(partitions)} partition(s)")
+    finally:
+        if own_conn:
+            conn.close()
+
+    if not problems:
+        log(f"✓ Reconciled order_log_id {lo_id}-{hi_id}: all ranges match")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare events_data with MySQL per order_log_id range")
+    parser.add_argument('--deep', action='store_true', help="check every range up to the checkpoint")
+    parser.add_argument('--from-id', type=int, help="first order_log_id to check")
+    parser.add_argument('--to-id', type=int, help="last order_log_id to check (default: checkpoint)")
+    parser.add_argument('--repair', action='store_true',
+                        help="re-insert events missing from ClickHouse, deduplicate duplicated ones")
+    args = parser.parse_args()
+
+    log("="*70)
+    log("EVENTS ETL - RECONCILIATION")
+    log("="*70)
+
+    try:
+        ch_client = clickhouse_connect.get_client(**CH_CONFIG)
+        checkpoint = get_last_synced_id(ch_client=ch_client)
+        hi_id = min(args.to_id, checkpoint) if args.to_id is not None else checkpoint
+        range_size = ETL_CONFIG['reconcile_range_size']
+        if args.deep:
+            lo_id = 0
+        elif args.from_id is not None:
+            lo_id = args.from_id // range_size * range_size
+        else:
+            lo_id = hi_id // range_size * range_size  # just the newest range
+
+        # A deep pass goes in chunks of ranges to keep each GROUP BY small
+        step = range_size * 100
+        problems = []
+        ch_schema = get_clickhouse_schema(ch_client)
+        conn = connect_source()
+        try:
+            for start in range(lo_id, hi_id + 1, step):
+                problems += reconcile(ch_client, start, min(start + step - 1, hi_id), conn, args.repair, ch_schema)
+        finally:
+            conn.close()
+
+        log(f"\n✓ Checked order_log_id {lo_id}-{hi_id}: {len(problems)} range(s) with differences")
+        return 1 if problems and not args.repair else 0
+    except Exception as e:
+        log(f"\n✗ FAILED: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
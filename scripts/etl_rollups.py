@@ -0,0 +1,284 @@
+"""
+Rollups
+Pre-aggregated copies of events_data for dashboards: one row per day ×
+event_type × the rollup's dimensions (config.ROLLUPS) with the event count and
+the sum of its 'sums' columns, in a SummingMergeTree partitioned by month.
+Dashboards read thousands of rollup rows instead of millions of events.
+
+ETL_CONFIG['rollups'] picks how they are kept current:
+  'load' - the incremental sync groups each loaded block in pandas and inserts
+           the result with the block's dedup token (a replayed block is dropped)
+  'view' - materialized views on events_data aggregate every insert server-side
+
+Rewrites of events already loaded (order updates, CDC corrections) can't be
+followed this way - a view would count them again, the sync never sees them -
+so their months are recorded in rollups_stale_file for `rebuild --stale`.
+In 'load' mode so are blocks left in staging (shipped later, not aggregated);
+`rebuild --stale` waits until they are shipped.
+
+Usage:
+  python3 scripts/etl_rollups.py setup                          # create tables (and views in 'view' mode)
+  python3 scripts/etl_rollups.py rebuild                        # recompute every month from events_data
+  python3 scripts/etl_rollups.py rebuild --months 202405 202406
+  python3 scripts/etl_rollups.py rebuild --stale                # the months rewrites have touched
+"""
+
+import argparse
+import json
+import os
+import sys
+from datetime import datetime
+
+import clickhouse_connect
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import CH_CONFIG, ETL_CONFIG, ROLLUPS
+from scripts.etl_checkpoint import dedup_settings, write_atomic
+from scripts.etl_insert import insert_settings
+from scripts.etl_metrics import stage
+from scripts.etl_staging import INCREMENTAL, list_staged
+from scripts.etl_transform_plan import column_kind, get_clickhouse_schema, parse_clickhouse_type
+
+SOURCE_TABLE = 'events_data'
+
+# Days are taken from event_timestamp as stored (the MySQL wall clock, sent as
+# UTC by the client), so the SQL side converts in UTC as well
+DAY_SQL = "toDate(event_timestamp, 'UTC')"
+MONTH_SQL = "toYYYYMM(event_timestamp, 'UTC')"
+
+def log(message):
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    print(f"[{timestamp}] {message}", flush=True)
+
+def rollup_mode():
+    mode = ETL_CONFIG['rollups']
+    if mode not in (False, None, 'load', 'view'):
+        raise ValueError(f"rollups must be False, 'load' or 'view', not {mode!r}")
+    return mode or None
+
+def _dimension_kinds(spec, ch_schema):
+    """[(dimension, ClickHouse base type, kind)] - NULLs are grouped as 0 / ''"""
+    types = dict(ch_schema)
+    dimensions = []
+    for dim in ['event_type', *spec['dimensions']]:
+        if dim not in types:
+            raise ValueError(f"Rollup dimension '{dim}' is not a column of {SOURCE_TABLE}")
+        base, _ = parse_clickhouse_type(types[dim])
+        dimensions.append((dim, base, column_kind(base)))
+    return dimensions
+
+def create_table_sql(name, spec, ch_schema):
+    columns = ["day Date"]
+    for dim, base, kind in _dimension_kinds(spec, ch_schema):
+        columns.append(f"{dim} {'LowCardinality(String)' if kind == 'string' else base}")
+    columns.append("events UInt64")
+    columns += [f"{col} Float64" for col in spec['sums']]
+    keys = ', '.join(['day', 'event_type', *spec['dimensions']])
+    column_list = ",\n        ".join(columns)
+    return f"""
+    CREATE TABLE IF NOT EXISTS {name} (
+        {column_list}
+    )
+    ENGINE = SummingMergeTree
+    PARTITION BY toYYYYMM(day)
+    ORDER BY ({keys})
+    SETTINGS non_replicated_deduplication_window = 1000
+    """
+
+def aggregate_sql(spec, ch_schema, final=False, where=None):
+    """The rollup's rows computed from events_data (materialized view and rebuild)"""
+    # Source columns are qualified: the aliases reuse their names
+    select_parts = [f"{DAY_SQL} AS day"]
+    for dim, _, kind in _dimension_kinds(spec, ch_schema):
+        select_parts.append(f"ifNull({SOURCE_TABLE}.{dim}, {repr('') if kind == 'string' else 0}) AS {dim}")
+    select_parts.append("count() AS events")
+    select_parts += [f"sum(ifNull(toFloat64({SOURCE_TABLE}.{col}), 0)) AS {col}" for col in spec['sums']]
+    select_clause = ",\n        ".join(select_parts)
+    return f"""
+    SELECT
+        {select_clause}
+    FROM {SOURCE_TABLE}{' FINAL' if final else ''}
+    {f'WHERE {where}' if where else ''}
+    GROUP BY {', '.join(['day', 'event_type', *spec['dimensions']])}
+    """
+
+def _block_frame(block, columns):
+    """The given columns of a loaded block (DataFrame or ColumnBatch) as a DataFrame"""
+    if isinstance(block, pd.DataFrame):
+        return block[columns]
+    frame = pd.DataFrame({name: block.columns[name] for name in columns})
+    # The columnar path holds DateTime values as epoch seconds
+    frame['event_timestamp'] = pd.to_datetime(frame['event_timestamp'], unit='s')
+    return frame
+
+def aggregate_block(block, spec, ch_schema):
+    """One group-by over the block: rows of the rollup, as ClickHouse would compute them"""
+    dimensions = _dimension_kinds(spec, ch_schema)
+    keys = [dim for dim, _, _ in dimensions]
+    frame = _block_frame(block, ['event_timestamp', *keys, *spec['sums']])
+    day = frame['event_timestamp'].dt.normalize().fillna(pd.Timestamp(0))
+    frame = frame.assign(day=day)
+
+    grouped = frame.groupby(['day', *keys], dropna=False, observed=True, sort=False)
+    out = grouped.size().to_frame('events')
+    for col in spec['sums']:
+        out[col] = grouped[col].sum().astype('float64')
+    out = out.reset_index()
+    for dim, _, kind in dimensions:
+        if kind == 'string':
+            out[dim] = out[dim].astype(object).fillna('').astype(str)
+        else:
+            out[dim] = pd.to_numeric(out[dim], errors='coerce').fillna(0).astype('int64')
+    out['events'] = out['events'].astype('int64')
+    return out[['day', *keys, 'events', *spec['sums']]]
+
+def update_rollups(ch_client, block, ids, ch_schema, scope=None):
+    """
+    Insert the aggregates of one loaded block into every rollup ('load' mode)
+    Each insert carries a token for the block's id range, so replaying a block
+    that was loaded but not checkpointed doesn't count its events twice
+    """
+    if block.empty:
+        return
+    for name, spec in ROLLUPS.items():
+        with stage('rollups') as sample:
+            rows = aggregate_block(block, spec, ch_schema)
+            ch_client.insert_df(name, rows, settings=insert_settings(dedup_settings(name, *ids, scope)))
+            sample['rows'] = len(rows)
+        log(f"✓ Rollup {name}: {len(block)} events → {len(rows)} rows")
+
+def stale_months():
+    path = ETL_CONFIG['rollups_stale_file']
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def _save_stale_months(months):
+    write_atomic(ETL_CONFIG['rollups_stale_file'], json.dumps(sorted(months)))
+
+def mark_stale(block, reason):
+    """
+    Record the months of events the rollups don't follow (rewritten copies,
+    repaired or staged events in 'load' mode) for `rebuild --stale`
+    """
+    if rollup_mode() is None or block.empty:
+        return
+    timestamps = pd.to_datetime(_block_frame(block, ['event_timestamp'])['event_timestamp'], errors='coerce').dropna()
+    mark_months_stale(set((timestamps.dt.year * 100 + timestamps.dt.month).astype(int).tolist()), reason)
+
+def mark_months_stale(months, reason):
+    """mark_stale for YYYYMM months already known"""
+    months = {int(month) for month in months}
+    if rollup_mode() is None or not months:
+        return
+    pending = set(stale_months())
+    if months - pending:
+        _save_stale_months(pending | months)
+    log(f"⚠ Rollups don't follow {reason} - months {', '.join(map(str, sorted(months)))} "
+        f"queued for: python3 scripts/etl_rollups.py rebuild --stale")
+
+def source_is_replacing(ch_client):
+    """events_data rewritten by order updates is read with FINAL (latest copy only)"""
+    result = ch_client.query(
+        "SELECT engine FROM system.tables WHERE database = currentDatabase() AND name = {table:String}",
+        parameters={'table': SOURCE_TABLE}
+    )
+    return bool(result.result_rows) and 'Replacing' in result.result_rows[0][0]
+
+def setup(ch_client, mode):
+    """Create every rollup table; in 'view' mode also its materialized view, otherwise drop it"""
+    ch_schema = get_clickhouse_schema(ch_client, SOURCE_TABLE)
+    for name, spec in ROLLUPS.items():
+        ch_client.command(create_table_sql(name, spec, ch_schema))
+        log(f"✓ Table {name}")
+        if mode == 'view':
+            ch_client.command(f"CREATE MATERIALIZED VIEW IF NOT EXISTS {name}_mv TO {name} AS "
+                              + aggregate_sql(spec, ch_schema))
+            log(f"✓ Materialized view {name}_mv")
+        else:
+            # The sync inserts the aggregates itself - a view would count every event twice
+            ch_client.command(f"DROP VIEW IF EXISTS {name}_mv")
+
+def rebuild(ch_client, names=None, months=None):
+    """
+    Recompute rollup months from events_data; each month is built in a side
+    table and swapped in with REPLACE PARTITION, so dashboards never see it
+    half-built
+    Inserts into the current month made while it is rebuilt are lost - stop
+    the scheduler first if the rebuild covers it
+    """
+    ch_schema = get_clickhouse_schema(ch_client, SOURCE_TABLE)
+    final = source_is_replacing(ch_client)
+    every_month = months is None
+    if every_month:
+        result = ch_client.query(f"SELECT DISTINCT {MONTH_SQL} FROM {SOURCE_TABLE}")
+        months = [row[0] for row in result.result_rows]
+
+    for name in names or ROLLUPS:
+        spec = ROLLUPS[name]
+        side_table = f"{name}_rebuild"
+        rebuild_months = set(int(month) for month in months)
+        if every_month:
+            # Months the rollup holds but events_data no longer does are emptied too
+            result = ch_client.query(f"SELECT DISTINCT toYYYYMM(day) FROM {name}")
+            rebuild_months.update(int(row[0]) for row in result.result_rows)
+        ch_client.command(f"DROP TABLE IF EXISTS {side_table}")
+        ch_client.command(f"CREATE TABLE {side_table} AS {name}")
+        try:
+            for month in sorted(rebuild_months):
+                ch_client.command(f"TRUNCATE TABLE {side_table}")
+                ch_client.command(f"INSERT INTO {side_table} "
+                                  + aggregate_sql(spec, ch_schema, final, f"{MONTH_SQL} = {month}"),
+                                  settings={'insert_deduplicate': 0})
+                ch_client.command(f"ALTER TABLE {name} REPLACE PARTITION {month} FROM {side_table}")
+                log(f"✓ {name}: rebuilt {month}")
+        finally:
+            ch_client.command(f"DROP TABLE IF EXISTS {side_table}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Create and rebuild the rollup tables in config.ROLLUPS")
+    parser.add_argument('command', choices=['setup', 'rebuild'])
+    parser.add_argument('--only', nargs='+', choices=list(ROLLUPS), help="rollups to rebuild")
+    parser.add_argument('--months', nargs='+', type=int, help="YYYYMM months to rebuild (default: all)")
+    parser.add_argument('--stale', action='store_true', help="rebuild the months rewrites have touched")
+    args = parser.parse_args()
+
+    log("="*70)
+    log(f"EVENTS ETL - ROLLUPS ({args.command})")
+    log("="*70)
+
+    try:
+        mode = rollup_mode()
+        ch_client = clickhouse_connect.get_client(**CH_CONFIG)
+        if args.command == 'setup':
+            setup(ch_client, mode)
+            if mode is None:
+                log("⚠ ETL_CONFIG['rollups'] is off - the tables won't be kept current")
+            log("✓ Fill them from existing events with: python3 scripts/etl_rollups.py rebuild")
+        elif args.stale:
+            months = stale_months()
+            if not months:
+                log("✓ No stale months")
+                return 0
+            staged = list_staged(INCREMENTAL)
+            if staged:
+                # Rebuilt now, the months would miss the staged events and leave the queue
+                log(f"⚠ {len(staged)} staged file(s) not shipped yet - stale months are rebuilt once they are")
+                return 0
+            rebuild(ch_client, args.only, months)
+            if not args.only:
+                # Months queued while this ran stay for the next rebuild
+                _save_stale_months(set(stale_months()) - set(months))
+        else:
+            rebuild(ch_client, args.only, args.months)
+        return 0
+    except Exception as e:
+        log(f"\n✗ FAILED: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
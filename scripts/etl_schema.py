@@ -0,0 +1,289 @@
+"""
+events_data Layout
+Creates events_data - or migrates an existing one - to the layout in
+config.EVENTS_TABLE: by default ReplacingMergeTree(version), partitioned by
+month of event_timestamp, ordered by event_id, with a bloom_filter skip index
+for order_id / customer_id lookups.
+
+With event_id as the primary key, the ETL's own queries (the checkpoint
+fallback, lag, reconcile ranges) read a few granules instead of scanning, and
+the row count comes from part metadata.
+
+Usage:
+  python3 scripts/etl_schema.py show               # layout vs EVENTS_TABLE, rows, high-water mark
+  python3 scripts/etl_schema.py create             # create events_data from the MySQL columns
+  python3 scripts/etl_schema.py migrate            # copy into the new layout month by month, then swap
+  python3 scripts/etl_schema.py migrate --drop-old
+"""
+
+import argparse
+import os
+import re
+import sys
+from datetime import datetime
+
+import clickhouse_connect
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import CH_CONFIG, EVENT_TYPE_MAPPING, EVENTS_TABLE, ORDER_COLUMNS, ROLLUPS
+from scripts.etl_rollups import rollup_mode, setup as setup_rollups
+from scripts.etl_source import connect_source
+from scripts.etl_transform_plan import get_clickhouse_schema
+
+TABLE = 'events_data'
+MIGRATE_TABLE = f"{TABLE}_migrate"
+OLD_TABLE = f"{TABLE}_old"
+
+# order_logs columns → events_data columns (the rest are ORDER_COLUMNS from orders)
+LOG_COLUMNS = {
+    'order_log_id': 'event_id',
+    'order_id': 'order_id',
+    'order_status_id': 'order_status_id',
+    'created_at': 'event_timestamp',
+}
+KEY_COLUMNS = {'event_id', 'order_id', 'event_type', 'order_status_id', 'event_timestamp'}  # never NULL
+
+MYSQL_INT_BITS = {'tinyint': 8, 'smallint': 16, 'mediumint': 32, 'int': 32, 'integer': 32, 'bigint': 64}
+
+def log(message):
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    print(f"[{timestamp}] {message}", flush=True)
+
+def clickhouse_type(mysql_type, nullable=False):
+    """ClickHouse type for a MySQL column type as DESCRIBE shows it, e.g. 'int(10) unsigned'"""
+    mysql_type = mysql_type.lower()
+    base = re.match(r'[a-z]+', mysql_type).group(0)
+    if mysql_type.startswith('tinyint(1)') or base in ('bool', 'boolean'):
+        type_name = 'UInt8'
+    elif base in MYSQL_INT_BITS:
+        type_name = f"{'UInt' if 'unsigned' in mysql_type else 'Int'}{MYSQL_INT_BITS[base]}"
+    elif base in ('decimal', 'numeric'):
+        precision = re.search(r'\((\d+)\s*,\s*(\d+)\)', mysql_type)
+        type_name = f"Decimal({precision.group(1)}, {precision.group(2)})" if precision else 'Decimal(10, 0)'
+    elif base == 'float':
+        type_name = 'Float32'
+    elif base in ('double', 'real'):
+        type_name = 'Float64'
+    elif base == 'date':
+        type_name = 'Date'
+    elif base in ('datetime', 'timestamp'):
+        type_name = 'DateTime'
+    elif base == 'year':
+        type_name = 'UInt16'
+    elif base in ('enum', 'set'):
+        return f"LowCardinality({'Nullable(String)' if nullable else 'String'})"
+    else:
+        type_name = 'String'  # char, varchar, text, time, json, ...
+    return f"Nullable({type_name})" if nullable else type_name
+
+def describe_mysql(conn, table_name):
+    """{column: (MySQL type, nullable)}"""
+    cursor = conn.cursor()
+    cursor.execute(f"DESCRIBE {table_name}")
+    columns = {row[0]: (row[1].decode() if isinstance(row[1], bytes) else row[1], row[2] == 'YES')
+               for row in cursor.fetchall()}
+    cursor.close()
+    return columns
+
+def planned_columns(conn):
+    """
+    [(name, ClickHouse type)] of events_data as the ETL writes it: the order_logs
+    columns, event_type, every ORDER_COLUMNS column orders has, and version
+    """
+    logs = describe_mysql(conn, 'order_logs')
+    orders = describe_mysql(conn, 'orders')
+    columns = []
+    for source, name in LOG_COLUMNS.items():
+        mysql_type, nullable = logs[source]
+        columns.append((name, clickhouse_type(mysql_type, nullable and name not in KEY_COLUMNS)))
+    columns.insert(2, ('event_type', 'UInt8' if max(EVENT_TYPE_MAPPING.values()) <= 255 else 'UInt16'))
+    for name in ORDER_COLUMNS:
+        if name in orders:
+            columns.append((name, clickhouse_type(*orders[name])))
+    columns.append(('version', 'UInt64'))
+    return columns
+
+def create_table_sql(name, columns, layout=None):
+    """CREATE TABLE in the EVENTS_TABLE layout"""
+    layout = layout or EVENTS_TABLE
+    definitions = [f"{col} {type_name}{' DEFAULT 0' if col == 'version' else ''}" for col, type_name in columns]
+    settings = dict(layout['settings'])
+    names = {col for col, _ in columns}
+    for col in layout['lookup_columns']:
+        if col not in names:
+            continue
+        if layout['lookup_index'] == 'bloom_filter':
+            definitions.append(f"INDEX idx_{col} {col} TYPE bloom_filter GRANULARITY 4")
+        elif layout['lookup_index'] == 'projection':
+            definitions.append(f"PROJECTION by_{col} (SELECT * ORDER BY {col})")
+            # Projections on a Replacing engine must be rebuilt when merges drop rows
+            settings['deduplicate_merge_projection_mode'] = 'rebuild'
+    column_list = ",\n        ".join(definitions)
+    settings_clause = ", ".join(f"{key} = {value!r}" for key, value in settings.items())
+    return f"""
+    CREATE TABLE {name} (
+        {column_list}
+    )
+    ENGINE = {layout['engine']}
+    PARTITION BY {layout['partition_by']}
+    ORDER BY {layout['order_by']}
+    {f'SETTINGS {settings_clause}' if settings_clause else ''}
+    """
+
+def current_layout(ch_client, name=TABLE):
+    """(engine_full, partition_key, sorting_key) from system.tables, None if the table doesn't exist"""
+    result = ch_client.query(
+        "SELECT engine_full, partition_key, sorting_key FROM system.tables "
+        "WHERE database = currentDatabase() AND name = {name:String}",
+        parameters={'name': name}
+    )
+    return result.result_rows[0] if result.result_rows else None
+
+def _normalize(expression):
+    return re.sub(r'\s+', '', expression or '')
+
+def layout_differences(layout):
+    """What differs between an existing table's layout and EVENTS_TABLE ([] if nothing)"""
+    engine_full, partition_key, sorting_key = layout
+    differences = []
+    if not _normalize(engine_full).startswith(_normalize(EVENTS_TABLE['engine'])):
+        differences.append(f"engine {engine_full.split(' PARTITION BY')[0].split(' ORDER BY')[0]}")
+    if _normalize(partition_key) != _normalize(EVENTS_TABLE['partition_by']):
+        differences.append(f"partition key '{partition_key}'")
+    if _normalize(sorting_key) != _normalize(EVENTS_TABLE['order_by']):
+        differences.append(f"sorting key '{sorting_key}'")
+    return differences
+
+def row_count(ch_client, name=TABLE):
+    """Rows in the active parts - part metadata, no data read (not deduplicated until merged)"""
+    result = ch_client.query(
+        "SELECT sum(rows) FROM system.parts "
+        "WHERE database = currentDatabase() AND table = {name:String} AND active",
+        parameters={'name': name}
+    )
+    return int(result.result_rows[0][0] or 0)
+
+def high_water_mark(ch_client, name=TABLE):
+    """
+    Highest event_id loaded, None for an empty table
+    Read in primary key order, so with ORDER BY event_id only the last
+    granule of each part is read
+    """
+    result = ch_client.query(f"SELECT event_id FROM {name} ORDER BY event_id DESC LIMIT 1")
+    return int(result.result_rows[0][0]) if result.result_rows else None
+
+def month_counts(ch_client, name):
+    result = ch_client.query(
+        f"SELECT {EVENTS_TABLE['partition_by']} AS month, count() FROM {name} GROUP BY month ORDER BY month"
+    )
+    return [(month, int(rows)) for month, rows in result.result_rows]
+
+def create(ch_client, conn):
+    if current_layout(ch_client) is not None:
+        log(f"✓ {TABLE} already exists - use 'migrate' to change its layout")
+        return
+    columns = planned_columns(conn)
+    ch_client.command(create_table_sql(TABLE, columns))
+    log(f"✓ Created {TABLE} with {len(columns)} columns")
+
+def migrate(ch_client, drop_old=False):
+    """
+    Copy events_data into a new table in the EVENTS_TABLE layout one month at
+    a time, then swap the two with a single RENAME (the old table is kept as
+    events_data_old unless drop_old)
+    Stop the scheduler first: events loaded during the copy would be left behind
+    """
+    layout = current_layout(ch_client)
+    if layout is None:
+        raise RuntimeError(f"{TABLE} doesn't exist - use 'create'")
+    differences = layout_differences(layout)
+    if not differences:
+        log(f"✓ {TABLE} already has the configured layout")
+        return
+    log(f"Migrating {TABLE}: {', '.join(differences)}")
+    if current_layout(ch_client, OLD_TABLE) is not None:
+        raise RuntimeError(f"{OLD_TABLE} exists from an earlier migration - drop it first")
+
+    existing = get_clickhouse_schema(ch_client, TABLE)
+    # Keys can't be Nullable - NULLs are copied as the type's default
+    columns = [(name, type_name[len('Nullable('):-1] if name in KEY_COLUMNS and type_name.startswith('Nullable(')
+                else type_name) for name, type_name in existing]
+    if 'version' in EVENTS_TABLE['engine'] and 'version' not in dict(existing):
+        columns.append(('version', 'UInt64'))  # DEFAULT 0 for the copied rows
+    ch_client.command(f"DROP TABLE IF EXISTS {MIGRATE_TABLE}")
+    ch_client.command(create_table_sql(MIGRATE_TABLE, columns))
+
+    names = ', '.join(name for name, _ in existing)
+    for month, rows in month_counts(ch_client, TABLE):
+        in_month = f"{EVENTS_TABLE['partition_by']} " + ("IS NULL" if month is None else f"= {int(month)}")
+        ch_client.command(
+            f"INSERT INTO {MIGRATE_TABLE} ({names}) SELECT {names} FROM {TABLE} WHERE {in_month}",
+            settings={'insert_deduplicate': 0}
+        )
+        log(f"✓ Copied {month}: {rows:,} rows")
+
+    # Distinct ids, not rows: a Replacing engine may already have merged copies away
+    old_ids, new_ids = (int(ch_client.query(f"SELECT uniqExact(event_id) FROM {name}").result_rows[0][0])
+                        for name in (TABLE, MIGRATE_TABLE))
+    if new_ids != old_ids:
+        raise RuntimeError(f"Copied {new_ids:,} of {old_ids:,} events - {TABLE} left unchanged")
+
+    # Rollup views are bound to the table they were created on
+    views = rollup_mode() == 'view'
+    if views:
+        for name in ROLLUPS:
+            ch_client.command(f"DROP VIEW IF EXISTS {name}_mv")
+    ch_client.command(f"RENAME TABLE {TABLE} TO {OLD_TABLE}, {MIGRATE_TABLE} TO {TABLE}")
+    log(f"✓ Swapped: {TABLE} has the new layout, the old table is {OLD_TABLE}")
+    if views:
+        setup_rollups(ch_client, 'view')
+    if drop_old:
+        ch_client.command(f"DROP TABLE {OLD_TABLE}")
+        log(f"✓ Dropped {OLD_TABLE}")
+
+def show(ch_client):
+    layout = current_layout(ch_client)
+    if layout is None:
+        log(f"✗ {TABLE} doesn't exist - create it with: python3 scripts/etl_schema.py create")
+        return False
+    log(f"  Engine:       {layout[0]}")
+    differences = layout_differences(layout)
+    if differences:
+        log(f"⚠ Differs from EVENTS_TABLE: {', '.join(differences)} - python3 scripts/etl_schema.py migrate")
+    else:
+        log("✓ Layout matches EVENTS_TABLE")
+    log(f"  Rows (parts): {row_count(ch_client):,}")
+    log(f"  Max event_id: {high_water_mark(ch_client)}")
+    return not differences
+
+def main():
+    parser = argparse.ArgumentParser(description="Create or migrate events_data to the EVENTS_TABLE layout")
+    parser.add_argument('command', choices=['show', 'create', 'migrate'])
+    parser.add_argument('--drop-old', action='store_true', help="migrate: drop the old table after the swap")
+    args = parser.parse_args()
+
+    log("="*70)
+    log(f"EVENTS ETL - TABLE LAYOUT ({args.command})")
+    log("="*70)
+
+    try:
+        ch_client = clickhouse_connect.get_client(**CH_CONFIG)
+        if args.command == 'show':
+            return 0 if show(ch_client) else 1
+        if args.command == 'create':
+            conn = connect_source()
+            try:
+                create(ch_client, conn)
+            finally:
+                conn.close()
+        else:
+            migrate(ch_client, args.drop_old)
+        return 0
+    except Exception as e:
+        log(f"\n✗ FAILED: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""
+Schema Cache
+Keeps the MySQL and ClickHouse column lists between runs of a long-lived
+process. A cached schema is trusted for schema_check_interval seconds; after
+that one cheap fingerprint query (column count + hash from information_schema
+or system.columns) decides whether DESCRIBE has to run again.
+"""
+
+import threading
+import time
+
+MYSQL_FINGERPRINT = """
+    SELECT COUNT(*), COALESCE(SUM(CRC32(CONCAT_WS(':', COLUMN_NAME, COLUMN_TYPE, ORDINAL_POSITION))), 0)
+    FROM information_schema.COLUMNS
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+"""
+
+CLICKHOUSE_FINGERPRINT = """
+    SELECT count(), sum(cityHash64(name, type, position))
+    FROM system.columns
+    WHERE database = currentDatabase() AND table = {table:String}
+"""
+
+def mysql_fingerprint(conn, table):
+    cursor = conn.cursor()
+    cursor.execute(MYSQL_FINGERPRINT, (table,))
+    fingerprint = tuple(cursor.fetchone())
+    cursor.close()
+    return fingerprint
+
+def clickhouse_fingerprint(ch_client, table):
+    result = ch_client.query(CLICKHOUSE_FINGERPRINT, parameters={'table': table})
+    return tuple(result.result_rows[0])
+
+class SchemaCache:
+    """Column lists keyed by (side, table), revalidated by fingerprint"""
+
+    def __init__(self, check_interval):
+        self.check_interval = check_interval
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key, fingerprint, describe):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry['checked_at'] < self.check_interval:
+                return entry['value']
+            # Fingerprint first: a change that lands mid-DESCRIBE is caught next check
+            current = fingerprint()
+            if entry is None or entry['fingerprint'] != current:
+                entry = {'fingerprint': current, 'value': describe()}
+                self._entries[key] = entry
+            entry['checked_at'] = now
+            return entry['value']
+
+    def mysql_columns(self, conn, table, describe):
+        return self._get(
+            ('mysql', table),
+            lambda: mysql_fingerprint(conn, table),
+            lambda: describe(conn, table)
+        )
+
+    def clickhouse_schema(self, ch_client, table, describe):
+        return self._get(
+            ('clickhouse', table),
+            lambda: clickhouse_fingerprint(ch_client, table),
+            lambda: describe(ch_client, table)
+        )
+
+    def invalidate(self):
+        """Forget everything, e.g. after a failed load"""
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,157 @@
+"""
+Source-Friendly Extraction
+Keeps the sync's reads from hurting the OLTP database:
+- read_from_replica: extraction connects to the first of MYSQL_REPLICAS whose
+  replication lag is under replica_max_lag_seconds, and stops reading once the
+  replica falls further behind than that
+- throttle: before each extraction query, Threads_running is checked and the
+  previous query's latency compared with the best seen; while either says the
+  server is busy, the pause between queries doubles (up to throttle_max_sleep),
+  and it halves again once the server is calm
+- force_index: source_table() pins the keyset scan to the key's index, so
+  each page stays a primary key range scan whatever the optimizer estimates
+"""
+
+import time
+from datetime import datetime
+
+import mysql.connector
+
+from config.config import MYSQL_CONFIG, MYSQL_REPLICAS, ETL_CONFIG
+
+THROTTLE_MIN_SLEEP = 0.5  # First back-off step, seconds
+LATENCY_MIN_ROWS = 1000  # Smaller pages are mostly round trip - their latency isn't compared
+LATENCY_BASELINE_DECAY = 1.01  # Best seconds-per-row creeps up so an old best is forgotten
+
+def log(message):
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    print(f"[{timestamp}] {message}", flush=True)
+
+def replica_lag(conn):
+    """
+    Seconds_Behind_Source of this connection's server, None if it isn't a
+    replica; a replica whose SQL thread is stopped counts as infinitely behind
+    """
+    cursor = conn.cursor(dictionary=True)
+    try:
+        try:
+            cursor.execute("SHOW REPLICA STATUS")
+        except mysql.connector.Error:
+            cursor.execute("SHOW SLAVE STATUS")  # MySQL < 8.0.22
+        status = cursor.fetchone()
+        cursor.fetchall()
+    finally:
+        cursor.close()
+    if not status:
+        return None
+    lag = status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+    return float('inf') if lag is None else int(lag)
+
+def replica_ok(conn):
+    """True unless conn is a replica further behind than replica_max_lag_seconds"""
+    lag = replica_lag(conn)
+    return lag is None or lag <= ETL_CONFIG['replica_max_lag_seconds']
+
+def connect_source(config=None, replicas=None):
+    """
+    MySQL connection to extract from: with read_from_replica on, the first
+    replica (config overrides) within replica_max_lag_seconds, else the
+    primary if replica_fallback_primary allows it
+    """
+    config = config or MYSQL_CONFIG
+    replicas = MYSQL_REPLICAS if replicas is None else replicas
+    if not ETL_CONFIG['read_from_replica'] or not replicas:
+        return mysql.connector.connect(**config)
+
+    max_lag = ETL_CONFIG['replica_max_lag_seconds']
+    for overrides in replicas:
+        host = overrides.get('host', config.get('host'))
+        try:
+            conn = mysql.connector.connect(**{**config, **overrides})
+        except mysql.connector.Error as e:
+            log(f"⚠ Replica {host} unavailable: {e}")
+            continue
+        lag = replica_lag(conn)
+        if lag is not None and lag <= max_lag:
+            log(f"✓ Reading from replica {host} ({lag}s behind)")
+            return conn
+        conn.close()
+        log(f"⚠ Replica {host} skipped: " + ("not replicating" if lag is None else f"{lag}s behind"))
+
+    if ETL_CONFIG['replica_fallback_primary']:
+        log("⚠ No replica within the lag limit - reading from the primary")
+        return mysql.connector.connect(**config)
+    raise RuntimeError(f"No MySQL replica within {max_lag}s of the primary")
+
+def threads_running(conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SHOW GLOBAL STATUS LIKE 'Threads_running'")
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+    return int(row[1]) if row else 0
+
+def source_table(alias, force_index=None, table='order_logs', index='PRIMARY'):
+    """The keyset-scanned table, pinned to its key's index when force_index is on"""
+    if ETL_CONFIG['force_index'] if force_index is None else force_index:
+        return f"{table} {alias} FORCE INDEX ({index})"
+    return f"{table} {alias}"
+
+class SourceThrottle:
+    """
+    Paces the extraction queries on one connection: call before_query() before
+    each and after_query(rows, seconds) after it, from the extracting thread
+    """
+
+    def __init__(self, conn, stop_event=None):
+        self.conn = conn
+        self.stop_event = stop_event
+        self.check_lag = ETL_CONFIG['read_from_replica']
+        self.enabled = ETL_CONFIG['throttle']
+        self.delay = 0.0
+        self._baseline = None  # best seconds per row seen
+        self._slow = False
+
+    def before_query(self):
+        """
+        Wait as long as the source asks; False when the replica has fallen too
+        far behind to read past the checkpoint (the caller stops for now)
+        """
+        if self.check_lag:
+            lag = replica_lag(self.conn)
+            if lag is not None and lag > ETL_CONFIG['replica_max_lag_seconds']:
+                log(f"⚠ Replica is {lag}s behind (limit {ETL_CONFIG['replica_max_lag_seconds']}s) - "
+                    f"not reading further")
+                return False
+        if not self.enabled:
+            return True
+
+        running = threads_running(self.conn)
+        crowded = running > ETL_CONFIG['throttle_threads_running']
+        if crowded or self._slow:
+            self.delay = min(ETL_CONFIG['throttle_max_sleep'], max(self.delay * 2, THROTTLE_MIN_SLEEP))
+        elif self.delay > THROTTLE_MIN_SLEEP:
+            self.delay /= 2
+        else:
+            self.delay = 0.0
+        if crowded or self._slow:
+            reason = f"{running} threads running" if crowded else "slow extraction"
+            log(f"⚠ MySQL busy ({reason}) - pausing {self.delay:.1f}s")
+        if self.delay:
+            if self.stop_event is not None:
+                self.stop_event.wait(self.delay)
+            else:
+                time.sleep(self.delay)
+        return True
+
+    def after_query(self, rows, seconds):
+        """Record an extraction query; slower than throttle_latency_factor × the best counts as busy"""
+        if not self.enabled or rows < LATENCY_MIN_ROWS:
+            return
+        per_row = seconds / rows
+        if self._baseline is None or per_row < self._baseline:
+            self._baseline = per_row
+        else:
+            self._baseline *= LATENCY_BASELINE_DECAY
+        self._slow = per_row > self._baseline * ETL_CONFIG['throttle_latency_factor']
@@ -0,0 +1,195 @@
+"""
+Local Staging
+Transformed batches are written to gzip-compressed ClickHouse Native files
+named by their order_log_id range, shipped to ClickHouse (the server
+decompresses and parses them, the client only streams the file) and
+deleted once the insert succeeds.
+
+A load that fails leaves its file behind - the next run ships the staged
+files before reading MySQL again, and while ClickHouse is down a run keeps
+extracting into staging (up to staging_max_mb) instead of stopping.
+The command below ships staged files on their own, e.g. a full load
+written with etl_events_full.py --stage-only.
+
+Usage:
+  python3 scripts/etl_staging.py --list
+  python3 scripts/etl_staging.py --scope full-1700000000 --set-checkpoint
+  python3 scripts/etl_staging.py --keep      # ship, but leave the files (testing)
+"""
+
+import argparse
+import gzip
+import os
+import re
+import sys
+import time
+
+import clickhouse_connect
+from clickhouse_connect.datatypes.registry import get_from_name
+from clickhouse_connect.driver.insert import InsertContext
+from clickhouse_connect.driver.tools import insert_file
+from clickhouse_connect.driver.transform import NativeTransform
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.config import CH_CONFIG, ETL_CONFIG
+from scripts.etl_checkpoint import dedup_settings
+from scripts.etl_columnar import ColumnBatch
+from scripts.etl_insert import describe_insert, insert_settings
+
+# Files of the incremental sync; other scopes are one-off loads (e.g. 'full-<ts>')
+INCREMENTAL = 'events'
+
+STAGE_FILE = re.compile(r'^(?P<scope>[A-Za-z0-9-]+)_(?P<after>\d+)_(?P<last>\d+)\.native\.gz$')
+
+def stage_path(scope, after_id, last_id):
+    """<staging_dir>/<scope>_<after_id>_<last_id>.native.gz (zero-padded so names sort by id)"""
+    return os.path.join(ETL_CONFIG['staging_dir'], f"{scope}_{after_id:012d}_{last_id:012d}.native.gz")
+
+def parse_stage_path(path):
+    """(scope, after_id, last_id) from a staged file name"""
+    match = STAGE_FILE.match(os.path.basename(path))
+    if match is None:
+        raise ValueError(f"Not a staged file name: {path}")
+    return match['scope'], int(match['after']), int(match['last'])
+
+def write_stage(path, batch, ch_schema, table='events_data'):
+    """
+    Serialize a transformed DataFrame or ColumnBatch as Native, in ch_schema
+    column order, and move the file into place atomically
+    Returns the compressed size in bytes
+    """
+    names = [name for name, _ in ch_schema]
+    types = [get_from_name(type_name) for _, type_name in ch_schema]
+    if isinstance(batch, ColumnBatch):
+        context = InsertContext(table, names, types, [batch.columns[name] for name in names], column_oriented=True)
+    else:
+        context = InsertContext(table, names, types, batch[names])
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as raw:
+        # Level 3 keeps compression well ahead of the insert it feeds
+        with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=3) as f:
+            for i, block in enumerate(NativeTransform().build_insert(context)):
+                if context.insert_exception is not None:
+                    break  # a column failed to serialize - the rest is garbage
+                if i == 0:
+                    # The client puts its INSERT statement before the first block - keep only the data
+                    block = bytes(block).split(b" FORMAT Native\n", 1)[1]
+                f.write(block)
+        raw.flush()
+        os.fsync(raw.fileno())
+    if context.insert_exception is not None:
+        os.remove(tmp_path)
+        raise context.insert_exception
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
+
+def ship_file(ch_client, path, table='events_data', keep=False):
+    """
+    Insert a staged file, then delete it
+    The dedup token depends only on the name, so shipping a file twice
+    (a crash before the delete) is dropped by ClickHouse
+    Returns the insert's QuerySummary
+    """
+    scope, after_id, last_id = parse_stage_path(path)
+    # Incremental files share their token with direct inserts of the same range
+    token_scope = None if scope == INCREMENTAL else scope
+    settings = insert_settings(dedup_settings(table, after_id, last_id, token_scope))
+    # The .gz suffix makes the client send it with Content-Encoding: gzip
+    summary = insert_file(ch_client, table, path, fmt='Native', settings=settings)
+    if not keep:
+        os.remove(path)
+    return summary
+
+def list_staged(scope=None):
+    """[(scope, after_id, last_id, path)] in the staging dir, ordered by scope and id"""
+    staging_dir = ETL_CONFIG['staging_dir']
+    if not os.path.isdir(staging_dir):
+        return []
+    staged = []
+    for name in os.listdir(staging_dir):
+        match = STAGE_FILE.match(name)
+        if match and (scope is None or match['scope'] == scope):
+            staged.append((match['scope'], int(match['after']), int(match['last']),
+                           os.path.join(staging_dir, name)))
+    return sorted(staged)
+
+def staged_bytes():
+    return sum(os.path.getsize(path) for _, _, _, path in list_staged())
+
+def ship_chain(ch_client, last_id, commit, scope=INCREMENTAL):
+    """
+    Ship the staged files that continue from last_id, in id order,
+    calling commit(last_id) after each one
+    Stops shipping at the first failure but keeps following the chain, so the
+    caller can resume extraction after the last staged id
+    Returns (last shipped id, last staged id, error or None)
+    """
+    staged_id = last_id
+    error = None
+    for _, after_id, end_id, path in list_staged(scope):
+        if end_id <= last_id:
+            os.remove(path)  # loaded and checkpointed before its delete ran
+            continue
+        if after_id != staged_id:
+            break  # not contiguous - left to be overwritten or cleaned up later
+        staged_id = end_id
+        if error is None:
+            try:
+                ship_file(ch_client, path)
+            except Exception as e:
+                error = e
+                continue
+            commit(end_id)
+            last_id = end_id
+    return last_id, staged_id, error
+
+def main():
+    parser = argparse.ArgumentParser(description="Ship staged Native files to ClickHouse")
+    parser.add_argument('--scope', help=f"only files of this scope ('{INCREMENTAL}' for the incremental sync)")
+    parser.add_argument('--list', action='store_true', help="list staged files and exit")
+    parser.add_argument('--keep', action='store_true', help="don't delete files after shipping")
+    parser.add_argument('--set-checkpoint', action='store_true',
+                        help="write the last shipped order_log_id to the tracking file")
+    args = parser.parse_args()
+
+    from scripts.etl_events_main import log, save_last_synced_id
+
+    log("="*70)
+    log("EVENTS ETL - SHIP STAGED FILES")
+    log("="*70)
+
+    try:
+        staged = list_staged(args.scope)
+        log(f"✓ {len(staged)} staged file(s) in {ETL_CONFIG['staging_dir']}")
+        if args.list:
+            for scope, after_id, last_id, path in staged:
+                log(f"  {scope}: order_log_id {after_id + 1}-{last_id} "
+                    f"({os.path.getsize(path) / 1024 / 1024:.1f} MB)")
+            return 0
+
+        ch_client = clickhouse_connect.get_client(**CH_CONFIG)
+        rows = 0
+        last_id = None
+        for _, _, end_id, path in staged:
+            started = time.monotonic()
+            summary = ship_file(ch_client, path, keep=args.keep)
+            shipped = summary.written_rows if summary is not None else 0
+            rows += shipped
+            last_id = end_id if last_id is None else max(last_id, end_id)
+            log(f"✓ Shipped {os.path.basename(path)} "
+                f"({describe_insert(summary, shipped, time.monotonic() - started)})")
+
+        log(f"\n✓ Shipped {len(staged)} file(s), {rows:,} rows")
+        if args.set_checkpoint and last_id is not None:
+            save_last_synced_id(last_id, ch_client)
+        return 0
+    except Exception as e:
+        log(f"\n✗ FAILED: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+"""
+Schema-Driven Transform Plan
+Compiles the ClickHouse column types from DESCRIBE TABLE into one conversion
+per column, with defaults that match each type. Plans are cached per schema
+version, so a new column on either side just compiles a new plan.
+"""
+
+import re
+import threading
+import pandas as pd
+
+_plan_cache = {}
+_plan_lock = threading.Lock()
+
+INT_TYPES = {
+    'Int8', 'Int16', 'Int32', 'Int64', 'Int128', 'Int256',
+    'UInt8', 'UInt16', 'UInt32', 'UInt64', 'UInt128', 'UInt256', 'Bool'
+}
+FLOAT_TYPES = {'Float32', 'Float64'}
+STRING_TYPES = {'String', 'FixedString', 'UUID', 'Enum8', 'Enum16', 'IPv4', 'IPv6'}
+DATE_TYPES = {'Date', 'Date32'}
+DATETIME_TYPES = {'DateTime', 'DateTime64'}
+
+# Narrowest NumPy dtype for each ClickHouse number type (Nullable ints use the
+# pandas extension type of the same name, e.g. 'UInt32')
+NARROW_DTYPES = {
+    'UInt8': 'uint8', 'UInt16': 'uint16', 'UInt32': 'uint32', 'UInt64': 'uint64',
+    'Int8': 'int8', 'Int16': 'int16', 'Int32': 'int32', 'Int64': 'int64',
+    'Float32': 'float32', 'Float64': 'float64'
+}
+
+# Strings repeating at least this much in a batch's first rows become categories
+CATEGORY_SAMPLE_ROWS = 1000
+
+def get_clickhouse_schema(ch_client, table='events_data'):
+    """Get [(column, type)] from ClickHouse, in table order"""
+    result = ch_client.query(f"DESCRIBE TABLE {table}")
+    return [(row[0], row[1]) for row in result.result_rows]
+
+def parse_clickhouse_type(type_name):
+    """
+    Unwrap LowCardinality/Nullable and drop parameters
+    'LowCardinality(Nullable(String))' → ('String', nullable=True)
+    """
+    nullable = False
+    while True:
+        match = re.fullmatch(r'(LowCardinality|Nullable)\((.*)\)', type_name)
+        if not match:
+            break
+        nullable = nullable or match.group(1) == 'Nullable'
+        type_name = match.group(2)
+    base = type_name.split('(', 1)[0]
+    return base, nullable
+
+def narrow_dtype(type_name):
+    """
+    Smallest dtype that holds a ClickHouse type: 'uint8' for UInt8, 'UInt32' for
+    Nullable(UInt32), 'category' for LowCardinality strings; None keeps the plan's
+    """
+    base, nullable = parse_clickhouse_type(type_name)
+    if base in NARROW_DTYPES:
+        return base if nullable and column_kind(base) == 'int' else NARROW_DTYPES[base]
+    if column_kind(base) == 'string' and type_name.startswith('LowCardinality'):
+        return 'category'
+    return None
+
+def column_kind(base):
+    if base in INT_TYPES:
+        return 'int'
+    if base in FLOAT_TYPES or base.startswith('Decimal'):
+        return 'float'
+    if base in DATETIME_TYPES:
+        return 'datetime'
+    if base in DATE_TYPES:
+        return 'date'
+    if base in STRING_TYPES:
+        return 'string'
+    return 'passthrough'
+
+class TransformPlan:
+    """Ordered column rules: (name, kind, nullable, present in source)"""
+
+    def __init__(self, schema, source_columns):
+        self.columns = [name for name, _ in schema]
+        self.rules = []
+        self.missing = []
+        self.reported = False  # lets callers warn about missing columns once per plan
+        for name, type_name in schema:
+            base, nullable = parse_clickhouse_type(type_name)
+            present = name in source_columns
+            if not present:
+                self.missing.append(name)
+            self.rules.append((name, column_kind(base), nullable, present))
+        self.narrowing = [(name, narrow_dtype(type_name), column_kind(parse_clickhouse_type(type_name)[0]))
+                          for name, type_name in schema]
+
+    def apply(self, df):
+        """Build the output frame in one pass - one conversion per column"""
+        out = {}
+        for name, kind, nullable, present in self.rules:
+            if present:
+                out[name] = _convert(df[name], kind, nullable)
+            else:
+                out[name] = _default(kind, nullable, df.index)
+        return pd.DataFrame(out, index=df.index)
+
+    def narrow(self, df):
+        """
+        The frame from apply() with each column in its narrowest dtype (see
+        narrow_dtype); plain String columns whose values repeat become categories
+        ClickHouse gets the same bytes - only the batch's memory shrinks
+        """
+        out = {}
+        for name, dtype, kind in self.narrowing:
+            series = df[name]
+            if dtype is None and kind == 'string':
+                sample = series.iloc[:CATEGORY_SAMPLE_ROWS]
+                if len(sample) > 1 and sample.nunique() * 2 <= len(sample):
+                    dtype = 'category'
+            if dtype is not None and series.dtype != dtype:
+                try:
+                    series = series.astype(dtype)
+                except (TypeError, ValueError, OverflowError):
+                    pass  # values out of the type's range - ClickHouse reports them on insert
+            out[name] = series
+        return pd.DataFrame(out, index=df.index)
+
+def _convert(series, kind, nullable):
+    if kind == 'int':
+        values = pd.to_numeric(series, errors='coerce')
+        if nullable:
+            return values.astype('Int64')
+        return values.fillna(0).astype('int64')
+    if kind == 'float':
+        values = pd.to_numeric(series, errors='coerce')
+        if nullable:
+            return values.astype('float64')
+        return values.fillna(0.0).astype('float64')
+    if kind == 'datetime':
+        return pd.to_datetime(series, format='mixed', errors='coerce')
+    if kind == 'date':
+        return pd.to_datetime(series, format='mixed', errors='coerce').dt.normalize()
+    if kind == 'string':
+        if pd.api.types.is_timedelta64_dtype(series):
+            # MySQL TIME: the same text as the columnar path, e.g. '8:00:00'
+            series = pd.Series([None if pd.isna(v) else str(v.to_pytimedelta()) for v in series],
+                               index=series.index, dtype='object')
+        if nullable:
+            return series.where(series.isna(), series.astype(str))
+        return series.fillna('').astype(str)
+    return series
+
+def _default(kind, nullable, index):
+    if kind in ('datetime', 'date'):
+        return pd.Series(pd.NaT, index=index, dtype='datetime64[ns]')
+    if nullable:
+        return pd.Series([None] * len(index), index=index, dtype='object')
+    if kind == 'int':
+        return pd.Series(0, index=index, dtype='int64')
+    if kind == 'float':
+        return pd.Series(0.0, index=index, dtype='float64')
+    if kind == 'string':
+        return pd.Series('', index=index, dtype='object')
+    return pd.Series([None] * len(index), index=index, dtype='object')
+
+def get_transform_plan(schema, source_columns):
+    """Compiled plan for this (ClickHouse schema, source columns) pair, cached"""
+    key = (tuple(schema), tuple(source_columns))
+    with _plan_lock:
+        plan = _plan_cache.get(key)
+        if plan is None:
+            plan = TransformPlan(schema, set(source_columns))
+            _plan_cache[key] = plan
+        return plan
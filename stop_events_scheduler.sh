@@ -6,7 +6,12 @@ cd ~/Desktop/events_etl
 if [ -f scheduler.pid ]; then
     PID=$(cat scheduler.pid)
     if ps -p $PID > /dev/null 2>&1; then
+        # SIGTERM lets the scheduler finish its current batch before exiting
         kill $PID
+        echo "Stopping scheduler (PID: $PID) after the current batch..."
+        while ps -p $PID > /dev/null 2>&1; do
+            sleep 1
+        done
         echo "Scheduler stopped (PID: $PID)"
         rm scheduler.pid
     else